@@ -226,57 +226,22 @@ class Flight:
         """Vérifie si le vol a une trajectoire valide"""
         return len(self.get_trajectory()) > 1
     
-    def to_geopandas(self, transformer=None):
-        """Convertit la trajectoire en GeoDataFrame"""
-        import pyproj
-        from shapely.geometry import Point, LineString
-        
-        trajectory = self.get_trajectory()
-        if len(trajectory) == 0:
-            return None
-            
-        if transformer is None:
-            transformer = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:2154", always_xy=True)
-        
-        # Conversion des coordonnées
-        x_coords, y_coords = transformer.transform(
-            trajectory['longitude'].values, 
-            trajectory['latitude'].values
+    def to_geopandas(self, transformer=None, region=None):
+        """Convertit la trajectoire en GeoDataFrame (points, ligne) en Lambert-93
+
+        Seuls les points dans `region` (région parisienne par défaut) sont gardés.
+        """
+        from adsb_geo import PARIS_REGION, as_region, trajectories_to_geodataframes
+
+        # Projection vectorisée avec le transformer partagé (get_transformer par défaut),
+        # après le préfiltrage lat/lon sur la boîte de la région
+        points_gdf, line_gdf = trajectories_to_geodataframes(
+            self.data, np.zeros(len(self.data), dtype=np.int64), transformer,
+            region=as_region(PARIS_REGION if region is None else region),
         )
-        
-        # Filtrage des valeurs aberrantes (région parisienne)
-        center_x, center_y = 650000, 6860000
-        max_distance = 100000
-        
-        valid_mask = (
-            (abs(x_coords - center_x) <= max_distance) &
-            (abs(y_coords - center_y) <= max_distance)
-        )
-        
-        if not valid_mask.any():
+        if points_gdf is None:
             return None
-            
-        # Créer GeoDataFrame avec points et ligne
-        trajectory_filtered = trajectory[valid_mask].copy()
-        x_filtered = x_coords[valid_mask]
-        y_filtered = y_coords[valid_mask]
-        
-        trajectory_filtered['x_lambert'] = x_filtered
-        trajectory_filtered['y_lambert'] = y_filtered
-        trajectory_filtered['geometry'] = [Point(x, y) for x, y in zip(x_filtered, y_filtered)]
-        
-        gdf = gpd.GeoDataFrame(trajectory_filtered, crs="EPSG:2154")
-        
-        # Ajouter la ligne de trajectoire
-        if len(gdf) > 1:
-            coords = [(row.x_lambert, row.y_lambert) for _, row in gdf.iterrows()]
-            line_gdf = gpd.GeoDataFrame(
-                [{'icao24': self.icao24, 'geometry': LineString(coords)}], 
-                crs="EPSG:2154"
-            )
-            return gdf, line_gdf
-        
-        return gdf, None
+        return points_gdf, line_gdf
 
 
 # Chargement optimisé des données ADS-B
@@ -367,62 +332,29 @@ if takeoff_flights:
 # Visualisation avec l'approche orientée objet
 print("\n=== VISUALISATION DES TRAJECTOIRES ===")
 
-import pyproj
-from shapely.geometry import Point, LineString
+from adsb_geo import PARIS_REGION, as_region, flights_to_geodataframes, get_transformer
 
 # Transformer pour les coordonnées
-transformer = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:2154", always_xy=True)
+transformer = get_transformer()  # Transformer partagé (mémoïsé par couple de CRS)
 
-# Convertir les trajectoires d'atterrissage en GeoDataFrames
-landing_points_list = []
-landing_lines_list = []
+# Région des cartes: les messages hors de sa boîte lat/lon sont écartés avant la
+# projection, puis le test exact est fait en Lambert-93 (boîte ou polygone)
+region = as_region(PARIS_REGION)
 
+# Projection de toutes les trajectoires en un seul appel (points + lignes)
 print("Conversion des atterrissages...")
-for i, flight in enumerate(landing_flights[:50]):  # Limiter à 50 pour performance
-    result = flight.to_geopandas(transformer)
-    if result and result[0] is not None:
-        points_gdf, line_gdf = result
-        landing_points_list.append(points_gdf)
-        if line_gdf is not None:
-            landing_lines_list.append(line_gdf)
-
-# Convertir les trajectoires de décollage en GeoDataFrames
-takeoff_points_list = []
-takeoff_lines_list = []
-
+gdf_landing_points, gdf_landing_lines = flights_to_geodataframes(landing_flights, transformer, region=region)
 print("Conversion des décollages...")
-for i, flight in enumerate(takeoff_flights[:50]):  # Limiter à 50 pour performance
-    result = flight.to_geopandas(transformer)
-    if result and result[0] is not None:
-        points_gdf, line_gdf = result
-        takeoff_points_list.append(points_gdf)
-        if line_gdf is not None:
-            takeoff_lines_list.append(line_gdf)
-
-# Combiner les GeoDataFrames
-if landing_points_list:
-    gdf_landing_points = pd.concat(landing_points_list, ignore_index=True)
-    print(f"Points d'atterrissage: {len(gdf_landing_points)}")
-else:
-    gdf_landing_points = None
-
-if landing_lines_list:
-    gdf_landing_lines = pd.concat(landing_lines_list, ignore_index=True)
-    print(f"Lignes d'atterrissage: {len(gdf_landing_lines)}")
-else:
-    gdf_landing_lines = None
-
-if takeoff_points_list:
-    gdf_takeoff_points = pd.concat(takeoff_points_list, ignore_index=True)
-    print(f"Points de décollage: {len(gdf_takeoff_points)}")
-else:
-    gdf_takeoff_points = None
-
-if takeoff_lines_list:
-    gdf_takeoff_lines = pd.concat(takeoff_lines_list, ignore_index=True)
-    print(f"Lignes de décollage: {len(gdf_takeoff_lines)}")
-else:
-    gdf_takeoff_lines = None
+gdf_takeoff_points, gdf_takeoff_lines = flights_to_geodataframes(takeoff_flights, transformer, region=region)
+
+for label, gdf in [
+    ("Points d'atterrissage", gdf_landing_points),
+    ("Lignes d'atterrissage", gdf_landing_lines),
+    ("Points de décollage", gdf_takeoff_points),
+    ("Lignes de décollage", gdf_takeoff_lines),
+]:
+    if gdf is not None:
+        print(f"{label}: {len(gdf)}")
 
 # %%
 # Carte finale combinée avec approche orientée objet
@@ -584,48 +516,16 @@ if len(trajectoires_decollage) > 0:
 # %%
 # Affichage des trajectoires de décollage sur la carte
 
-# Créer GeoDataFrame des trajectoires de décollage
-trajectoires_decollage_geo = trajectoires_decollage.copy()
-trajectoires_decollage_geo["x_lambert"], trajectoires_decollage_geo["y_lambert"] = transformer.transform(
-    trajectoires_decollage_geo["longitude"].values, trajectoires_decollage_geo["latitude"].values
+# Projection de toutes les trajectoires de décollage en un seul appel (points + lignes)
+gdf_trajectoires_decollage, gdf_lignes_decollage = flights_to_geodataframes(
+    takeoff_flights, transformer, region=region
 )
-
-# Filtrer les valeurs aberrantes (région parisienne en Lambert-93)
-# Orly: environ x=650000, y=6860000
-center_x, center_y = 650000, 6860000
-max_distance = 100000  # 100km maximum depuis le centre
-
-trajectoires_decollage_geo = trajectoires_decollage_geo[
-    (abs(trajectoires_decollage_geo["x_lambert"] - center_x) <= max_distance) &
-    (abs(trajectoires_decollage_geo["y_lambert"] - center_y) <= max_distance)
-].copy()
-
-print(f"Après filtrage des aberrantes: {len(trajectoires_decollage_geo)} points")
-
-# Créer les points en Lambert-93
-trajectoires_decollage_geo["geometry"] = [
-    Point(x, y)
-    for x, y in zip(
-        trajectoires_decollage_geo["x_lambert"], trajectoires_decollage_geo["y_lambert"]
-    )
-]
-gdf_trajectoires_decollage = gpd.GeoDataFrame(
-    trajectoires_decollage_geo, crs="EPSG:2154"
+trajectoires_decollage_geo = (
+    gdf_trajectoires_decollage
+    if gdf_trajectoires_decollage is not None
+    else pd.DataFrame(columns=["latitude", "longitude", "x_lambert", "y_lambert"])
 )
-
-# Créer les lignes de trajectoire pour chaque avion en décollage
-trajectoires_decollage_lignes = []
-for icao24 in icao24_decollages[:50]:  # Premiers 10 avions
-    traj_avion = gdf_trajectoires_decollage[
-        gdf_trajectoires_decollage["icao24"] == icao24
-    ].sort_values("timestamp_dt")
-    if len(traj_avion) > 1:
-        coords = [(row.x_lambert, row.y_lambert) for _, row in traj_avion.iterrows()]
-        trajectoires_decollage_lignes.append(
-            {"icao24": icao24, "geometry": LineString(coords)}
-        )
-
-gdf_lignes_decollage = gpd.GeoDataFrame(trajectoires_decollage_lignes, crs="EPSG:2154")
+print(f"Points de décollage dans la région: {len(trajectoires_decollage_geo)}")
 
 # Nouvelle carte avec trajectoires de décollage
 fig, ax = plt.subplots(figsize=(12, 10))
@@ -640,19 +540,21 @@ gdf_limite_region_departement.plot(
 )
 
 # Trajectoires de décollage en vert
-gdf_trajectoires_decollage.plot(
-    ax=ax, color="green", markersize=2, alpha=0.6, label="Points décollage"
-)
-gdf_lignes_decollage.plot(
-    ax=ax, color="green", linewidth=2, alpha=0.8, label="Trajectoires décollage"
-)
+if gdf_trajectoires_decollage is not None:
+    gdf_trajectoires_decollage.plot(
+        ax=ax, color="green", markersize=2, alpha=0.6, label="Points décollage"
+    )
+if gdf_lignes_decollage is not None:
+    gdf_lignes_decollage.plot(
+        ax=ax, color="green", linewidth=2, alpha=0.8, label="Trajectoires décollage"
+    )
 
 # Diagnostic des coordonnées décollage
 print(
-    f"Décollage - Lat: {trajectoires_decollage['latitude'].min():.4f} à {trajectoires_decollage['latitude'].max():.4f}"
+    f"Décollage - Lat: {trajectoires_decollage_geo['latitude'].min():.4f} à {trajectoires_decollage_geo['latitude'].max():.4f}"
 )
 print(
-    f"Décollage - Lon: {trajectoires_decollage['longitude'].min():.4f} à {trajectoires_decollage['longitude'].max():.4f}"
+    f"Décollage - Lon: {trajectoires_decollage_geo['longitude'].min():.4f} à {trajectoires_decollage_geo['longitude'].max():.4f}"
 )
 
 # Ajuster le zoom selon les données de décollage
@@ -702,6 +604,7 @@ if len(trajectoires_decollage_geo) > 0:
     gdf_trajectoires_decollage.plot(
         ax=ax, color="green", markersize=1, alpha=0.4, label="Points décollage"
     )
+if gdf_lignes_decollage is not None:
     gdf_lignes_decollage.plot(ax=ax, color="green", linewidth=1.5, alpha=0.6, label="Trajectoires décollage")
 
 # Calculer les limites globales pour toutes les trajectoires
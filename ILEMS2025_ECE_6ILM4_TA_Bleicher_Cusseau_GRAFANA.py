@@ -2,10 +2,10 @@
 # Grafana Integration for ADS-B Trajectory Visualization
 # Enhanced version of ILEMS2025_ECE_6ILM4_TA_Bleicher_Cusseau_OO.py with Grafana export capabilities
 
-import gzip
+import asyncio
+import glob
 import json
 import os
-import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
@@ -13,25 +13,50 @@ import geopandas as gpd
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import pyproj
-from shapely.geometry import LineString, Point
 
-# Database imports for Grafana integration
-try:
-    from influxdb_client import InfluxDBClient, Point as InfluxPoint, WritePrecision
-    from influxdb_client.client.write_api import SYNCHRONOUS
-    INFLUXDB_AVAILABLE = True
-except ImportError:
-    INFLUXDB_AVAILABLE = False
-    print("InfluxDB client not available. Install with: pip install influxdb-client")
-
-try:
-    import psycopg2
-    from sqlalchemy import create_engine
-    POSTGRESQL_AVAILABLE = True
-except ImportError:
-    POSTGRESQL_AVAILABLE = False
-    print("PostgreSQL client not available. Install with: pip install psycopg2-binary sqlalchemy")
+from adsb_airports import assign_airports
+from adsb_cache import MessageCache, default_cache
+from adsb_checkpoint import ExportCheckpoint, csv_sink, flight_fingerprint, source_stamp
+from adsb_decoding import decode_cpr_positions, epoch_seconds
+from adsb_dedup import DEFAULT_DEDUP_WINDOW, deduplicate_frames
+from adsb_export import DEFAULT_METADATA_WORKERS, DEFAULT_TIMESERIES_WORKERS, ExportPipeline
+from adsb_flights import (
+    DEFAULT_GAP_THRESHOLD,
+    ColumnStore,
+    FlightIndex,
+    classify_aircraft,
+    segment_flights,
+    summarize_aircraft,
+)
+from adsb_geo import (
+    LAMBERT93,
+    PARIS_REGION,
+    Region,
+    add_lambert_columns,
+    as_region,
+    simplify_trajectory,
+    trajectories_to_geodataframes,
+)
+from adsb_influx import InfluxLineWriter, writer_from_config
+from adsb_ingest import (
+    DEFAULT_BATCH_SIZE,
+    JsonDecoder,
+    iter_jsonl_gz_batches,
+    read_jsonl_gz_many,
+    read_jsonl_gz_typed,
+)
+from adsb_metadata import MetadataBuffer, metadata_sink_from_config
+from adsb_replay import DEFAULT_SPEED, DEFAULT_TICK, GrafanaReplaySink, ReplayEngine, ReplayStream
+from adsb_state import DEFAULT_STALENESS, DEFAULT_STEP, assemble_state_vectors
+from adsb_trajectory import (
+    DEFAULT_MAX_GAP,
+    DEFAULT_RESAMPLE_GAP,
+    DEFAULT_RESAMPLE_STEP,
+    DEFAULT_TOLERANCE,
+    ResampledTrajectories,
+    compression_ratio,
+    resample_trajectories,
+)
 
 # Configuration for Grafana integration
 GRAFANA_CONFIG = {
@@ -39,182 +64,256 @@ GRAFANA_CONFIG = {
         'url': 'http://localhost:8086',
         'token': 'your-influxdb-token',
         'org': 'your-org',
-        'bucket': 'adsb-trajectories'
+        'bucket': 'adsb-trajectories',
+        # Batched asynchronous writes (see adsb_influx.InfluxLineWriter)
+        'writer': {
+            'batch_size': 5000,
+            'flush_interval': 1.0,
+            'max_retries': 5
+        }
     },
     'postgresql': {
         'host': 'localhost',
         'port': 5432,
         'database': 'adsb_db',
         'user': 'postgres',
-        'password': 'your-password'
+        'password': 'your-password',
+        # Pooled connections; metadata go to this SQLite file when PostgreSQL is unreachable
+        'pool_size': 4,
+        'sqlite_fallback': 'adsb_metadata.sqlite'
+    },
+    # Douglas-Peucker simplification of exported trajectories
+    # (tolerance in metres, max_gap in seconds between kept points)
+    'simplification': {
+        'tolerance': DEFAULT_TOLERANCE,
+        'max_gap': DEFAULT_MAX_GAP
     }
 }
 
-# Utility functions from original file
-def iterate_time(data, threshold):
-    """Split data by time gaps larger than threshold seconds"""
-    # Ensure timestamp is datetime type
-    if not pd.api.types.is_datetime64_any_dtype(data['timestamp']):
-        data = data.copy()
-        data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s')
-    
-    idx = np.where(data.timestamp.diff().dt.total_seconds() > threshold)[0]
-    start = 0
-    for stop in idx:
-        yield data.iloc[start:stop]
-        start = stop + 1
-    yield data.iloc[start:]
-
-def iterate_icao24_callsign(data):
-    """Group data by ICAO24 and callsign"""
-    for _, chunk in data.groupby(["icao24", "callsign"]):
-        yield chunk
-
 class GrafanaExporter:
     """Handles data export to Grafana-compatible databases"""
     
     def __init__(self, config: Dict = None):
         self.config = config or GRAFANA_CONFIG
-        self.influx_client = None
-        self.postgres_engine = None
+        self.influx_writer: Optional[InfluxLineWriter] = None
+        self.metadata_sink = None
         
-        if INFLUXDB_AVAILABLE:
-            self._init_influxdb()
-        if POSTGRESQL_AVAILABLE:
-            self._init_postgresql()
+        self._init_influxdb()
+        self._init_postgresql()
     
     def _init_influxdb(self):
-        """Initialize InfluxDB connection"""
+        """Initialize the batched InfluxDB writer (one connection reused for every flight)"""
         try:
-            self.influx_client = InfluxDBClient(
-                url=self.config['influxdb']['url'],
-                token=self.config['influxdb']['token'],
-                org=self.config['influxdb']['org']
-            )
-            print("InfluxDB connection initialized")
+            influx_config = dict(self.config['influxdb'])
+            options = influx_config.pop('writer', {})
+            self.influx_writer = writer_from_config(influx_config, **options)
+            print("InfluxDB writer initialized")
         except Exception as e:
             print(f"Failed to initialize InfluxDB: {e}")
     
     def _init_postgresql(self):
-        """Initialize PostgreSQL connection"""
+        """Initialize the metadata sink (pooled PostgreSQL, or the SQLite fallback)"""
         try:
             pg_config = self.config['postgresql']
-            connection_string = f"postgresql://{pg_config['user']}:{pg_config['password']}@{pg_config['host']}:{pg_config['port']}/{pg_config['database']}"
-            self.postgres_engine = create_engine(connection_string)
-            print("PostgreSQL connection initialized")
+            self.metadata_sink = metadata_sink_from_config(
+                pg_config,
+                sqlite_path=pg_config.get('sqlite_fallback', 'adsb_metadata.sqlite'),
+                pool_size=pg_config.get('pool_size', 4)
+            )
+            print(f"Metadata sink initialized: {self.metadata_sink}")
         except Exception as e:
             print(f"Failed to initialize PostgreSQL: {e}")
     
     def export_trajectory_to_influx(self, flight_data: pd.DataFrame, flight_id: str):
-        """Export trajectory points to InfluxDB for time-series visualization"""
-        if not self.influx_client:
+        """Queue trajectory points for InfluxDB (sent in batches in the background, see flush)"""
+        if not self.influx_writer:
             print("InfluxDB not available")
             return False
         
         try:
-            write_api = self.influx_client.write_api(write_options=SYNCHRONOUS)
-            points = []
-            
-            for _, row in flight_data.iterrows():
-                point = (
-                    InfluxPoint("trajectory")
-                    .tag("flight_id", flight_id)
-                    .tag("icao24", row.get('icao24', ''))
-                    .tag("callsign", row.get('callsign', ''))
-                    .field("latitude", float(row['latitude']))
-                    .field("longitude", float(row['longitude']))
-                    .field("altitude", float(row.get('altitude', 0)))
-                    .field("vertical_rate", float(row.get('vertical_rate', 0)))
-                    .field("ground_speed", float(row.get('ground_speed', 0)))
-                    .time(int(row['timestamp']), WritePrecision.S)
-                )
-                points.append(point)
-            
-            write_api.write(bucket=self.config['influxdb']['bucket'], record=points)
-            print(f"Exported {len(points)} points to InfluxDB for flight {flight_id}")
+            n_points = self.influx_writer.write_trajectory(flight_data, {"flight_id": flight_id})
+            print(f"Queued {n_points} points to InfluxDB for flight {flight_id}")
             return True
             
         except Exception as e:
             print(f"Error exporting to InfluxDB: {e}")
             return False
     
+    def flush(self, timeout: float = None) -> Dict:
+        """Wait until queued InfluxDB points are written; return the writer counters"""
+        if not self.influx_writer:
+            return {}
+        self.influx_writer.flush(timeout)
+        return dict(self.influx_writer.stats)
+    
+    def close(self):
+        """Flush and stop the InfluxDB writer, close the metadata connections"""
+        if self.influx_writer:
+            self.influx_writer.close()
+        if self.metadata_sink:
+            self.metadata_sink.close()
+    
     def export_flight_metadata_to_postgres(self, flight_summary: Dict):
-        """Export flight metadata to PostgreSQL"""
-        if not self.postgres_engine:
+        """Export (upsert) one flight's metadata"""
+        if self.export_metadata_bulk(MetadataBuffer([flight_summary])):
+            print(f"Exported flight metadata for {flight_summary.get('flight_id')}")
+            return True
+        return False
+    
+    def export_metadata_bulk(self, buffer: MetadataBuffer) -> int:
+        """Upsert all buffered summaries at once (COPY + ON CONFLICT); returns the rows written"""
+        if not self.metadata_sink:
             print("PostgreSQL not available")
-            return False
+            return 0
         
         try:
-            df = pd.DataFrame([flight_summary])
-            df.to_sql('flight_metadata', self.postgres_engine, if_exists='append', index=False)
-            print(f"Exported flight metadata for {flight_summary.get('flight_id')}")
-            return True
+            return self.metadata_sink.write(buffer)
             
         except Exception as e:
             print(f"Error exporting to PostgreSQL: {e}")
-            return False
+            return 0
 
 class FlightGrafana:
-    """Enhanced Flight class with Grafana export capabilities"""
+    """Enhanced Flight class with Grafana export capabilities
     
-    def __init__(self, data: pd.DataFrame, exporter: GrafanaExporter = None):
-        self.data = data
+    A flight is a lightweight view: a reference to a shared ColumnStore and
+    the start/stop rows of the flight in it. Columns are read as NumPy
+    slices on demand and `data` builds a DataFrame only when asked for.
+    Derived metrics are computed once (see `metrics`) and refreshed only
+    when the store is invalidated.
+    """
+    
+    __slots__ = ("store", "start", "stop", "exporter", "collection", "_metrics", "_version")
+    
+    def __init__(self, data, exporter: GrafanaExporter = None, start: int = None, stop: int = None,
+                 collection: "FlightCollectionGrafana" = None):
+        if not isinstance(data, ColumnStore):
+            data = ColumnStore(data)
+        self.store = data
+        self.start = 0 if start is None else int(start)
+        self.stop = len(data) if stop is None else int(stop)
         self.exporter = exporter
-        self._trajectory_cache = None
+        # Parent collection, whose region of interest the maps follow
+        self.collection = collection
+        self._metrics = None
+        self._version = None
     
     def __repr__(self):
         return (
             f"FlightGrafana {self.callsign} with aircraft {self.icao24} "
-            f"on {self.min('timestamp'):%Y-%m-%d}"
+            f"on {self.metrics()['start_time']:%Y-%m-%d}"
         )
     
     def __lt__(self, other):
-        return self.min("timestamp") <= other.min("timestamp")
+        return self.metrics()["start_time"] <= other.metrics()["start_time"]
+    
+    def __len__(self):
+        return self.stop - self.start
+    
+    @property
+    def data(self) -> pd.DataFrame:
+        """Messages of this flight as a DataFrame (built on each access)"""
+        return self.store.frame_slice(self.start, self.stop)
+    
+    def column(self, feature) -> np.ndarray:
+        """One column of this flight as a NumPy array (a view of the shared store)"""
+        return self.store.column(feature, self.start, self.stop)
+    
+    def _numeric(self, feature) -> np.ndarray:
+        if feature not in self.store:
+            return np.full(len(self), np.nan)
+        return pd.to_numeric(pd.Series(self.column(feature)), errors='coerce').to_numpy()
+    
+    def metrics(self) -> Dict:
+        """Start/end time, ranges, keys, flight_id and point count, computed in one pass
+        
+        Cached on the flight and recomputed only after `store.invalidate()`
+        or `invalidate()`.
+        """
+        if self._metrics is not None and self._version == self.store.version:
+            return self._metrics
+        
+        timestamps = self.column("timestamp")
+        if not np.issubdtype(timestamps.dtype, np.datetime64):
+            timestamps = pd.to_datetime(timestamps, unit='s').to_numpy()
+        latitude = self._numeric("latitude")
+        longitude = self._numeric("longitude")
+        altitude = self._numeric("altitude")
+        vertical_rate = self._numeric("vertical_rate")
+        # Valid trajectory points in time order, as in get_trajectory
+        valid = ~(np.isnan(latitude) | np.isnan(longitude) | np.isnan(altitude))
+        ordered = np.flatnonzero(valid)
+        ordered = ordered[np.argsort(timestamps[ordered], kind='stable')]
+        first = ordered[0] if len(ordered) else None
+        last = ordered[-1] if len(ordered) else None
+        
+        def first_known(feature):
+            if feature not in self.store:
+                return None
+            known = pd.Series(self.column(feature)).dropna()
+            return known.iloc[0] if len(known) > 0 else None
+        
+        def value_range(values):
+            values = values[~np.isnan(values)]
+            return (values.min(), values.max()) if len(values) else (None, None)
+        
+        metrics = {
+            'icao24': first_known("icao24"),
+            'callsign': first_known("callsign"),
+            'start_time': pd.Timestamp(timestamps.min()),
+            'end_time': pd.Timestamp(timestamps.max()),
+            'altitude_range': value_range(altitude),
+            'vertical_rate_range': value_range(vertical_rate),
+            'total_points': len(ordered),
+            'start_lat': latitude[first] if first is not None else None,
+            'start_lon': longitude[first] if first is not None else None,
+            'end_lat': latitude[last] if last is not None else None,
+            'end_lon': longitude[last] if last is not None else None,
+        }
+        metrics['flight_id'] = (
+            f"{metrics['icao24']}_{metrics['callsign']}_{metrics['start_time']:%Y%m%d_%H%M%S}"
+        )
+        self._metrics = metrics
+        self._version = self.store.version
+        return metrics
+    
+    def invalidate(self):
+        """Drop the cached metrics of this flight"""
+        self._metrics = None
     
     def max(self, feature):
         if feature == "timestamp":
-            # Ensure timestamp is datetime type
-            if not pd.api.types.is_datetime64_any_dtype(self.data[feature]):
-                return pd.to_datetime(self.data[feature], unit='s').max()
-        return self.data[feature].max()
+            return self.metrics()['end_time']
+        return pd.Series(self.column(feature)).max()
 
     def min(self, feature):
         if feature == "timestamp":
-            # Ensure timestamp is datetime type
-            if not pd.api.types.is_datetime64_any_dtype(self.data[feature]):
-                return pd.to_datetime(self.data[feature], unit='s').min()
+            return self.metrics()['start_time']
         # For string features, ensure we get the first non-null value
         if feature in ["callsign", "icao24"]:
-            return self.data[feature].dropna().iloc[0] if len(self.data[feature].dropna()) > 0 else None
-        return self.data[feature].min()
+            return self.metrics()[feature]
+        return pd.Series(self.column(feature)).min()
     
     @property
     def callsign(self):
-        return self.min("callsign")
+        return self.metrics()['callsign']
     
     @property
     def icao24(self):
-        return self.min("icao24")
+        return self.metrics()['icao24']
     
     @property
     def flight_id(self):
         """Generate unique flight ID for Grafana"""
-        start_time = self.min("timestamp").strftime("%Y%m%d_%H%M%S")
-        return f"{self.icao24}_{self.callsign}_{start_time}"
+        return self.metrics()['flight_id']
     
     def altitude_range(self) -> Tuple[Optional[float], Optional[float]]:
         """Return (alt_min, alt_max) for this flight"""
-        alt_data = pd.to_numeric(self.data["altitude"], errors='coerce').dropna()
-        if len(alt_data) == 0:
-            return None, None
-        return alt_data.min(), alt_data.max()
+        return self.metrics()['altitude_range']
     
     def vertical_rate_range(self) -> Tuple[Optional[float], Optional[float]]:
         """Return (vr_min, vr_max) for this flight"""
-        vr_data = pd.to_numeric(self.data["vertical_rate"], errors='coerce').dropna()
-        if len(vr_data) == 0:
-            return None, None
-        return vr_data.min(), vr_data.max()
+        return self.metrics()['vertical_rate_range']
     
     def is_landing(self, ground_altitude_threshold=100, descent_rate_threshold=-1500) -> bool:
         """Determine if flight is a landing"""
@@ -238,299 +337,479 @@ class FlightGrafana:
     
     def get_trajectory(self) -> pd.DataFrame:
         """Return trajectory coordinates with timestamp"""
-        if self._trajectory_cache is not None:
-            return self._trajectory_cache
-        
         # Select available columns, ground_speed is optional
         available_columns = ["latitude", "longitude", "altitude", "timestamp", "vertical_rate"]
-        if "ground_speed" in self.data.columns:
+        if "ground_speed" in self.store:
             available_columns.append("ground_speed")
         
-        trajectory = (
-            self.data[available_columns]
-            .dropna(subset=["latitude", "longitude", "altitude"])
-            .copy()
-        )
+        # Drop points without position/altitude on the NumPy views, then build
+        # the DataFrame once (index = row number within the flight)
+        columns = {col: self.column(col) for col in available_columns}
+        valid = np.ones(len(self), dtype=bool)
+        for col in ["latitude", "longitude", "altitude"]:
+            valid &= pd.notna(columns[col])
+        rows = np.flatnonzero(valid)
+        trajectory = pd.DataFrame({col: values[rows] for col, values in columns.items()}, index=rows)
         
         if len(trajectory) > 0:
             trajectory["timestamp_dt"] = pd.to_datetime(
                 trajectory["timestamp"], unit="s"
             )
-            trajectory = trajectory.sort_values("timestamp_dt")
+            if not trajectory["timestamp_dt"].is_monotonic_increasing:
+                trajectory = trajectory.sort_values("timestamp_dt")
         
-        self._trajectory_cache = trajectory
         return trajectory
     
+    def simplified_trajectory(self, tolerance: float = None, max_gap: float = None) -> pd.DataFrame:
+        """Return the trajectory simplified with Douglas-Peucker (defaults from the simplification config)"""
+        config = (self.exporter.config if self.exporter else GRAFANA_CONFIG).get(
+            'simplification', GRAFANA_CONFIG['simplification']
+        )
+        tolerance = config['tolerance'] if tolerance is None else tolerance
+        max_gap = config['max_gap'] if max_gap is None else max_gap
+        return simplify_trajectory(self.get_trajectory(), tolerance, max_gap)
+    
     def has_valid_trajectory(self) -> bool:
         """Check if flight has valid trajectory"""
-        return len(self.get_trajectory()) > 1
+        return self.metrics()['total_points'] > 1
     
     def get_flight_summary(self) -> Dict:
-        """Generate flight summary for Grafana metadata"""
-        trajectory = self.get_trajectory()
-        alt_min, alt_max = self.altitude_range()
-        vr_min, vr_max = self.vertical_rate_range()
+        """Generate flight summary for Grafana metadata (from the cached metrics)"""
+        metrics = self.metrics()
+        alt_min, alt_max = metrics['altitude_range']
+        vr_min, vr_max = metrics['vertical_rate_range']
         
         return {
-            'flight_id': self.flight_id,
-            'icao24': self.icao24,
-            'callsign': self.callsign,
-            'start_time': self.min("timestamp"),
-            'end_time': self.max("timestamp"),
-            'duration_minutes': (self.max("timestamp") - self.min("timestamp")).total_seconds() / 60,
-            'total_points': len(trajectory),
+            'flight_id': metrics['flight_id'],
+            'icao24': metrics['icao24'],
+            'callsign': metrics['callsign'],
+            'start_time': metrics['start_time'],
+            'end_time': metrics['end_time'],
+            'duration_minutes': (metrics['end_time'] - metrics['start_time']).total_seconds() / 60,
+            'total_points': metrics['total_points'],
             'altitude_min': alt_min,
             'altitude_max': alt_max,
             'vertical_rate_min': vr_min,
             'vertical_rate_max': vr_max,
             'is_landing': self.is_landing(),
             'is_takeoff': self.is_takeoff(),
-            'start_lat': trajectory.iloc[0]['latitude'] if len(trajectory) > 0 else None,
-            'start_lon': trajectory.iloc[0]['longitude'] if len(trajectory) > 0 else None,
-            'end_lat': trajectory.iloc[-1]['latitude'] if len(trajectory) > 0 else None,
-            'end_lon': trajectory.iloc[-1]['longitude'] if len(trajectory) > 0 else None,
+            'start_lat': metrics['start_lat'],
+            'start_lon': metrics['start_lon'],
+            'end_lat': metrics['end_lat'],
+            'end_lon': metrics['end_lon'],
         }
     
-    def export_to_grafana(self) -> bool:
-        """Export flight data to Grafana databases"""
+    def export_to_grafana(self, metadata_buffer: MetadataBuffer = None) -> bool:
+        """Export flight data to Grafana databases
+        
+        With a `metadata_buffer` the summary is appended to it, to be written
+        later with all the other flights (see export_metadata_bulk).
+        """
         if not self.exporter:
             print("No Grafana exporter configured")
             return False
         
-        trajectory = self.get_trajectory()
+        trajectory = self.simplified_trajectory()
         if len(trajectory) == 0:
             print(f"No trajectory data for flight {self.flight_id}")
             return False
         
-        # Export trajectory points to InfluxDB
+        # Export simplified trajectory points to InfluxDB
         influx_success = self.exporter.export_trajectory_to_influx(trajectory, self.flight_id)
         
         # Export metadata to PostgreSQL
         flight_summary = self.get_flight_summary()
+        if metadata_buffer is not None:
+            metadata_buffer.add(flight_summary)
+            return influx_success
         postgres_success = self.exporter.export_flight_metadata_to_postgres(flight_summary)
         
         return influx_success and postgres_success
     
-    def to_geopandas(self, transformer=None):
-        """Convert trajectory to GeoDataFrame (from original implementation)"""
-        trajectory = self.get_trajectory()
-        if len(trajectory) == 0:
-            return None
+    def to_geopandas(self, transformer=None, region=None, tolerance: float = None,
+                     max_gap: float = None):
+        """Convert trajectory to GeoDataFrame (points, line) in Lambert-93, optionally simplified
         
-        if transformer is None:
-            transformer = pyproj.Transformer.from_crs(
-                "EPSG:4326", "EPSG:2154", always_xy=True
-            )
-        
-        # Convert coordinates
-        x_coords, y_coords = transformer.transform(
-            trajectory["longitude"].values, trajectory["latitude"].values
+        Without a `region`, positions are clipped to the region of the parent
+        collection (see FlightCollectionGrafana.set_region), or to
+        PARIS_REGION for a flight built on its own.
+        """
+        if region is None:
+            region = self.collection.region if self.collection is not None else PARIS_REGION
+        points_gdf, line_gdf = trajectories_to_geodataframes(
+            self.data, np.zeros(len(self.data), dtype=np.int64), transformer,
+            region=as_region(region), tolerance=tolerance, max_gap=max_gap
         )
-        
-        # Filter outliers (Paris region)
-        center_x, center_y = 650000, 6860000
-        max_distance = 100000
-        
-        valid_mask = (abs(x_coords - center_x) <= max_distance) & (
-            abs(y_coords - center_y) <= max_distance
-        )
-        
-        if not valid_mask.any():
+        if points_gdf is None:
             return None
-        
-        # Create GeoDataFrame with points and line
-        trajectory_filtered = trajectory[valid_mask].copy()
-        x_filtered = x_coords[valid_mask]
-        y_filtered = y_coords[valid_mask]
-        
-        trajectory_filtered["x_lambert"] = x_filtered
-        trajectory_filtered["y_lambert"] = y_filtered
-        trajectory_filtered["geometry"] = [
-            Point(x, y) for x, y in zip(x_filtered, y_filtered)
-        ]
-        
-        gdf = gpd.GeoDataFrame(trajectory_filtered, crs="EPSG:2154")
-        
-        # Add trajectory line
-        if len(gdf) > 1:
-            coords = [(row.x_lambert, row.y_lambert) for _, row in gdf.iterrows()]
-            line_gdf = gpd.GeoDataFrame(
-                [{"icao24": self.icao24, "geometry": LineString(coords)}],
-                crs="EPSG:2154",
-            )
-            return gdf, line_gdf
-        
-        return gdf, None
+        return points_gdf, line_gdf
 
 class FlightCollectionGrafana:
     """Enhanced FlightCollection with Grafana integration"""
     
-    def __init__(self, data: pd.DataFrame, exporter: GrafanaExporter = None):
+    def __init__(self, data: pd.DataFrame, exporter: GrafanaExporter = None,
+                 gap_threshold: float = DEFAULT_GAP_THRESHOLD, region=PARIS_REGION,
+                 region_crs: str = LAMBERT93):
         self.data = data
         self.exporter = exporter or GrafanaExporter()
+        self.gap_threshold = gap_threshold
+        self._region = as_region(region, region_crs)
+        self._flights = None
+        self._offsets = None
+        self._store = None
+        self._index = None
+        self._summary = None
+        # {path: [size, mtime_ns]} of the files read, for incremental exports
+        self.sources = {}
     
     def __repr__(self):
         return f"FlightCollectionGrafana with {len(self)} flights"
     
+    def _segment(self) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Compute the flight segmentation once (sorted messages + flight offsets)"""
+        if self._offsets is None:
+            self._flights, self._offsets = segment_flights(self.data, self.gap_threshold)
+        return self._flights, self._offsets
+    
+    @property
+    def region(self) -> Optional[Region]:
+        """Region of interest of the maps (None keeps every position)"""
+        return self._region
+    
+    def set_region(self, region, crs: str = LAMBERT93):
+        """Change the region of interest (box or polygon, in Lambert-93 or WGS84)"""
+        self._region = as_region(region, crs)
+        if self._flights is not None:
+            # Cached projections only cover the bounding box of the previous region
+            self._flights = self._flights.drop(columns=["x_lambert", "y_lambert"], errors="ignore")
+            self._store = None
+    
+    def _columns(self) -> ColumnStore:
+        """Shared column store of the segmented table, read by every flight view"""
+        if self._store is None:
+            self._store = ColumnStore(self._segment()[0])
+        return self._store
+    
+    @property
+    def index(self) -> FlightIndex:
+        """Lookup index by icao24, callsign and time window (built once)"""
+        if self._index is None:
+            self._index = FlightIndex(*self._segment())
+        return self._index
+    
+    def subset(self, flight_ids) -> "FlightCollectionGrafana":
+        """Return a collection of the given flights, already segmented"""
+        flights, offsets = self._segment()
+        flight_ids = np.asarray(flight_ids, dtype=np.int64)
+        lengths = offsets[flight_ids + 1] - offsets[flight_ids]
+        rows = np.repeat(offsets[flight_ids] - np.cumsum(lengths) + lengths, lengths)
+        rows += np.arange(lengths.sum())
+        
+        data = flights.iloc[rows].reset_index(drop=True)
+        data["flight_id"] = np.repeat(np.arange(len(flight_ids)), lengths)
+        result = FlightCollectionGrafana(data, self.exporter, self.gap_threshold, self._region)
+        result._flights = data
+        result._offsets = np.append(0, np.cumsum(lengths)).astype(np.int64)
+        result.sources = self.sources
+        return result
+    
+    def flight(self, flight_id: int) -> FlightGrafana:
+        """Return one flight as a view of the sorted message table"""
+        offsets = self._segment()[1]
+        return FlightGrafana(
+            self._columns(), self.exporter, offsets[flight_id], offsets[flight_id + 1], collection=self
+        )
+    
     @classmethod
     def read_json(cls, filename: str, exporter: GrafanaExporter = None):
         """Read JSON file and create collection"""
-        return cls(pd.read_json(filename), exporter)
+        sources = source_stamp([filename])
+        collection = cls(pd.read_json(filename), exporter)
+        collection.sources = sources
+        return collection
     
     @classmethod
-    def read_jsonl_gz(cls, filename: str, exporter: GrafanaExporter = None):
-        """Read compressed JSONL file and create collection"""
-        data = []
-        with gzip.open(filename, "rt", encoding="utf-8", errors="ignore") as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        data.append(json.loads(line))
-                    except json.JSONDecodeError:
-                        continue
-        
-        df = pd.DataFrame(data)
-        
-        # Preprocess timestamp column if it exists
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-        
-        # Convert numeric columns to proper types
-        if 'altitude' in df.columns:
-            df['altitude'] = pd.to_numeric(df['altitude'], errors='coerce')
-        if 'vertical_rate' in df.columns:
-            df['vertical_rate'] = pd.to_numeric(df['vertical_rate'], errors='coerce')
-        
-        return cls(df, exporter)
+    def read_jsonl_gz(cls, filename: str, exporter: GrafanaExporter = None,
+                      batch_size: int = DEFAULT_BATCH_SIZE, include_raw: bool = False,
+                      decoder: JsonDecoder = None, cache: MessageCache = None,
+                      decode_positions: bool = True):
+        """Read compressed JSONL file batch by batch (or from the cache) and create collection"""
+        # Stamped before reading: a file growing meanwhile is seen as changed next time
+        sources = source_stamp([filename])
+        df = read_jsonl_gz_typed(filename, batch_size=batch_size,
+                                 include_raw=include_raw, decoder=decoder, cache=cache)
+        if decode_positions:
+            df = decode_cpr_positions(df)
+        collection = cls(df, exporter)
+        collection.sources = sources
+        return collection
+    
+    @classmethod
+    def iter_jsonl_gz(cls, filename: str, exporter: GrafanaExporter = None,
+                      batch_size: int = DEFAULT_BATCH_SIZE, include_raw: bool = False,
+                      decoder: JsonDecoder = None, decode_positions: bool = True):
+        """Yield one collection per batch of messages (bounded memory)"""
+        for batch in iter_jsonl_gz_batches(filename, batch_size=batch_size,
+                                           include_raw=include_raw, decoder=decoder):
+            if decode_positions:
+                batch = decode_cpr_positions(batch)
+            yield cls(batch, exporter)
+    
+    @classmethod
+    def read_jsonl_gz_many(cls, files, exporter: GrafanaExporter = None,
+                           workers: int = None, include_raw: bool = False,
+                           cache: MessageCache = None, decode_positions: bool = True,
+                           dedup_window: Optional[float] = DEFAULT_DEDUP_WINDOW):
+        """Read several receiver files (glob or list) in parallel into one time-ordered collection
+        
+        Frames received by several antennas within `dedup_window` seconds are
+        kept once (None disables deduplication).
+        """
+        sources = source_stamp(sorted(glob.glob(files)) if isinstance(files, str) else files)
+        df = read_jsonl_gz_many(files, workers=workers, cache=cache,
+                                include_raw=include_raw or dedup_window is not None)
+        if dedup_window is not None:
+            df = deduplicate_frames(df, dedup_window)
+            if not include_raw:
+                df = df.drop(columns=["frame"])
+        if decode_positions:
+            df = decode_cpr_positions(df)
+        collection = cls(df, exporter)
+        collection.sources = sources
+        return collection
+    
+    def to_state_vectors(self, step: float = DEFAULT_STEP,
+                         staleness=DEFAULT_STALENESS) -> "FlightCollectionGrafana":
+        """Return a collection of dense state vectors (one row per aircraft and time step)"""
+        return FlightCollectionGrafana(
+            assemble_state_vectors(self.data, step=step, staleness=staleness),
+            self.exporter, region=self._region
+        )
+    
+    def resample(self, step: float = DEFAULT_RESAMPLE_STEP,
+                 max_gap: float = DEFAULT_RESAMPLE_GAP) -> ResampledTrajectories:
+        """Interpolate every flight onto a regular `step`-second grid (gaps over `max_gap` left NaN)"""
+        return resample_trajectories(*self._segment(), step=step, max_gap=max_gap)
     
     def __iter__(self):
-        for group in iterate_icao24_callsign(self.data):
-            for elt in iterate_time(group, 20000):
-                yield FlightGrafana(elt, self.exporter)
+        store, offsets = self._columns(), self._segment()[1]
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            yield FlightGrafana(store, self.exporter, start, stop, collection=self)
     
     def __len__(self):
-        return sum(1 for _ in self)
+        return len(self._segment()[1]) - 1
     
     def __getitem__(self, key):
         if isinstance(key, str):
-            result = FlightCollectionGrafana(
-                self.data.query("callsign == @key or icao24 == @key"),
-                self.exporter
-            )
-        if isinstance(key, pd.Timestamp):
-            before = key
-            after = key + timedelta(days=1)
-            result = FlightCollectionGrafana(
-                self.data.query("@before < timestamp < @after"),
-                self.exporter
-            )
-        
-        if len(result) == 1:
-            return FlightGrafana(result.data, self.exporter)
+            flight_ids = self.index.lookup(key)
+        elif isinstance(key, pd.Timestamp):
+            flight_ids = self.index.between(key, key + timedelta(days=1))
         else:
-            return result
+            raise TypeError(f"Unsupported key type: {type(key).__name__}")
+        
+        if len(flight_ids) == 1:
+            return self.flight(flight_ids[0])
+        return self.subset(flight_ids)
     
-    def filter_by_icao24_only(self):
-        """Iterate over flights grouped by icao24 only"""
-        for icao24, group in self.data.groupby("icao24"):
-            if len(group) > 1:
-                yield FlightGrafana(group, self.exporter)
+    def aircraft_summary(self) -> pd.DataFrame:
+        """Per-aircraft altitude/vertical rate extremes and valid point counts (computed once)"""
+        if self._summary is None:
+            self._summary = summarize_aircraft(self._segment()[0])
+        return self._summary
     
-    def filter_landings(self) -> List[FlightGrafana]:
+    def classify(self, ground_altitude_threshold=100, descent_rate_threshold=-1500,
+                 climb_rate_threshold=3000) -> pd.DataFrame:
+        """Per-aircraft summary with is_landing/is_takeoff flags for the given thresholds"""
+        return classify_aircraft(
+            self.aircraft_summary(),
+            ground_altitude_threshold=ground_altitude_threshold,
+            descent_rate_threshold=descent_rate_threshold,
+            climb_rate_threshold=climb_rate_threshold,
+        )
+    
+    def _aircraft_flights(self, summary: pd.DataFrame) -> List[FlightGrafana]:
+        """Build the flights (one per aircraft) of the selected summary rows"""
+        store = self._columns()
+        return [
+            FlightGrafana(store, self.exporter, first, stop, collection=self)
+            for first, stop in zip(summary["first_row"], summary["stop_row"])
+        ]
+    
+    def project(self, transformer=None) -> pd.DataFrame:
+        """Add x_lambert/y_lambert to the message table once, shared by every flight view
+        
+        Only positions inside the bounding box of the region are projected.
+        """
+        return add_lambert_columns(self._segment()[0], transformer, self._region)
+    
+    def assign_airports(self, airports: gpd.GeoDataFrame, **options) -> pd.DataFrame:
+        """Per-aircraft summary with departure/arrival aerodromes from the AERODROME layer"""
+        return assign_airports(self.aircraft_summary(), self.project(), airports, **options)
+    
+    def to_geopandas(self, which: str = "all", transformer=None, tolerance: float = None,
+                     max_gap: float = None,
+                     **thresholds) -> Tuple[Optional[gpd.GeoDataFrame], Optional[gpd.GeoDataFrame]]:
+        """Points and lines GeoDataFrames of all, landing or takeoff flights, projected at once
+        
+        With a `tolerance` (metres) trajectories are simplified; the compression
+        ratio is in `points.attrs["compression_ratio"]`.
+        """
+        summary = self.classify(**thresholds)
+        selected = summary["n_messages"] > 1
+        if which == "landings":
+            selected &= summary["is_landing"] & (summary["valid_points"] > 1)
+        elif which == "takeoffs":
+            selected &= summary["is_takeoff"] & (summary["valid_points"] > 1)
+        elif which != "all":
+            raise ValueError(f"which must be 'all', 'landings' or 'takeoffs', not {which!r}")
+        
+        # Rows of the selected aircraft slices, numbered by aircraft
+        first = summary.loc[selected, "first_row"].to_numpy()
+        counts = summary.loc[selected, "n_messages"].to_numpy()
+        group = np.repeat(np.arange(len(first)), counts)
+        rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + first[group]
+        return trajectories_to_geodataframes(
+            self.project(transformer).iloc[rows], group, region=self._region,
+            tolerance=tolerance, max_gap=max_gap
+        )
+    
+    def latest_timestamp(self) -> Optional[float]:
+        """Epoch seconds of the most recent message (None when empty)"""
+        timestamps = epoch_seconds(self._segment()[0]["timestamp"])
+        return float(np.nanmax(timestamps)) if len(timestamps) else None
+    
+    def filter_by_icao24_only(self, since: float = None):
+        """Iterate over flights grouped by icao24 only
+        
+        With `since` (epoch seconds), only aircraft with a message after it.
+        """
+        summary = self.aircraft_summary()
+        selected = summary["n_messages"] > 1
+        if since is not None:
+            # Rows are sorted by time within each aircraft: the last one is the latest
+            timestamps = epoch_seconds(self._segment()[0]["timestamp"])
+            selected &= timestamps[summary["stop_row"].to_numpy() - 1] > since
+        yield from self._aircraft_flights(summary[selected])
+    
+    def filter_landings(self, **thresholds) -> List[FlightGrafana]:
         """Return landing flights"""
-        landings = []
-        for flight in self.filter_by_icao24_only():
-            if flight.is_landing() and flight.has_valid_trajectory():
-                landings.append(flight)
-        return landings
+        summary = self.classify(**thresholds)
+        selected = (summary["n_messages"] > 1) & summary["is_landing"] & (summary["valid_points"] > 1)
+        return self._aircraft_flights(summary[selected])
     
-    def filter_takeoffs(self) -> List[FlightGrafana]:
+    def filter_takeoffs(self, **thresholds) -> List[FlightGrafana]:
         """Return takeoff flights"""
-        takeoffs = []
-        for flight in self.filter_by_icao24_only():
-            if flight.is_takeoff() and flight.has_valid_trajectory():
-                takeoffs.append(flight)
-        return takeoffs
+        summary = self.classify(**thresholds)
+        selected = (summary["n_messages"] > 1) & summary["is_takeoff"] & (summary["valid_points"] > 1)
+        return self._aircraft_flights(summary[selected])
     
-    def get_statistics(self) -> Dict:
+    def get_statistics(self, **thresholds) -> Dict:
         """Return collection statistics"""
-        total_flights = 0
-        landings = 0
-        takeoffs = 0
-        
-        for flight in self.filter_by_icao24_only():
-            total_flights += 1
-            if flight.is_landing():
-                landings += 1
-            if flight.is_takeoff():
-                takeoffs += 1
+        summary = self.classify(**thresholds)
+        summary = summary[summary["n_messages"] > 1]
         
         return {
-            "total_flights": total_flights,
-            "landings": landings,
-            "takeoffs": takeoffs,
+            "total_flights": len(summary),
+            "landings": int(summary["is_landing"].sum()),
+            "takeoffs": int(summary["is_takeoff"].sum()),
         }
     
-    def export_all_to_grafana(self, max_flights: int = None) -> Dict:
-        """Export all flights to Grafana databases"""
-        results = {
-            'exported': 0,
-            'failed': 0,
-            'skipped': 0
-        }
+    def export_all_to_grafana(self, max_flights: int = None,
+                              timeseries_workers: int = DEFAULT_TIMESERIES_WORKERS,
+                              metadata_workers: int = DEFAULT_METADATA_WORKERS,
+                              checkpoint: ExportCheckpoint = None) -> Dict:
+        """Export all flights to Grafana databases through the pipelined exporter
         
-        flights = list(self.filter_by_icao24_only())
-        if max_flights:
-            flights = flights[:max_flights]
+        Trajectories and summaries are built by one producer and written by
+        separate bounded sink stages (see adsb_export.ExportPipeline); the
+        result includes per-sink throughput, latency percentiles and failures.
         
-        print(f"Exporting {len(flights)} flights to Grafana...")
+        With a `checkpoint` the export is incremental: only aircraft with
+        messages after the high-water mark of the source files are read, and
+        of those only new or changed flights are sent. The mark advances
+        when the run is complete (no failure, no `max_flights` cut).
+        """
+        if not self.exporter:
+            print("No Grafana exporter configured")
+            return {'exported': 0, 'failed': 0, 'skipped': 0, 'points': 0, 'points_exported': 0}
         
-        for i, flight in enumerate(flights):
-            if not flight.has_valid_trajectory():
-                results['skipped'] += 1
-                continue
-            
-            try:
-                if flight.export_to_grafana():
-                    results['exported'] += 1
-                else:
-                    results['failed'] += 1
-                
-                if (i + 1) % 10 == 0:
-                    print(f"Processed {i + 1}/{len(flights)} flights")
-                    
-            except Exception as e:
-                print(f"Error exporting flight {flight.flight_id}: {e}")
-                results['failed'] += 1
-        
-        print(f"Export complete: {results['exported']} exported, {results['failed']} failed, {results['skipped']} skipped")
+        state = None
+        since = None
+        if checkpoint is not None:
+            if not self.sources:
+                raise ValueError("Incremental export needs a collection read from files")
+            state = checkpoint.state(self.sources, "grafana")
+            since = state.high_water_mark
+            if since is not None:
+                print(f"Exporting messages after {pd.to_datetime(since, unit='s')} (checkpoint)")
+        
+        print("Exporting flights to Grafana...")
+        pipeline = ExportPipeline(self.exporter, timeseries_workers, metadata_workers)
+        results = pipeline.run(self.filter_by_icao24_only(since), max_flights, state)
+        
+        if state is not None:
+            if not (results['failed'] or results['truncated'] or results.get('influx_points_failed')):
+                state.complete(self.latest_timestamp())
+            checkpoint.save()
+        
+        print(f"Export complete: {results['exported']} exported, {results['failed']} failed, "
+              f"{results['skipped']} skipped, {results['unchanged']} unchanged "
+              f"in {results['elapsed_s']:.2f}s")
+        for error in results['errors']:
+            print(f"  Error exporting {error}")
+        ratio = compression_ratio(results['points'], results['points_exported'])
+        print(f"Simplified {results['points']} points to {results['points_exported']} (ratio {ratio:.1f})")
+        for name, stats in results['sinks'].items():
+            print(f"  {name}: {stats['items']} flights, {stats['units']} rows/points "
+                  f"({stats['units_per_s'] or 0:.0f}/s), p50 {stats['latency_p50_ms'] or 0:.1f} ms, "
+                  f"p99 {stats['latency_p99_ms'] or 0:.1f} ms, {stats['failed']} failed")
+        timeseries = results['sinks']['timeseries']
+        if timeseries.get('delivery_latency_p50_ms') is not None:
+            # The stage above only queues points; these are the writes to InfluxDB
+            print(f"  influx writes: request p50 {timeseries['send_latency_p50_ms']:.1f} ms, "
+                  f"p99 {timeseries['send_latency_p99_ms']:.1f} ms; flight delivery "
+                  f"p50 {timeseries['delivery_latency_p50_ms']:.1f} ms, "
+                  f"p99 {timeseries['delivery_latency_p99_ms']:.1f} ms")
         return results
     
-    def stream_to_grafana(self, interval_seconds: int = 60):
-        """Stream flight data to Grafana in real-time simulation"""
-        print(f"Starting real-time streaming to Grafana (interval: {interval_seconds}s)")
+    def replay_engine(self, speed: float = DEFAULT_SPEED, tick: float = DEFAULT_TICK,
+                      start=None, end=None, sink=None) -> ReplayEngine:
+        """Event-time replay of every valid flight (see adsb_replay.ReplayEngine)
+        
+        The positions of all flights are merged into one time-ordered stream;
+        `sink` defaults to writing to this collection's Grafana databases.
+        """
+        # Aircraft with a valid trajectory, from the per-aircraft summary
+        summary = self.aircraft_summary()
+        flights = self._aircraft_flights(summary[(summary["n_messages"] > 1) & (summary["valid_points"] > 1)])
+        stream = ReplayStream.from_flights(flights)
+        return ReplayEngine(stream, sink or GrafanaReplaySink(self.exporter), speed, tick, start, end)
+    
+    def stream_to_grafana(self, speed: float = DEFAULT_SPEED, tick: float = DEFAULT_TICK,
+                          duration: float = None) -> Dict:
+        """Replay flight data to Grafana in real time, `speed` times faster
         
-        flights = list(self.filter_by_icao24_only())
+        Every `tick` seconds the points of all aircraft from the next
+        `tick * speed` seconds of the capture are written at once, and each
+        flight's metadata when its last point was replayed. Blocks until the
+        end of the capture or for `duration` seconds; from a running event
+        loop (notebook) use `await collection.replay_engine(...).run()`.
+        """
+        if not self.exporter:
+            print("No Grafana exporter configured")
+            return {}
         
-        for flight in flights:
-            if not flight.has_valid_trajectory():
-                continue
-            
-            print(f"Streaming flight {flight.flight_id}")
-            trajectory = flight.get_trajectory()
-            
-            # Stream points one by one to simulate real-time
-            for _, point in trajectory.iterrows():
-                point_df = pd.DataFrame([point])
-                if self.exporter:
-                    self.exporter.export_trajectory_to_influx(point_df, flight.flight_id)
-                
-                time.sleep(interval_seconds / len(trajectory))
-            
-            # Export metadata after trajectory is complete
-            flight_summary = flight.get_flight_summary()
-            if self.exporter:
-                self.exporter.export_flight_metadata_to_postgres(flight_summary)
+        engine = self.replay_engine(speed, tick)
+        print(f"Starting real-time replay to Grafana: {engine}")
+        stats = asyncio.run(engine.run(duration))
+        self.exporter.flush()
+        
+        if stats['ticks']:
+            print(f"Replayed {stats['points']} points and {stats['flights_ended']} flights in "
+                  f"{stats['elapsed_s']:.1f}s (x{stats['effective_speed']:.1f}), "
+                  f"tick lateness p99 {stats['lateness_p99_s'] * 1000:.1f} ms, "
+                  f"{stats['failed_batches']} failed batches")
+        return stats
 
 def create_grafana_dashboard_config() -> Dict:
     """Generate Grafana dashboard configuration JSON"""
@@ -614,46 +893,18 @@ def setup_grafana_databases():
     """Setup database schemas for Grafana integration"""
     print("Setting up Grafana databases...")
     
-    # PostgreSQL schema
-    if POSTGRESQL_AVAILABLE:
-        try:
-            engine = create_engine(f"postgresql://{GRAFANA_CONFIG['postgresql']['user']}:{GRAFANA_CONFIG['postgresql']['password']}@{GRAFANA_CONFIG['postgresql']['host']}:{GRAFANA_CONFIG['postgresql']['port']}/{GRAFANA_CONFIG['postgresql']['database']}")
-            
-            schema_sql = """
-            CREATE TABLE IF NOT EXISTS flight_metadata (
-                flight_id VARCHAR(100) PRIMARY KEY,
-                icao24 VARCHAR(10),
-                callsign VARCHAR(20),
-                start_time TIMESTAMP,
-                end_time TIMESTAMP,
-                duration_minutes FLOAT,
-                total_points INTEGER,
-                altitude_min FLOAT,
-                altitude_max FLOAT,
-                vertical_rate_min FLOAT,
-                vertical_rate_max FLOAT,
-                is_landing BOOLEAN,
-                is_takeoff BOOLEAN,
-                start_lat FLOAT,
-                start_lon FLOAT,
-                end_lat FLOAT,
-                end_lon FLOAT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            
-            CREATE INDEX IF NOT EXISTS idx_flight_start_time ON flight_metadata(start_time);
-            CREATE INDEX IF NOT EXISTS idx_flight_icao24 ON flight_metadata(icao24);
-            CREATE INDEX IF NOT EXISTS idx_flight_callsign ON flight_metadata(callsign);
-            """
-            
-            with engine.connect() as conn:
-                conn.execute(schema_sql)
-                conn.commit()
-            
-            print("PostgreSQL schema created successfully")
-            
-        except Exception as e:
-            print(f"Error setting up PostgreSQL: {e}")
+    # PostgreSQL schema (or the SQLite fallback)
+    try:
+        sink = metadata_sink_from_config(
+            GRAFANA_CONFIG['postgresql'],
+            sqlite_path=GRAFANA_CONFIG['postgresql'].get('sqlite_fallback', 'adsb_metadata.sqlite')
+        )
+        sink.ensure_schema()
+        sink.close()
+        print(f"Metadata schema created successfully ({sink.dialect})")
+        
+    except Exception as e:
+        print(f"Error setting up PostgreSQL: {e}")
     
     # InfluxDB bucket creation would be done through InfluxDB UI or CLI
     print("InfluxDB bucket 'adsb-trajectories' should be created manually")
@@ -673,6 +924,21 @@ def check_data_file_exists():
     
     raise FileNotFoundError(f"ADS-B data file not found. Searched paths: {possible_paths}")
 
+def find_data_files(pattern: str = "*.jsonl.gz") -> List[str]:
+    """Search for all receiver files (orly, montsouris, ...) and return their paths"""
+    possible_dirs = [
+        "adsb25",
+        "TP_FINAL/adsb25",
+        "../TP_FINAL/adsb25",
+    ]
+    
+    for directory in possible_dirs:
+        paths = sorted(glob.glob(os.path.join(directory, pattern)))
+        if paths:
+            return paths
+    
+    raise FileNotFoundError(f"No ADS-B data files matching '{pattern}'. Searched: {possible_dirs}")
+
 # %%
 # Example usage and testing
 if __name__ == "__main__":
@@ -688,7 +954,8 @@ if __name__ == "__main__":
         data_file_path = check_data_file_exists()
         flight_collection = FlightCollectionGrafana.read_jsonl_gz(
             data_file_path, 
-            exporter
+            exporter,
+            cache=default_cache()
         )
         print(f"Loaded collection with {len(flight_collection)} flights")
         
@@ -740,94 +1007,121 @@ if __name__ == "__main__":
 # %%
 # Additional utility functions for Grafana integration
 
-def export_sample_data_csv():
-    """Export sample data to CSV for manual Grafana testing"""
+def trajectories_to_csv(flights, path: str) -> Tuple[int, int]:
+    """Write the simplified trajectories of `flights` to one CSV for Grafana import
+    
+    Returns (rows written, points before simplification).
+    """
+    all_trajectories = []
+    total_points = 0
+    
+    for flight in flights:
+        total_points += flight.metrics()['total_points']
+        trajectory = flight.simplified_trajectory()
+        
+        # Prepare data for Grafana CSV import - select available columns
+        base_columns = ['timestamp_dt', 'latitude', 'longitude', 'altitude', 'vertical_rate']
+        available_columns = [col for col in base_columns if col in trajectory.columns]
+        
+        # Add ground_speed if available
+        if 'ground_speed' in trajectory.columns:
+            available_columns.append('ground_speed')
+        
+        csv_data = trajectory[available_columns].copy()
+        csv_data['flight_id'] = flight.flight_id
+        csv_data['icao24'] = flight.icao24
+        csv_data['callsign'] = flight.callsign
+        
+        all_trajectories.append(csv_data)
+    
+    # Combine all trajectories
+    combined_data = pd.concat(all_trajectories, ignore_index=True)
+    
+    # Round timestamps to seconds (remove nanoseconds for Grafana compatibility)
+    combined_data['timestamp_dt'] = pd.to_datetime(combined_data['timestamp_dt']).dt.floor('s')
+    
+    combined_data.to_csv(path, index=False)
+    return len(combined_data), total_points
+
+def flights_to_csv_incremental(data_file_path: str, select, path: str,
+                               checkpoint: ExportCheckpoint = None) -> Tuple[List, Optional[int], int]:
+    """Read the capture, select flights with `select(collection)` and write their CSV
+    
+    With a `checkpoint` nothing is read when the capture did not change since
+    the last export to `path`, and the CSV (a snapshot read whole by Grafana)
+    is rewritten only when a selected flight is new or changed.
+    Returns (flights, rows written or None if up to date, points before simplification).
+    """
+    state = None
+    if checkpoint is not None:
+        state = checkpoint.state(source_stamp([data_file_path]), csv_sink(path))
+        if state.up_to_date and os.path.exists(path):
+            return [], None, 0
+    
+    flight_collection = FlightCollectionGrafana.read_jsonl_gz(data_file_path, cache=default_cache())
+    flights = select(flight_collection)
+    
+    fingerprints = {flight.flight_id: flight_fingerprint(flight) for flight in flights}
+    unchanged = state is not None and os.path.exists(path) and state.flight_ids <= set(fingerprints) and not any(
+        state.changed(flight_id, fingerprint) for flight_id, fingerprint in fingerprints.items()
+    )
+    if unchanged:
+        n_rows, total_points = None, 0
+    elif not flights:
+        n_rows, total_points = 0, 0
+    else:
+        n_rows, total_points = trajectories_to_csv(flights, path)
+    
+    if state is not None:
+        # Flights no longer selected are not in the rewritten CSV
+        state.forget(state.flight_ids - set(fingerprints))
+        for flight in flights:
+            state.record(flight.flight_id, fingerprints[flight.flight_id],
+                         flight.metrics()['end_time'].value / 1e9)
+        state.complete(flight_collection.latest_timestamp(), prune=False)
+        checkpoint.save()
+    return flights, n_rows, total_points
+
+def export_sample_data_csv(checkpoint: ExportCheckpoint = None):
+    """Export sample data to CSV for manual Grafana testing (incremental with a checkpoint)"""
     print("Exporting sample data to CSV...")
     
     try:
         data_file_path = check_data_file_exists()
-        flight_collection = FlightCollectionGrafana.read_jsonl_gz(data_file_path)
-        landings = flight_collection.filter_landings()
+        landings, n_rows, total_points = flights_to_csv_incremental(
+            data_file_path, FlightCollectionGrafana.filter_landings,
+            'sample_trajectory_for_grafana.csv', checkpoint
+        )
         
-        if landings:
+        if n_rows is None:
+            print("'sample_trajectory_for_grafana.csv' is up to date (no new or changed landing)")
+        elif landings:
             print(f"Found {len(landings)} landing trajectories")
-            
-            # Collect all trajectories
-            all_trajectories = []
-            
-            for flight in landings:
-                trajectory = flight.get_trajectory()
-                
-                # Prepare data for Grafana CSV import - select available columns
-                base_columns = ['timestamp_dt', 'latitude', 'longitude', 'altitude', 'vertical_rate']
-                available_columns = [col for col in base_columns if col in trajectory.columns]
-                
-                # Add ground_speed if available
-                if 'ground_speed' in trajectory.columns:
-                    available_columns.append('ground_speed')
-                
-                csv_data = trajectory[available_columns].copy()
-                csv_data['flight_id'] = flight.flight_id
-                csv_data['icao24'] = flight.icao24
-                csv_data['callsign'] = flight.callsign
-                
-                all_trajectories.append(csv_data)
-            
-            # Combine all trajectories
-            combined_data = pd.concat(all_trajectories, ignore_index=True)
-            
-            # Round timestamps to seconds (remove nanoseconds for Grafana compatibility)
-            combined_data['timestamp_dt'] = pd.to_datetime(combined_data['timestamp_dt']).dt.floor('S')
-            
-            combined_data.to_csv('sample_trajectory_for_grafana.csv', index=False)
             print(f"All {len(landings)} trajectories exported to 'sample_trajectory_for_grafana.csv'")
-            print(f"Total data points: {len(combined_data)}")
+            print(f"Total data points: {n_rows} "
+                  f"(simplified from {total_points}, ratio {compression_ratio(total_points, n_rows):.1f})")
             
     except Exception as e:
         print(f"Error exporting CSV: {e}")
 
-def export_takeoffs_csv():
-    """Export takeoff trajectories to CSV for manual Grafana testing"""
+def export_takeoffs_csv(checkpoint: ExportCheckpoint = None):
+    """Export takeoff trajectories to CSV for manual Grafana testing (incremental with a checkpoint)"""
     print("Exporting takeoff trajectories to CSV...")
     
     try:
         data_file_path = check_data_file_exists()
-        flight_collection = FlightCollectionGrafana.read_jsonl_gz(data_file_path)
-        takeoffs = flight_collection.filter_takeoffs()
+        takeoffs, n_rows, total_points = flights_to_csv_incremental(
+            data_file_path, FlightCollectionGrafana.filter_takeoffs,
+            'takeoffs_trajectory_for_grafana.csv', checkpoint
+        )
         
-        if takeoffs:
+        if n_rows is None:
+            print("'takeoffs_trajectory_for_grafana.csv' is up to date (no new or changed takeoff)")
+        elif takeoffs:
             print(f"Found {len(takeoffs)} takeoff trajectories")
-            
-            # Collect all trajectories
-            all_trajectories = []
-            
-            for flight in takeoffs:
-                trajectory = flight.get_trajectory()
-                
-                # Prepare data for Grafana CSV import - select available columns
-                base_columns = ['timestamp_dt', 'latitude', 'longitude', 'altitude', 'vertical_rate']
-                available_columns = [col for col in base_columns if col in trajectory.columns]
-                
-                # Add ground_speed if available
-                if 'ground_speed' in trajectory.columns:
-                    available_columns.append('ground_speed')
-                
-                csv_data = trajectory[available_columns].copy()
-                csv_data['flight_id'] = flight.flight_id
-                csv_data['icao24'] = flight.icao24
-                csv_data['callsign'] = flight.callsign
-                
-                all_trajectories.append(csv_data)
-            
-            # Combine all trajectories
-            combined_data = pd.concat(all_trajectories, ignore_index=True)
-            
-            # Round timestamps to seconds (remove nanoseconds for Grafana compatibility)
-            combined_data['timestamp_dt'] = pd.to_datetime(combined_data['timestamp_dt']).dt.floor('s')
-            
-            combined_data.to_csv('takeoffs_trajectory_for_grafana.csv', index=False)
             print(f"All {len(takeoffs)} takeoff trajectories exported to 'takeoffs_trajectory_for_grafana.csv'")
-            print(f"Total data points: {len(combined_data)}")
+            print(f"Total data points: {n_rows} "
+                  f"(simplified from {total_points}, ratio {compression_ratio(total_points, n_rows):.1f})")
             
     except Exception as e:
         print(f"Error exporting takeoffs CSV: {e}")
@@ -841,9 +1135,7 @@ def generate_requirements_txt():
         "matplotlib>=3.5.0",
         "pyproj>=3.2.0",
         "shapely>=1.8.0",
-        "influxdb-client>=1.24.0",
-        "psycopg2-binary>=2.9.0",
-        "sqlalchemy>=1.4.0"
+        "psycopg2-binary>=2.9.0"
     ]
     
     with open("requirements_grafana.txt", "w") as f:
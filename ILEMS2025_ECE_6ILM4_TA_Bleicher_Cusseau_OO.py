@@ -1,40 +1,42 @@
 # %%
 # Requirements.txt
-import gzip
-import json
 from datetime import timedelta
 
-import geopandas as gpd
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import pyproj
-from shapely.geometry import LineString, Point
+
+from adsb_airports import assign_airports
+from adsb_basemap import Basemap
+from adsb_cache import default_cache
+from adsb_decoding import decode_cpr_positions
+from adsb_flights import (
+    DEFAULT_GAP_THRESHOLD,
+    ColumnStore,
+    FlightIndex,
+    classify_aircraft,
+    segment_flights,
+    summarize_aircraft,
+)
+from adsb_geo import (
+    add_lambert_columns,
+    flights_to_geodataframes,
+    get_transformer,
+    trajectories_to_geodataframes,
+)
+from adsb_ingest import read_jsonl_gz_typed
+from adsb_trajectory import DEFAULT_MAX_GAP, DEFAULT_TOLERANCE
 
 # Charger les shapefile
 base_path = r"C:\Users\ncuss\Documents\GitHub\pyclass\TP_FINAL\ROUTE500_3-0__SHP_LAMB93_FXX_2021-11-03\ROUTE500\1_DONNEES_LIVRAISON_2022-01-00175\R500_3-0_SHP_LAMB93_FXX-ED211"
-path_to_airport = rf"{base_path}\RESEAU_ROUTIER\AERODROME.shp"
-path_to_route = rf"{base_path}\RESEAU_ROUTIER\TRONCON_ROUTE.shp"
-path_to_admin = rf"{base_path}\ADMINISTRATIF\LIMITE_ADMINISTRATIVE.shp"
-path_to_occupation = rf"{base_path}\HABILLAGE\ZONE_OCCUPATION_SOL.shp"
-
-# Lire shapefiles
-gdf_airport = gpd.read_file(path_to_airport)
-gdf_route = gpd.read_file(path_to_route, encoding="cp1252")
-gdf_limite_admin = gpd.read_file(path_to_admin)
-gdf_occupation = gpd.read_file(path_to_occupation)
-
-# Filtrer les données
-gdf_route = gdf_route.query('CLASS_ADM == "Autoroute"')
-gdf_limite_region_departement = gdf_limite_admin[
-    gdf_limite_admin["NATURE"].isin(["Limite de département", "Limite de région"])
-]
-gdf_airport = gdf_airport[gdf_airport["TOPONYME"].notna()]
-gdf_occupation = gdf_occupation.query('NATURE == "Bâti"')
-
-# Calculer les surfaces avant conversion CRS
-gdf_route["area"] = gdf_route.area
-gdf_airport["area"] = gdf_airport.area
+
+# Lecture par fenêtre (région parisienne) des seules colonnes utiles, filtrée
+# puis mise en cache GeoParquet: les exécutions suivantes ne relisent pas les shapefiles
+basemap = Basemap(base_path)
+gdf_airport = basemap["airport"]
+gdf_route = basemap["route"]
+gdf_limite_region_departement = basemap["admin"].copy()
+gdf_occupation = basemap["occupation"]
 gdf_limite_region_departement["ID_RTE500"] = gdf_limite_region_departement.area
 
 # Centrer sur Paris
@@ -64,102 +66,146 @@ plt.grid()
 plt.show()
 
 
-# Fonctions necessaires pour les classes
-def iterate_time(data, threshold):
-    idx = np.where(data.timestamp.diff().dt.total_seconds() > threshold)[0]
-    start = 0
-    for stop in idx:
-        yield data.iloc[start:stop]
-        start = stop + 1
-    yield data.iloc[start:]
-
-
-def iterate_icao24_callsign(data):
-    for _, chunk in data.groupby(["icao24", "callsign"]):
-        yield chunk
-
-
 # class FlightCollection
 class FlightCollection:
-    def __init__(self, data):
+    def __init__(self, data, gap_threshold=DEFAULT_GAP_THRESHOLD):
         self.data = data
+        self.gap_threshold = gap_threshold
+        self._flights = None
+        self._offsets = None
+        self._store = None
+        self._index = None
+        self._summary = None
 
     def __repr__(self):
         return f"FlightCollection with {len(self)} flights"
 
+    def _segment(self):
+        """Segmentation calculée une seule fois (messages triés + offsets des vols)"""
+        if self._offsets is None:
+            self._flights, self._offsets = segment_flights(self.data, self.gap_threshold)
+        return self._flights, self._offsets
+
+    def _columns(self):
+        """Stockage colonnaire partagé par toutes les vues de vols"""
+        if self._store is None:
+            self._store = ColumnStore(self._segment()[0])
+        return self._store
+
+    @property
+    def index(self):
+        """Index de recherche par icao24, callsign et fenêtre de temps (construit une seule fois)"""
+        if self._index is None:
+            self._index = FlightIndex(*self._segment())
+        return self._index
+
+    def subset(self, flight_ids):
+        """Collection des vols donnés, déjà segmentée"""
+        flights, offsets = self._segment()
+        flight_ids = np.asarray(flight_ids, dtype=np.int64)
+        lengths = offsets[flight_ids + 1] - offsets[flight_ids]
+        rows = np.repeat(offsets[flight_ids] - np.cumsum(lengths) + lengths, lengths)
+        rows += np.arange(lengths.sum())
+
+        data = flights.iloc[rows].reset_index(drop=True)
+        data["flight_id"] = np.repeat(np.arange(len(flight_ids)), lengths)
+        result = FlightCollection(data, self.gap_threshold)
+        result._flights = data
+        result._offsets = np.append(0, np.cumsum(lengths)).astype(np.int64)
+        return result
+
     @classmethod
     def read_json(cls, filename):
         return cls(pd.read_json(filename))
 
     def __iter__(self):
-        for group in iterate_icao24_callsign(self.data):
-            for elt in iterate_time(group, 20000):
-                yield Flight(elt)
+        store, offsets = self._columns(), self._segment()[1]
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            yield Flight(store, start, stop)
 
     def __len__(self):
-        return sum(1 for _ in self)
+        return len(self._segment()[1]) - 1
 
     def __getitem__(self, key):
+        # Recherche par index (table de hachage / recherche binaire) au lieu d'un parcours des messages
         if isinstance(key, str):
-            result = FlightCollection(
-                self.data.query("callsign == @key or icao24 == @key")
-            )
-        if isinstance(key, pd.Timestamp):
-            before = key
-            after = key + timedelta(days=1)
-            result = FlightCollection(self.data.query("@before < timestamp < @after"))
-
-        if len(result) == 1:
-            return Flight(result.data)
+            flight_ids = self.index.lookup(key)
+        elif isinstance(key, pd.Timestamp):
+            flight_ids = self.index.between(key, key + timedelta(days=1))
         else:
-            return result
+            raise TypeError(f"Type de clé non supporté: {type(key).__name__}")
+
+        if len(flight_ids) == 1:
+            offsets = self._segment()[1]
+            return Flight(self._columns(), offsets[flight_ids[0]], offsets[flight_ids[0] + 1])
+        return self.subset(flight_ids)
+
+    def aircraft_summary(self):
+        """Statistiques par avion (altitudes, vitesses verticales, points valides) calculées une seule fois"""
+        if self._summary is None:
+            self._summary = summarize_aircraft(self._segment()[0])
+        return self._summary
+
+    def classify(self, ground_altitude_threshold=100, descent_rate_threshold=-1500, climb_rate_threshold=3000):
+        """Résumé par avion avec les colonnes is_landing/is_takeoff, sans relire les messages"""
+        return classify_aircraft(
+            self.aircraft_summary(),
+            ground_altitude_threshold=ground_altitude_threshold,
+            descent_rate_threshold=descent_rate_threshold,
+            climb_rate_threshold=climb_rate_threshold,
+        )
+
+    def project(self):
+        """Ajoute x_lambert/y_lambert à la table des messages une seule fois (partagé par tous les vols)"""
+        return add_lambert_columns(self._segment()[0])
+
+    def _aircraft_flights(self, summary):
+        store = self._columns()
+        return [
+            Flight(store, first, stop)
+            for first, stop in zip(summary["first_row"], summary["stop_row"])
+        ]
 
     def filter_by_icao24_only(self):
         """Itère sur les vols groupés par icao24 seulement (plus efficace)"""
-        for icao24, group in self.data.groupby("icao24"):
-            if len(group) > 1:  # Au moins 2 points pour une trajectoire
-                yield Flight(group)
+        summary = self.aircraft_summary()
+        yield from self._aircraft_flights(summary[summary["n_messages"] > 1])
 
-    def filter_landings(self):
+    def filter_landings(self, **thresholds):
         """Retourne les vols d'atterrissage"""
-        landings = []
-        for flight in self.filter_by_icao24_only():
-            if flight.is_landing() and flight.has_valid_trajectory():
-                landings.append(flight)
-        return landings
+        summary = self.classify(**thresholds)
+        selected = (summary["n_messages"] > 1) & summary["is_landing"] & (summary["valid_points"] > 1)
+        return self._aircraft_flights(summary[selected])
 
-    def filter_takeoffs(self):
+    def filter_takeoffs(self, **thresholds):
         """Retourne les vols de décollage"""
-        takeoffs = []
-        for flight in self.filter_by_icao24_only():
-            if flight.is_takeoff() and flight.has_valid_trajectory():
-                takeoffs.append(flight)
-        return takeoffs
+        summary = self.classify(**thresholds)
+        selected = (summary["n_messages"] > 1) & summary["is_takeoff"] & (summary["valid_points"] > 1)
+        return self._aircraft_flights(summary[selected])
 
-    def get_statistics(self):
+    def get_statistics(self, **thresholds):
         """Retourne les statistiques de la collection"""
-        total_flights = 0
-        landings = 0
-        takeoffs = 0
-
-        for flight in self.filter_by_icao24_only():
-            total_flights += 1
-            if flight.is_landing():
-                landings += 1
-            if flight.is_takeoff():
-                takeoffs += 1
+        summary = self.classify(**thresholds)
+        summary = summary[summary["n_messages"] > 1]
 
         return {
-            "total_flights": total_flights,
-            "landings": landings,
-            "takeoffs": takeoffs,
+            "total_flights": len(summary),
+            "landings": int(summary["is_landing"].sum()),
+            "takeoffs": int(summary["is_takeoff"].sum()),
         }
 
 
 # Class Flight
 class Flight:
-    def __init__(self, data):
-        self.data = data
+    # Vue légère: référence vers le stockage colonnaire partagé + lignes start:stop
+    __slots__ = ("store", "start", "stop")
+
+    def __init__(self, data, start=None, stop=None):
+        if not isinstance(data, ColumnStore):
+            data = ColumnStore(data)
+        self.store = data
+        self.start = 0 if start is None else int(start)
+        self.stop = len(data) if stop is None else int(stop)
 
     def __repr__(self):
         return (
@@ -170,11 +216,26 @@ class Flight:
     def __lt__(self, other):
         return self.min("timestamp") <= other.min("timestamp")
 
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def data(self):
+        """Messages du vol en DataFrame (construit à chaque accès)"""
+        return self.store.frame_slice(self.start, self.stop)
+
+    def _column(self, feature):
+        # Vue NumPy de la colonne; les catégories (icao24, callsign) deviennent des chaînes
+        column = pd.Series(self.store.column(feature, self.start, self.stop))
+        if column.dtype == object:
+            column = column.dropna().astype(str)
+        return column
+
     def max(self, feature):
-        return self.data[feature].max()
+        return self._column(feature).max()
 
     def min(self, feature):
-        return self.data[feature].min()
+        return self._column(feature).min()
 
     @property
     def callsign(self):
@@ -186,14 +247,14 @@ class Flight:
 
     def altitude_range(self):
         """Retourne (alt_min, alt_max) pour ce vol"""
-        alt_data = self.data["altitude"].dropna()
+        alt_data = self._column("altitude").dropna()
         if len(alt_data) == 0:
             return None, None
         return alt_data.min(), alt_data.max()
 
     def vertical_rate_range(self):
         """Retourne (vr_min, vr_max) pour ce vol"""
-        vr_data = self.data["vertical_rate"].dropna()
+        vr_data = self._column("vertical_rate").dropna()
         if len(vr_data) == 0:
             return None, None
         return vr_data.min(), vr_data.max()
@@ -222,13 +283,10 @@ class Flight:
 
     def get_trajectory(self):
         """Retourne les coordonnées de la trajectoire avec timestamp"""
-        trajectory = (
-            self.data[
-                ["latitude", "longitude", "altitude", "timestamp", "vertical_rate"]
-            ]
-            .dropna(subset=["latitude", "longitude", "altitude"])
-            .copy()
-        )
+        columns = ["latitude", "longitude", "altitude", "timestamp", "vertical_rate"]
+        trajectory = pd.DataFrame(
+            {col: self.store.column(col, self.start, self.stop) for col in columns}
+        ).dropna(subset=["latitude", "longitude", "altitude"])
 
         if len(trajectory) > 0:
             trajectory["timestamp_dt"] = pd.to_datetime(
@@ -243,75 +301,23 @@ class Flight:
         return len(self.get_trajectory()) > 1
 
     def to_geopandas(self, transformer=None):
-        """Convertit la trajectoire en GeoDataFrame"""
-        import pyproj
-        from shapely.geometry import LineString, Point
-
-        trajectory = self.get_trajectory()
-        if len(trajectory) == 0:
-            return None
-
-        if transformer is None:
-            transformer = pyproj.Transformer.from_crs(
-                "EPSG:4326", "EPSG:2154", always_xy=True
-            )
-
-        # Conversion des coordonnées
-        x_coords, y_coords = transformer.transform(
-            trajectory["longitude"].values, trajectory["latitude"].values
+        """Convertit la trajectoire en GeoDataFrame (points, ligne) en Lambert-93"""
+        points_gdf, line_gdf = trajectories_to_geodataframes(
+            self.data, np.zeros(len(self.data), dtype=np.int64), transformer
         )
-
-        # Filtrage des valeurs aberrantes (région parisienne)
-        center_x, center_y = 650000, 6860000
-        max_distance = 100000
-
-        valid_mask = (abs(x_coords - center_x) <= max_distance) & (
-            abs(y_coords - center_y) <= max_distance
-        )
-
-        if not valid_mask.any():
+        if points_gdf is None:
             return None
-
-        # Créer GeoDataFrame avec points et ligne
-        trajectory_filtered = trajectory[valid_mask].copy()
-        x_filtered = x_coords[valid_mask]
-        y_filtered = y_coords[valid_mask]
-
-        trajectory_filtered["x_lambert"] = x_filtered
-        trajectory_filtered["y_lambert"] = y_filtered
-        trajectory_filtered["geometry"] = [
-            Point(x, y) for x, y in zip(x_filtered, y_filtered)
-        ]
-
-        gdf = gpd.GeoDataFrame(trajectory_filtered, crs="EPSG:2154")
-
-        # Ajouter la ligne de trajectoire
-        if len(gdf) > 1:
-            coords = [(row.x_lambert, row.y_lambert) for _, row in gdf.iterrows()]
-            line_gdf = gpd.GeoDataFrame(
-                [{"icao24": self.icao24, "geometry": LineString(coords)}],
-                crs="EPSG:2154",
-            )
-            return gdf, line_gdf
-
-        return gdf, None
+        return points_gdf, line_gdf
 
 
 # %%
 # Chargement optimisé des données ADS-B
 print("\nChargement en cours...")
-data = []
-with gzip.open(
-    "adsb25/orly.jsonl.gz", "rt", encoding="utf-8", errors="ignore"
-) as f:
-    for line in f:
-        if line.strip():
-            try:
-                data.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-# Pensez au cp1252 si pb sur un pc
-df = pd.DataFrame(data)
+# Lecture par lots typés (float32, catégories) pour limiter la mémoire,
+# puis relecture depuis le cache Arrow tant que le fichier ne change pas
+df = read_jsonl_gz_typed("adsb25/orly.jsonl.gz", cache=default_cache())
+# Décodage CPR des positions absentes (paires pair/impair + référence Orly)
+df = decode_cpr_positions(df)
 print(f"Loaded: {df.shape}")
 
 # %%
@@ -350,6 +356,8 @@ print("\nAnalyse orientée objet avec FlightCollection")
 
 # Créer FlightCollection
 flight_collection = FlightCollection(df)
+# Projection Lambert-93 calculée une fois, réutilisée par toutes les cartes
+flight_collection.project()
 
 # Obtenir les statistiques
 stats = flight_collection.get_statistics()
@@ -357,6 +365,16 @@ print(f"Total des vols: {stats['total_flights']}")
 print(f"Atterrissages: {stats['landings']}")
 print(f"Décollages: {stats['takeoffs']}")
 
+# Aérodromes de départ et d'arrivée: jointure spatiale (STRtree) des points
+# à basse altitude avec les polygones de la couche AERODROME, en une requête
+airports = assign_airports(
+    flight_collection.aircraft_summary(), flight_collection.project(), gdf_airport
+)
+print("Départs par aérodrome:")
+print(airports["departure_airport"].value_counts())
+print("Arrivées par aérodrome:")
+print(airports["arrival_airport"].value_counts())
+
 # Extraire les vols d'atterrissage et de décollage
 print("\nExtraction des trajectoires...")
 landing_flights = flight_collection.filter_landings()
@@ -387,58 +405,29 @@ if takeoff_flights:
 print("\nVisualisation orientée objet avec FlightCollection")
 
 # Transformer pour les coordonnées
-transformer = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:2154", always_xy=True)
-
-# Convertir les trajectoires d'atterrissage en GeoDataFrames
-landing_points_list = []
-landing_lines_list = []
+transformer = get_transformer()  # Transformer partagé (mémoïsé par couple de CRS)
 
+# Projection de toutes les trajectoires en un seul appel (points + lignes)
 print("Conversion des atterrissages")
-for i, flight in enumerate(landing_flights):  # Tous les vols d'atterrissage
-    result = flight.to_geopandas(transformer)
-    if result and result[0] is not None:
-        points_gdf, line_gdf = result
-        landing_points_list.append(points_gdf)
-        if line_gdf is not None:
-            landing_lines_list.append(line_gdf)
-
-# Convertir les trajectoires de décollage en GeoDataFrames
-takeoff_points_list = []
-takeoff_lines_list = []
-
+gdf_landing_points, gdf_landing_lines = flights_to_geodataframes(
+    landing_flights, transformer, tolerance=DEFAULT_TOLERANCE, max_gap=DEFAULT_MAX_GAP
+)
 print("Conversion des décollages")
-for i, flight in enumerate(takeoff_flights):  # Tous les vols de décollage
-    result = flight.to_geopandas(transformer)
-    if result and result[0] is not None:
-        points_gdf, line_gdf = result
-        takeoff_points_list.append(points_gdf)
-        if line_gdf is not None:
-            takeoff_lines_list.append(line_gdf)
-
-# Combiner les GeoDataFrames
-if landing_points_list:
-    gdf_landing_points = pd.concat(landing_points_list, ignore_index=True)
-    print(f"Points d'atterrissage: {len(gdf_landing_points)}")
-else:
-    gdf_landing_points = None
-
-if landing_lines_list:
-    gdf_landing_lines = pd.concat(landing_lines_list, ignore_index=True)
-    print(f"Lignes d'atterrissage: {len(gdf_landing_lines)}")
-else:
-    gdf_landing_lines = None
-
-if takeoff_points_list:
-    gdf_takeoff_points = pd.concat(takeoff_points_list, ignore_index=True)
-    print(f"Points de décollage: {len(gdf_takeoff_points)}")
-else:
-    gdf_takeoff_points = None
-
-if takeoff_lines_list:
-    gdf_takeoff_lines = pd.concat(takeoff_lines_list, ignore_index=True)
-    print(f"Lignes de décollage: {len(gdf_takeoff_lines)}")
-else:
-    gdf_takeoff_lines = None
+gdf_takeoff_points, gdf_takeoff_lines = flights_to_geodataframes(
+    takeoff_flights, transformer, tolerance=DEFAULT_TOLERANCE, max_gap=DEFAULT_MAX_GAP
+)
+
+for label, gdf in [
+    ("Points d'atterrissage", gdf_landing_points),
+    ("Lignes d'atterrissage", gdf_landing_lines),
+    ("Points de décollage", gdf_takeoff_points),
+    ("Lignes de décollage", gdf_takeoff_lines),
+]:
+    if gdf is not None:
+        print(f"{label}: {len(gdf)}")
+for label, gdf in [("atterrissages", gdf_landing_points), ("décollages", gdf_takeoff_points)]:
+    if gdf is not None:
+        print(f"Simplification des {label}: ratio {gdf.attrs['compression_ratio']:.1f}")
 
 # %%
 # Carte finale combinée avec approche orientée objet
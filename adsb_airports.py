@@ -0,0 +1,109 @@
+# %%
+# Departure and arrival aerodromes of the flights
+# Low-altitude trajectory points are matched to the nearest aerodrome polygon
+# of the IGN AERODROME layer with one bulk STRtree query over all points.
+
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# Points at or below this altitude (ft) are matched to an aerodrome
+DEFAULT_AIRPORT_ALTITUDE = 1500
+# Maximum distance (m, Lambert-93) between a point and its aerodrome
+DEFAULT_AIRPORT_DISTANCE = 3000
+
+
+def nearest_airport(x, y, airports: gpd.GeoDataFrame, max_distance: float = DEFAULT_AIRPORT_DISTANCE) -> np.ndarray:
+    """Position in `airports` of the nearest aerodrome of each point, -1 if none within `max_distance`
+
+    Points inside an aerodrome polygon are at distance 0 from it. All points
+    are queried at once against an STRtree of the aerodrome geometries.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    result = np.full(len(x), -1, dtype=np.int64)
+    located = ~(np.isnan(x) | np.isnan(y))
+    if not located.any() or len(airports) == 0:
+        return result
+
+    tree = shapely.STRtree(airports.geometry.values)
+    points = shapely.points(x[located], y[located])
+    point_idx, airport_idx = tree.query_nearest(points, max_distance=max_distance, all_matches=False)
+    rows = np.flatnonzero(located)
+    result[rows[point_idx]] = airport_idx
+    return result
+
+
+def airports_by_group(
+    data: pd.DataFrame,
+    group: np.ndarray,
+    airports: gpd.GeoDataFrame,
+    name_column: str = "TOPONYME",
+    altitude_threshold: float = DEFAULT_AIRPORT_ALTITUDE,
+    max_distance: float = DEFAULT_AIRPORT_DISTANCE,
+) -> pd.DataFrame:
+    """Departure and arrival aerodrome of each group (flight) of a time-sorted table
+
+    `data` needs `x_lambert`, `y_lambert` and `altitude`. The departure is
+    the aerodrome of the first matched low-altitude point when it comes
+    before the highest point of the flight, the arrival that of the last
+    matched point when it comes after it. Returns one row per group with
+    `departure_airport` and `arrival_airport` (None when not found).
+    """
+    group = np.asarray(group)
+    groups = pd.unique(group)
+    result = pd.DataFrame(
+        {"departure_airport": None, "arrival_airport": None}, index=pd.Index(groups, name="group")
+    )
+    if len(data) == 0:
+        return result
+
+    altitude = pd.to_numeric(data["altitude"], errors="coerce").to_numpy(np.float64)
+    low = np.flatnonzero(altitude <= altitude_threshold)
+    matched = np.full(len(data), -1, dtype=np.int64)
+    matched[low] = nearest_airport(
+        data["x_lambert"].to_numpy()[low], data["y_lambert"].to_numpy()[low], airports, max_distance
+    )
+
+    rows = pd.Series(np.arange(len(data)))
+    known = ~np.isnan(altitude)
+    peak = pd.Series(altitude[known], index=np.flatnonzero(known)).groupby(group[known]).idxmax()
+    hits = matched >= 0
+    first = rows[hits].groupby(group[hits]).min()
+    last = rows[hits].groupby(group[hits]).max()
+
+    names = airports[name_column].to_numpy() if name_column in airports.columns else np.arange(len(airports))
+    peak_first = peak.reindex(first.index)
+    peak_last = peak.reindex(last.index)
+    departure = first[~(first > peak_first)]
+    arrival = last[~(last < peak_last)]
+    result.loc[departure.index, "departure_airport"] = names[matched[departure.to_numpy()]]
+    result.loc[arrival.index, "arrival_airport"] = names[matched[arrival.to_numpy()]]
+    return result
+
+
+def assign_airports(
+    summary: pd.DataFrame,
+    flights: pd.DataFrame,
+    airports: Optional[gpd.GeoDataFrame],
+    **options,
+) -> pd.DataFrame:
+    """Add departure/arrival aerodrome columns to the per-aircraft summary of `flights`
+
+    `summary` is the output of `summarize_aircraft(flights)`, `flights` the
+    projected table (see `add_lambert_columns`).
+    """
+    result = summary.copy()
+    if airports is None or len(summary) == 0:
+        result["departure_airport"] = None
+        result["arrival_airport"] = None
+        return result
+
+    group = np.repeat(np.arange(len(summary)), summary["n_messages"].to_numpy())
+    found = airports_by_group(flights, group, airports, **options)
+    result["departure_airport"] = found["departure_airport"].to_numpy()
+    result["arrival_airport"] = found["arrival_airport"].to_numpy()
+    return result
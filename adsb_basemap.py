@@ -0,0 +1,139 @@
+# %%
+# IGN ROUTE500 basemap layers clipped to the map window
+# Each layer is read lazily with a bounding-box read of the shapefile (only
+# the features intersecting the window) and only the needed columns, then
+# filtered and stored as GeoParquet so later map renders skip the shapefiles.
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+import geopandas as gpd
+
+from adsb_cache import DEFAULT_CACHE_DIR, PYARROW_AVAILABLE
+from adsb_geo import PARIS_REGION
+
+# Layers used by the maps: shapefile (relative to the ROUTE500 delivery
+# folder), attribute columns to read and values kept for each column
+BASEMAP_LAYERS = {
+    "route": {
+        "path": os.path.join("RESEAU_ROUTIER", "TRONCON_ROUTE.shp"),
+        "columns": ["CLASS_ADM"],
+        "keep": {"CLASS_ADM": ["Autoroute"]},
+        "encoding": "cp1252",
+    },
+    "airport": {
+        "path": os.path.join("RESEAU_ROUTIER", "AERODROME.shp"),
+        "columns": ["TOPONYME"],
+        "keep": {},
+        "notna": ["TOPONYME"],
+    },
+    "admin": {
+        "path": os.path.join("ADMINISTRATIF", "LIMITE_ADMINISTRATIVE.shp"),
+        "columns": ["NATURE"],
+        "keep": {"NATURE": ["Limite de département", "Limite de région"]},
+    },
+    "occupation": {
+        "path": os.path.join("HABILLAGE", "ZONE_OCCUPATION_SOL.shp"),
+        "columns": ["NATURE"],
+        "keep": {"NATURE": ["Bâti"]},
+    },
+}
+
+BASEMAP_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "basemap")
+
+
+def _shapefile_stamp(path: str) -> Dict:
+    """mtime and size of a shapefile and its sidecar files, to detect changes"""
+    stem, _ = os.path.splitext(path)
+    stamp = {}
+    for ext in (".shp", ".dbf", ".shx", ".prj", ".cpg"):
+        if os.path.exists(stem + ext):
+            stat = os.stat(stem + ext)
+            stamp[ext] = [stat.st_mtime_ns, stat.st_size]
+    return stamp
+
+
+class Basemap:
+    """Lazy, cached ROUTE500 layers for one Lambert-93 window
+
+    `window` is (xmin, ymin, xmax, ymax) in Lambert-93, the Paris region
+    by default. Layers are loaded on first access (`basemap["route"]` or
+    `basemap.layer("route")`) and cached as GeoParquet files keyed by the
+    shapefile, the window and the filter, so a change of any of them
+    reads the shapefile again.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        window: Optional[Tuple[float, float, float, float]] = None,
+        layers: Optional[Dict] = None,
+        cache_dir: Optional[str] = BASEMAP_CACHE_DIR,
+    ):
+        self.base_path = base_path
+        self.window = tuple(window) if window is not None else PARIS_REGION.geometry.bounds
+        self.layers = layers or BASEMAP_LAYERS
+        self.cache_dir = cache_dir if PYARROW_AVAILABLE else None
+        self._loaded: Dict[str, gpd.GeoDataFrame] = {}
+
+    def __repr__(self):
+        loaded = ", ".join(self._loaded) or "none"
+        return f"Basemap {self.base_path} window {self.window}, loaded layers: {loaded}"
+
+    def __getitem__(self, name: str) -> gpd.GeoDataFrame:
+        return self.layer(name)
+
+    def _cache_path(self, name: str, path: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        key = json.dumps(
+            {
+                "source": os.path.abspath(path),
+                "stamp": _shapefile_stamp(path),
+                "window": self.window,
+                "layer": self.layers[name],
+            },
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}_{digest}.parquet")
+
+    def _read(self, name: str, path: str) -> gpd.GeoDataFrame:
+        """Bounding-box read of the needed columns, then attribute filter"""
+        spec = self.layers[name]
+        kwargs = {"bbox": self.window, "columns": spec.get("columns", [])}
+        if spec.get("encoding"):
+            kwargs["encoding"] = spec["encoding"]
+        gdf = gpd.read_file(path, **kwargs)
+        for column, values in spec.get("keep", {}).items():
+            gdf = gdf[gdf[column].isin(values)]
+        for column in spec.get("notna", []):
+            gdf = gdf[gdf[column].notna()]
+        gdf = gdf.reset_index(drop=True)
+        gdf["area"] = gdf.area
+        return gdf
+
+    def layer(self, name: str) -> gpd.GeoDataFrame:
+        """Return one layer, from memory, the GeoParquet cache or the shapefile"""
+        if name in self._loaded:
+            return self._loaded[name]
+
+        path = os.path.join(self.base_path, self.layers[name]["path"])
+        cache_path = self._cache_path(name, path)
+        if cache_path and os.path.exists(cache_path):
+            gdf = gpd.read_parquet(cache_path)
+        else:
+            gdf = self._read(name, path)
+            if cache_path:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                gdf.to_parquet(cache_path + ".tmp")
+                os.replace(cache_path + ".tmp", cache_path)
+
+        self._loaded[name] = gdf
+        return gdf
+
+    def load(self, names: Sequence[str] = None) -> Dict[str, gpd.GeoDataFrame]:
+        """Load several layers (all by default)"""
+        return {name: self.layer(name) for name in (names or self.layers)}
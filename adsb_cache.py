@@ -0,0 +1,184 @@
+# %%
+# Columnar on-disk cache of parsed ADS-B messages
+# The typed DataFrame of each capture is written once as an uncompressed Arrow
+# IPC (Feather v2) file, then memory-mapped by later runs instead of
+# decompressing and re-parsing the JSONL.gz source.
+
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+    print("pyarrow not available, ADS-B cache disabled. Install with: pip install pyarrow")
+
+DEFAULT_CACHE_DIR = ".adsb_cache"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MessageCache:
+    """LRU cache of typed message tables keyed by source file and loader options
+
+    An entry is valid while the source keeps the same mtime and size; when
+    they change the source is re-hashed and the entry survives only if the
+    content is identical. The total size of the cache files is kept under
+    `max_bytes` by evicting the least recently used entries.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self._index = self._read_index()
+
+    def __repr__(self):
+        return (
+            f"MessageCache {self.cache_dir} with {len(self._index)} entries, "
+            f"{self.total_bytes() / 1e6:.1f}/{self.max_bytes / 1e6:.0f} MB"
+        )
+
+    def _read_index(self) -> Dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cache index {self.index_path}: {e}")
+            return {}
+
+    def _write_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _key(source: str, variant: str) -> str:
+        return f"{os.path.abspath(source)}|{variant}"
+
+    def _remove(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        try:
+            os.remove(os.path.join(self.cache_dir, entry["file"]))
+        except FileNotFoundError:
+            pass
+
+    def total_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self._index.values())
+
+    def _is_valid(self, entry: Dict, source: str) -> bool:
+        """Check an entry against the source stat, re-hashing only if the stat changed"""
+        stat = os.stat(source)
+        if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return True
+        if entry["size"] != stat.st_size or entry["sha256"] != file_digest(source):
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def get(self, source: str, variant: str = "") -> Optional[pd.DataFrame]:
+        """Return the cached table for `source`, or None on a miss"""
+        if not PYARROW_AVAILABLE:
+            return None
+
+        key = self._key(source, variant)
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+
+        cache_path = os.path.join(self.cache_dir, entry["file"])
+        if not os.path.exists(cache_path) or not self._is_valid(entry, source):
+            self._remove(key)
+            self._write_index()
+            return None
+
+        df = feather.read_table(cache_path, memory_map=True).to_pandas()
+        entry["last_access"] = time.time()
+        self._write_index()
+        return df
+
+    def put(self, source: str, df: pd.DataFrame, variant: str = "") -> bool:
+        """Store the typed table parsed from `source`, then evict old entries"""
+        if not PYARROW_AVAILABLE:
+            return False
+
+        key = self._key(source, variant)
+        self._remove(key)
+
+        stat = os.stat(source)
+        sha256 = file_digest(source)
+        key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        filename = f"{key_hash}_{sha256[:16]}.arrow"
+        cache_path = os.path.join(self.cache_dir, filename)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            feather.write_feather(df, cache_path + ".tmp", compression="uncompressed")
+            os.replace(cache_path + ".tmp", cache_path)
+        except Exception as e:
+            print(f"Could not cache {source}: {e}")
+            return False
+
+        self._index[key] = {
+            "source": os.path.abspath(source),
+            "variant": variant,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": sha256,
+            "file": filename,
+            "bytes": os.path.getsize(cache_path),
+            "last_access": time.time(),
+        }
+        self.evict()
+        self._write_index()
+        return True
+
+    def load(self, source: str, loader: Callable[[], pd.DataFrame], variant: str = "") -> pd.DataFrame:
+        """Return the cached table for `source`, calling `loader` and caching on a miss"""
+        df = self.get(source, variant)
+        if df is None:
+            df = loader()
+            self.put(source, df, variant)
+        return df
+
+    def invalidate(self, source: str = None):
+        """Drop the entries of one source, or the whole cache"""
+        source = os.path.abspath(source) if source else None
+        for key in [k for k, e in self._index.items() if source in (None, e["source"])]:
+            self._remove(key)
+        self._write_index()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        by_access = sorted(self._index.items(), key=lambda item: item[1]["last_access"])
+        total = self.total_bytes()
+        for key, entry in by_access:
+            if total <= self.max_bytes:
+                break
+            total -= entry["bytes"]
+            self._remove(key)
+
+
+def default_cache() -> Optional[MessageCache]:
+    """Return a cache in DEFAULT_CACHE_DIR, or None when pyarrow is missing"""
+    return MessageCache() if PYARROW_AVAILABLE else None
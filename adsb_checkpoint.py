@@ -0,0 +1,157 @@
+# %%
+# Incremental export checkpoints
+# For each (sink, source files) pair a JSON checkpoint keeps the high-water
+# mark (latest message timestamp covered by the last complete export), the
+# size and mtime of the source files at that time, and a fingerprint and last
+# exported timestamp per flight. Later runs skip unchanged sources, read only
+# aircraft with messages past the mark, and resend only new or changed flights.
+
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from adsb_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(DEFAULT_CACHE_DIR, "export_checkpoint.json")
+# Flights that ended this long (s) before the high-water mark are forgotten;
+# new messages for them are then exported as a new flight entry
+DEFAULT_RETENTION = 24 * 3600
+
+
+def source_stamp(files: Iterable[str]) -> Dict[str, list]:
+    """{absolute path: [size, mtime_ns]} of the source files"""
+    stamp = {}
+    for path in files:
+        stat = os.stat(path)
+        stamp[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns]
+    return stamp
+
+
+def csv_sink(path: str) -> str:
+    """Checkpoint sink name of a CSV export"""
+    return "csv:" + os.path.abspath(path)
+
+
+def flight_fingerprint(flight) -> str:
+    """Changes whenever a flight gains messages (count, valid points, last timestamp)"""
+    metrics = flight.metrics()
+    return f"{len(flight)}/{metrics['total_points']}/{metrics['end_time'].value}"
+
+
+class SourceCheckpoint:
+    """Export state of one sink for one set of source files
+
+    Wraps an entry of ExportCheckpoint; changes are persisted by
+    `ExportCheckpoint.save()`. If a source file shrank since the last run
+    (replaced or rotated capture) the state starts over.
+    """
+
+    def __init__(self, entry: Dict, sources: Dict[str, list], retention: float = DEFAULT_RETENTION):
+        self.entry = entry
+        self.sources = sources
+        self.retention = retention
+        previous = entry.get("sources", {})
+        if any(path in previous and size < previous[path][0] for path, (size, _) in sources.items()):
+            entry.clear()
+        entry.setdefault("high_water_mark", None)
+        entry.setdefault("sources", {})
+        entry.setdefault("flights", {})
+
+    def __repr__(self):
+        return f"SourceCheckpoint at {self.high_water_mark} with {len(self.entry['flights'])} flights"
+
+    @property
+    def high_water_mark(self) -> Optional[float]:
+        """Epoch seconds of the latest message covered by the last complete export"""
+        return self.entry["high_water_mark"]
+
+    @property
+    def up_to_date(self) -> bool:
+        """True when the last export was complete and no source file changed since"""
+        return self.high_water_mark is not None and self.entry["sources"] == self.sources
+
+    @property
+    def flight_ids(self) -> set:
+        """Ids of the flights recorded as exported"""
+        return set(self.entry["flights"])
+
+    def changed(self, flight_id: str, fingerprint: str) -> bool:
+        """True for a flight never exported or with a different fingerprint"""
+        previous = self.entry["flights"].get(flight_id)
+        return previous is None or previous[0] != fingerprint
+
+    def exported_until(self, flight_id: str) -> Optional[float]:
+        """Epoch seconds of the last point already exported for the flight"""
+        previous = self.entry["flights"].get(flight_id)
+        return previous[1] if previous else None
+
+    def record(self, flight_id: str, fingerprint: str, end: float):
+        self.entry["flights"][flight_id] = [fingerprint, end]
+
+    def forget(self, flight_ids: Iterable[str]):
+        for flight_id in flight_ids:
+            self.entry["flights"].pop(flight_id, None)
+
+    def complete(self, high_water_mark: Optional[float], prune: bool = True):
+        """Mark every message up to `high_water_mark` as exported
+
+        With `prune`, flights older than the retention are dropped; snapshot
+        sinks that compare the whole selection keep them.
+        """
+        if high_water_mark is None:
+            return
+        self.entry["high_water_mark"] = high_water_mark
+        self.entry["sources"] = self.sources
+        self.entry["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        if not prune:
+            return
+        horizon = high_water_mark - self.retention
+        self.entry["flights"] = {
+            flight_id: value for flight_id, value in self.entry["flights"].items() if value[1] >= horizon
+        }
+
+
+class ExportCheckpoint:
+    """Checkpoints of every sink and source, in one JSON file written atomically"""
+
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH, retention: float = DEFAULT_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._entries = self._read()
+
+    def __repr__(self):
+        return f"ExportCheckpoint {self.path} ({len(self._entries)} entries)"
+
+    def _read(self) -> Dict:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                print(f"Unreadable checkpoint {self.path}, starting a full export")
+        return {}
+
+    @staticmethod
+    def _key(sink: str, sources: Dict[str, list]) -> str:
+        return sink + "|" + "|".join(sorted(sources))
+
+    def state(self, sources: Dict[str, list], sink: str = "grafana") -> SourceCheckpoint:
+        """Checkpoint of `sink` for the source files stamped by `source_stamp`"""
+        entry = self._entries.setdefault(self._key(sink, sources), {})
+        return SourceCheckpoint(entry, sources, self.retention)
+
+    def reset(self, sink: str = None):
+        """Forget the checkpoints of `sink` (or all of them) so its next export is complete"""
+        for key in list(self._entries):
+            if sink is None or key.startswith(sink + "|"):
+                del self._entries[key]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,201 @@
+# %%
+# Decoding of raw ADS-B message fields
+# Airborne position messages (DF17, TC 9-18) only carry CPR-encoded
+# coordinates; this module turns them into latitude/longitude in bulk.
+
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# Paris-Orly (LFPO) aerodrome reference point, used for local CPR decoding
+ORLY_POSITION = (48.7233, 2.3794)
+
+# Number of latitude zones and resolution of airborne CPR coordinates
+CPR_NZ = 15
+CPR_SCALE = 2.0 ** 17
+
+# Local decoding is unambiguous within half a latitude zone (180 NM) of the
+# reference, so the reference must be recent or the receiver itself:
+# previous fixes older than this (s) are not used as reference
+MAX_REFERENCE_AGE = 180.0
+# Range (NM) of the receiver, below those 180 NM, for fixes decoded against it
+RECEIVER_RANGE_NM = 150.0
+# Fastest plausible ground speed (kt) from the previous fix, plus the
+# position error (NM) tolerated on top of it
+MAX_GROUND_SPEED_KT = 800.0
+POSITION_TOLERANCE_NM = 1.0
+
+
+def cpr_nl(lat) -> np.ndarray:
+    """Number of longitude zones at each latitude (vectorized NL function)"""
+    lat = np.abs(np.asarray(lat, dtype=np.float64))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        a = 1 - np.cos(np.pi / (2 * CPR_NZ))
+        b = np.cos(np.radians(lat)) ** 2
+        nl = np.floor(2 * np.pi / np.arccos(1 - a / b))
+    nl = np.where(lat == 0, 59, nl)
+    nl = np.where(lat == 87, 2, nl)
+    return np.where(lat > 87, 1, nl)
+
+
+def cpr_global(lat_even, lon_even, lat_odd, lon_odd, odd_is_latest) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Globally decode even/odd pairs of normalized CPR coordinates
+
+    Returns (latitude, longitude, valid); pairs straddling a latitude zone
+    boundary are flagged invalid.
+    """
+    j = np.floor(59 * lat_even - 60 * lat_odd + 0.5)
+    lat_e = 360.0 / 60 * (np.mod(j, 60) + lat_even)
+    lat_o = 360.0 / 59 * (np.mod(j, 59) + lat_odd)
+    lat_e = np.where(lat_e >= 270, lat_e - 360, lat_e)
+    lat_o = np.where(lat_o >= 270, lat_o - 360, lat_o)
+
+    nl = cpr_nl(lat_e)
+    valid = (nl == cpr_nl(lat_o)) & (np.abs(lat_e) <= 90) & (np.abs(lat_o) <= 90)
+
+    lat = np.where(odd_is_latest, lat_o, lat_e)
+    ni = np.where(odd_is_latest, np.maximum(nl - 1, 1), np.maximum(nl, 1))
+    m = np.floor(lon_even * (nl - 1) - lon_odd * nl + 0.5)
+    lon_cpr = np.where(odd_is_latest, lon_odd, lon_even)
+    lon = 360.0 / ni * (np.mod(m, ni) + lon_cpr)
+    lon = np.where(lon >= 180, lon - 360, lon)
+
+    return lat, lon, valid
+
+
+def cpr_local(lat_cpr, lon_cpr, odd, lat_ref, lon_ref) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode normalized CPR coordinates against a nearby reference position"""
+    i = np.asarray(odd, dtype=np.float64)
+    dlat = 360.0 / (60 - i)
+    j = np.floor(lat_ref / dlat) + np.floor(np.mod(lat_ref, dlat) / dlat - lat_cpr + 0.5)
+    lat = dlat * (j + lat_cpr)
+
+    dlon = 360.0 / np.maximum(cpr_nl(lat) - i, 1)
+    m = np.floor(lon_ref / dlon) + np.floor(np.mod(lon_ref, dlon) / dlon - lon_cpr + 0.5)
+    lon = dlon * (m + lon_cpr)
+
+    return lat, lon
+
+
+def distance_nm(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in nautical miles"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * 3440.065 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def last_valid_index(valid: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """Index of the last `valid` row at or before each row within its group, -1 if none
+
+    Rows must be sorted by group.
+    """
+    idx = np.where(valid, np.arange(len(valid)), -1)
+    idx = np.maximum.accumulate(idx) if len(idx) else idx
+    found = idx >= 0
+    found[found] = group[idx[found]] == group[found]
+    return np.where(found, idx, -1)
+
+
+def epoch_seconds(timestamps: pd.Series) -> np.ndarray:
+    """Timestamps as float epoch seconds, whether stored as datetimes or numbers"""
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return timestamps.to_numpy("datetime64[ns]").astype(np.int64) / 1e9
+    return pd.to_numeric(timestamps, errors="coerce").to_numpy(np.float64)
+
+
+def decode_cpr_positions(
+    data: pd.DataFrame,
+    reference: Tuple[float, float] = ORLY_POSITION,
+    max_pair_interval: float = 10.0,
+    max_reference_age: float = MAX_REFERENCE_AGE,
+    receiver_range_nm: float = RECEIVER_RANGE_NM,
+    max_ground_speed_kt: float = MAX_GROUND_SPEED_KT,
+) -> pd.DataFrame:
+    """Fill missing latitude/longitude of airborne position messages from their CPR fields
+
+    Each message is paired with the latest message of opposite parity from
+    the same aircraft received less than `max_pair_interval` seconds before
+    and decoded globally. Unpaired messages are decoded locally against the
+    aircraft's previous globally decoded position if it is at most
+    `max_reference_age` seconds old, and kept only if reachable from it at
+    `max_ground_speed_kt`. Otherwise they are decoded against `reference`,
+    the receiver (Orly by default), and kept only within
+    `receiver_range_nm` of it; an aircraft farther away would decode to an
+    aliased position. Everything is computed with NumPy over all messages
+    at once.
+    """
+    required = {"icao24", "timestamp", "lat_cpr", "lon_cpr", "parity"}
+    if not required.issubset(data.columns):
+        return data
+
+    parity = data["parity"].astype(object)
+    cpr_mask = (
+        data["lat_cpr"].notna().to_numpy()
+        & data["lon_cpr"].notna().to_numpy()
+        & parity.isin(["even", "odd"]).to_numpy()
+        & data["icao24"].notna().to_numpy()
+    )
+    if "tc" in data.columns:
+        # Airborne position type codes; surface positions (TC 5-8) use another grid
+        tc = pd.to_numeric(data["tc"], errors="coerce").to_numpy()
+        cpr_mask &= ((tc >= 9) & (tc <= 18)) | ((tc >= 20) & (tc <= 22))
+    if not cpr_mask.any():
+        return data
+
+    rows = np.flatnonzero(cpr_mask)
+    group = pd.factorize(data["icao24"].to_numpy()[rows])[0]
+    ts = epoch_seconds(data["timestamp"])[rows]
+    order = np.lexsort((ts, group))
+    rows, group, ts = rows[order], group[order], ts[order]
+
+    lat_cpr = data["lat_cpr"].to_numpy(np.float64)[rows] / CPR_SCALE
+    lon_cpr = data["lon_cpr"].to_numpy(np.float64)[rows] / CPR_SCALE
+    odd = (parity.to_numpy()[rows] == "odd")
+
+    # Global decoding with the latest message of opposite parity
+    last_even = last_valid_index(~odd, group)
+    last_odd = last_valid_index(odd, group)
+    partner = np.where(odd, last_even, last_odd)
+    paired = partner >= 0
+    partner_safe = np.where(paired, partner, 0)
+    paired &= (ts - ts[partner_safe]) <= max_pair_interval
+
+    even_idx = np.where(odd, partner_safe, np.arange(len(rows)))
+    odd_idx = np.where(odd, np.arange(len(rows)), partner_safe)
+    lat, lon, valid = cpr_global(
+        lat_cpr[even_idx], lon_cpr[even_idx], lat_cpr[odd_idx], lon_cpr[odd_idx], odd
+    )
+    decoded = paired & valid
+
+    # Local decoding against a recent decoded position, or else the receiver
+    previous = last_valid_index(decoded, group)
+    previous_safe = np.where(previous >= 0, previous, 0)
+    age = ts - ts[previous_safe]
+    recent = (previous >= 0) & (age <= max_reference_age)
+    lat_ref = np.where(recent, lat[previous_safe], reference[0])
+    lon_ref = np.where(recent, lon[previous_safe], reference[1])
+    lat_local, lon_local = cpr_local(lat_cpr, lon_cpr, odd, lat_ref, lon_ref)
+    distance = distance_nm(lat_local, lon_local, lat_ref, lon_ref)
+    plausible = np.where(
+        recent,
+        distance <= max_ground_speed_kt * age / 3600 + POSITION_TOLERANCE_NM,
+        distance <= receiver_range_nm,
+    )
+    local_ok = ~decoded & plausible
+
+    lat = np.where(decoded, lat, np.where(local_ok, lat_local, np.nan))
+    lon = np.where(decoded, lon, np.where(local_ok, lon_local, np.nan))
+
+    result = data.copy()
+    for col, values in (("latitude", lat), ("longitude", lon)):
+        if col not in result.columns:
+            result[col] = np.nan
+        column = result[col].to_numpy(np.float64, copy=True)
+        missing = np.isnan(column[rows])
+        column[rows[missing]] = values[missing]
+        result[col] = column
+    return result
@@ -0,0 +1,194 @@
+# %%
+# Deduplication of frames received by several antennas
+# When the Orly and Montsouris feeds are merged, the same Mode S frame shows up
+# once per receiver. Only one row is kept per frame, with the number of
+# receivers and the best RSSI, using a hash set limited to a sliding window.
+
+from collections import deque
+from typing import Dict, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from adsb_decoding import epoch_seconds
+from adsb_ingest import concat_batches
+
+# Identical frames further apart than this (seconds) are distinct messages
+DEFAULT_DEDUP_WINDOW = 1.0
+
+
+def _leaders(codes: np.ndarray, ts: np.ndarray, window: float) -> np.ndarray:
+    """Row of the first occurrence of each row's frame within the window
+
+    `codes` are the frame codes of time-sorted rows (-1 for rows that are
+    not deduplicated, which lead themselves). Within a frame, a row starts a
+    new group when it comes more than `window` seconds after the current
+    leader; the next leader of every row is found by one binary search over
+    (frame, time), then leaders are chained frame by frame, vectorized over
+    all frames at once.
+    """
+    leader = np.arange(len(codes), dtype=np.int64)
+    rows = np.flatnonzero(codes >= 0)
+    rows = rows[np.argsort(codes[rows], kind="stable")]
+    if len(rows) == 0:
+        return leader
+
+    keys = np.empty(len(rows), dtype=[("frame", np.int64), ("ts", np.float64)])
+    keys["frame"], keys["ts"] = codes[rows], ts[rows]
+    bounds = keys.copy()
+    bounds["ts"] += window
+    following = np.searchsorted(keys, bounds, side="right")
+
+    is_leader = np.zeros(len(rows), dtype=bool)
+    group_first = np.r_[True, keys["frame"][1:] != keys["frame"][:-1]]
+    group_stop = np.append(np.flatnonzero(group_first)[1:], len(rows))[np.cumsum(group_first) - 1]
+    current = np.flatnonzero(group_first)
+    while len(current):
+        is_leader[current] = True
+        current, stop = following[current], group_stop[current]
+        current = current[current < stop]
+
+    positions = np.maximum.accumulate(np.where(is_leader, np.arange(len(rows)), 0))
+    leader[rows] = rows[positions]
+    return leader
+
+
+def _receiver_counts(metadata: pd.Series, leader: np.ndarray):
+    """Distinct receiver serials and best RSSI of every group, from the `metadata` lists
+
+    Rows without receiver metadata count as one receiver each. Rows with a
+    negative `leader` are ignored.
+    """
+    n = len(leader)
+    counted = leader >= 0
+    receivers = metadata.explode()
+    row = receivers.index.to_numpy()
+    entries = receivers.to_numpy()
+    is_receiver = np.fromiter((isinstance(r, dict) for r in entries), dtype=bool, count=len(entries))
+    row, entries = row[is_receiver], entries[is_receiver]
+    table = pd.DataFrame(list(entries), columns=["serial", "rssi"], index=row)
+    keep = counted[row]
+    row, table = row[keep], table[keep]
+
+    serial, serials = pd.factorize(table["serial"], use_na_sentinel=False)
+    pairs = np.unique(leader[row] * max(len(serials), 1) + serial)
+    n_receivers = np.bincount(pairs // max(len(serials), 1), minlength=n)
+    without = counted & (np.bincount(row, minlength=n) == 0)
+    n_receivers += np.bincount(leader[without], minlength=n)
+
+    rssi_max = np.full(n, np.nan)
+    np.fmax.at(rssi_max, leader[row], pd.to_numeric(table["rssi"], errors="coerce").to_numpy(np.float64))
+    return n_receivers, rssi_max
+
+
+class FrameDeduplicator:
+    """Streaming deduplication of identical frames within a time window
+
+    Batches are fed in time order through `process`. Rows are held back
+    until no duplicate can arrive any more (`window` seconds), so memory
+    only depends on the traffic within one window: the hash set forgets
+    frames older than the window instead of growing like a global
+    `drop_duplicates`. Output rows gain `n_receivers` and `rssi_max`
+    columns, which replace `metadata`.
+    """
+
+    def __init__(self, window: float = DEFAULT_DEDUP_WINDOW):
+        self.window = window
+        self.duplicates = 0
+        self._pending = None
+        self._seen: Dict[str, float] = {}
+        self._seen_order = deque()
+        self._empty = None
+
+    def __repr__(self):
+        return (
+            f"FrameDeduplicator(window={self.window}s) with {len(self._seen)} "
+            f"frames in window, {self.duplicates} duplicates dropped"
+        )
+
+    def _forget(self, before: float):
+        while self._seen_order and self._seen_order[0][0] < before:
+            ts, frame = self._seen_order.popleft()
+            if self._seen.get(frame) == ts:
+                del self._seen[frame]
+
+    def _output(self, data: pd.DataFrame, rows: np.ndarray, n_receivers: np.ndarray,
+                rssi_max: np.ndarray) -> pd.DataFrame:
+        result = data.iloc[rows].drop(columns=["metadata"], errors="ignore").reset_index(drop=True)
+        result["n_receivers"] = n_receivers.astype(np.int16)
+        result["rssi_max"] = rssi_max.astype(np.float32)
+        self._empty = result.iloc[:0]
+        return result
+
+    def process(self, batch: pd.DataFrame, final: bool = False) -> pd.DataFrame:
+        """Add a batch of messages and return the deduplicated rows that are complete"""
+        parts = [part for part in (self._pending, batch) if part is not None]
+        data = concat_batches(parts)
+        if len(data) == 0:
+            self._pending = None
+            return self._output(data, np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+
+        ts = epoch_seconds(data["timestamp"])
+        order = np.argsort(ts, kind="stable")
+        data, ts = data.iloc[order].reset_index(drop=True), ts[order]
+        cutoff = np.inf if final else ts[-1] - self.window
+
+        # Frames already emitted within the window are dropped, the others
+        # are assigned to the first occurrence of their frame within the window
+        codes, frames = pd.factorize(data["frame"])
+        frames = np.asarray(frames, dtype=object)
+        seen = pd.Series(self._seen, dtype=np.float64).reindex(frames).to_numpy()
+        with np.errstate(invalid="ignore"):
+            dropped = (codes >= 0) & (ts - np.append(seen, np.nan)[codes] <= self.window)
+        codes = np.where(dropped, -1, codes)
+        leader = _leaders(codes, ts, self.window)
+        leader[dropped] = -1
+
+        if "metadata" in data.columns:
+            n_receivers, rssi_max = _receiver_counts(data["metadata"], leader)
+        else:
+            n_receivers = np.bincount(leader[leader >= 0], minlength=len(data))
+            rssi_max = np.full(len(data), np.nan)
+
+        is_leader = leader == np.arange(len(data))
+        emit = is_leader & (ts <= cutoff)
+        self.duplicates += int(((leader >= 0) & (ts <= cutoff) & ~is_leader).sum())
+        self.duplicates += int(dropped.sum())
+
+        emitted_rows = np.flatnonzero(emit)
+        result = self._output(data, emitted_rows, n_receivers[emit], rssi_max[emit])
+
+        # Only frames emitted within the last window can still have duplicates
+        horizon = cutoff - self.window
+        for i in emitted_rows[(codes[emitted_rows] >= 0) & (ts[emitted_rows] >= horizon)]:
+            frame = frames[codes[i]]
+            self._seen[frame] = ts[i]
+            self._seen_order.append((ts[i], frame))
+        self._forget(horizon)
+
+        held = (ts > cutoff) & (leader >= 0)
+        self._pending = data[held] if held.any() else None
+        return result
+
+    def flush(self) -> pd.DataFrame:
+        """Return the rows still held back at the end of the stream"""
+        if self._pending is None:
+            if self._empty is None:
+                return self.process(concat_batches([]), final=True)
+            return self._empty.copy()
+        return self.process(self._pending.iloc[:0], final=True)
+
+    def iter_batches(self, batches: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Deduplicate a stream of time-ordered batches"""
+        for batch in batches:
+            result = self.process(batch)
+            if len(result):
+                yield result
+        result = self.flush()
+        if len(result):
+            yield result
+
+
+def deduplicate_frames(data: pd.DataFrame, window: float = DEFAULT_DEDUP_WINDOW) -> pd.DataFrame:
+    """Keep one row per frame received several times within `window` seconds"""
+    return FrameDeduplicator(window).process(data, final=True)
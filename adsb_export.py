@@ -0,0 +1,298 @@
+# %%
+# Pipelined export of flights to the Grafana databases
+# One producer builds each flight's simplified trajectory and summary while
+# separate sink stages, each with a bounded queue and its own worker threads,
+# write them to the time-series store and the metadata table. A slow sink
+# fills its queue and pauses the producer instead of buffering without limit.
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from adsb_checkpoint import SourceCheckpoint, flight_fingerprint
+from adsb_metadata import MetadataBuffer
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_TIMESERIES_WORKERS = 2
+DEFAULT_METADATA_WORKERS = 1
+# Summaries upserted per metadata statement, and longest wait (s) for a
+# batch to fill before it is written anyway
+DEFAULT_METADATA_BATCH = 500
+DEFAULT_METADATA_LINGER = 0.5
+
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def trajectory_end(trajectory: pd.DataFrame, default: Optional[float] = None) -> Optional[float]:
+    """Epoch seconds of the last point of a trajectory (`default` when empty)"""
+    if len(trajectory) == 0:
+        return default
+    return trajectory["timestamp_dt"].max().value / 1e9
+
+
+class SinkStage:
+    """Bounded queue drained by `workers` threads calling `handle(items)`
+
+    `handle` receives up to `batch_size` items at once, waiting at most
+    `linger` seconds for a batch to fill, and returns the number of units
+    written (points, rows). Each item is a (key, payload) pair; the keys of
+    successful items are collected in `done`. Latency is measured from
+    `put` to the end of the `handle` call.
+    """
+
+    _STOP = object()
+
+    def __init__(self, name: str, handle: Callable[[List], int], workers: int = 1,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, batch_size: int = 1, linger: float = 0.0):
+        self.name = name
+        self.handle = handle
+        self.batch_size = batch_size
+        self.linger = linger
+        self.done = set()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._latencies: List[float] = []
+        self._items = 0
+        self._units = 0
+        self._failed = 0
+        self._busy = 0.0
+        self._errors: List[str] = []
+        self._started = None
+        self._finished = None
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+
+    def __repr__(self):
+        return f"SinkStage {self.name} ({len(self._threads)} workers, {self._queue.qsize()} queued)"
+
+    def start(self):
+        self._started = time.perf_counter()
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, key, payload):
+        """Queue one item, blocking while the queue is full"""
+        self._queue.put((time.perf_counter(), key, payload))
+
+    def close(self):
+        """Wait for every queued item to be handled and stop the workers"""
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._finished = time.perf_counter()
+
+    def _next_batch(self) -> List:
+        """Block for one item, then collect up to batch_size items for at most `linger` seconds"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.linger
+        while len(batch) < self.batch_size and batch[-1] is not self._STOP:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is self._STOP
+            items = batch[:-1] if stop else batch
+            if items:
+                self._process(items)
+            if stop:
+                return
+
+    def _process(self, items: List):
+        start = time.perf_counter()
+        try:
+            units = self.handle([(key, payload) for _, key, payload in items])
+            failed = False
+        except Exception as e:
+            units = 0
+            failed = True
+            error = f"{type(e).__name__}: {e}"
+        end = time.perf_counter()
+
+        with self._lock:
+            self._busy += end - start
+            if failed:
+                self._failed += len(items)
+                if len(self._errors) < 10:
+                    self._errors.append(error)
+            else:
+                self._items += len(items)
+                self._units += units
+                self.done.update(key for _, key, _ in items)
+                self._latencies.extend(end - queued for queued, _, _ in items)
+
+    def stats(self) -> Dict:
+        """Throughput, latency percentiles (ms) and failure count of the stage"""
+        elapsed = (self._finished or time.perf_counter()) - (self._started or time.perf_counter())
+        latencies = np.array(self._latencies) * 1000
+        result = {
+            "workers": len(self._threads),
+            "items": self._items,
+            "units": self._units,
+            "failed": self._failed,
+            "elapsed_s": elapsed,
+            "busy_s": self._busy,
+            "items_per_s": self._items / elapsed if elapsed > 0 else None,
+            "units_per_s": self._units / elapsed if elapsed > 0 else None,
+            "errors": list(self._errors),
+        }
+        for p in LATENCY_PERCENTILES:
+            result[f"latency_p{p}_ms"] = float(np.percentile(latencies, p)) if len(latencies) else None
+        return result
+
+
+class ExportPipeline:
+    """Producer → (time-series sink, metadata sink) export of flights
+
+    The producer walks the flights lazily, skips those without a valid
+    trajectory, and hands each simplified trajectory to the time-series
+    stage (line protocol queued on the exporter's InfluxLineWriter) and
+    each summary to the metadata stage (bulk upserts of up to
+    `metadata_batch` summaries). A flight counts as exported when its
+    summary was written and none of its points was dropped by the writer
+    (queued lines carry the flight id, see InfluxLineWriter.pop_failed_keys).
+    An exception while preparing one flight counts it as failed, with the
+    error in `errors`, and the export goes on.
+
+    The time-series stage only builds line protocol and queues it on the
+    writer, whose single thread sends batches shared by many flights: the
+    stage's latency and throughput cover queueing. The writer's own request
+    latency (`send_latency_p*_ms`, per batch) and delivery latency
+    (`delivery_latency_p*_ms`, per flight, from queueing to acknowledgment)
+    are added to the time-series statistics.
+
+    With a checkpoint, flights whose fingerprint did not change since the
+    last run are skipped, and only the trajectory points after the last
+    exported one are sent for flights that gained messages (the summary is
+    upserted in full). Exported flights are recorded in the checkpoint.
+    """
+
+    def __init__(self, exporter, timeseries_workers: int = DEFAULT_TIMESERIES_WORKERS,
+                 metadata_workers: int = DEFAULT_METADATA_WORKERS,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, metadata_batch: int = DEFAULT_METADATA_BATCH,
+                 metadata_linger: float = DEFAULT_METADATA_LINGER):
+        self.exporter = exporter
+        self.timeseries = SinkStage(
+            "timeseries", self._write_trajectories, timeseries_workers, queue_size
+        )
+        self.metadata = SinkStage(
+            "metadata", self._write_summaries, metadata_workers, queue_size,
+            batch_size=metadata_batch, linger=metadata_linger
+        )
+
+    def _write_trajectories(self, items: List) -> int:
+        writer = self.exporter.influx_writer
+        if writer is None:
+            raise RuntimeError("InfluxDB not available")
+        return sum(
+            writer.write_trajectory(trajectory, {"flight_id": flight_id}, key=flight_id)
+            for flight_id, trajectory in items
+        )
+
+    def _write_summaries(self, items: List) -> int:
+        buffer = MetadataBuffer(summary for _, summary in items)
+        if self.exporter.metadata_sink is None:
+            raise RuntimeError("PostgreSQL not available")
+        return self.exporter.metadata_sink.write(buffer)
+
+    def run(self, flights: Iterable, max_flights: Optional[int] = None,
+            checkpoint: Optional[SourceCheckpoint] = None) -> Dict:
+        """Export the flights; returns counts, timings and per-sink statistics"""
+        results = {
+            "exported": 0,
+            "failed": 0,
+            "skipped": 0,
+            "unchanged": 0,
+            "points": 0,
+            "points_exported": 0,
+            "truncated": False,
+            "errors": [],
+        }
+        pending = {}
+        producer_failed = 0
+        writer = self.exporter.influx_writer
+        influx_before = dict(writer.stats) if writer else {}
+        if writer:
+            # Only the failures and latencies of this run count
+            writer.pop_failed_keys()
+            writer.pop_latencies()
+
+        start = time.perf_counter()
+        self.timeseries.start()
+        self.metadata.start()
+        produced = 0
+        try:
+            for flight in flights:
+                if max_flights and produced + results["skipped"] >= max_flights:
+                    results["truncated"] = True
+                    break
+                flight_id = None
+                try:
+                    if not flight.has_valid_trajectory():
+                        results["skipped"] += 1
+                        continue
+                    flight_id = flight.flight_id
+                    if checkpoint is not None:
+                        fingerprint = flight_fingerprint(flight)
+                        if not checkpoint.changed(flight_id, fingerprint):
+                            results["unchanged"] += 1
+                            continue
+                    trajectory = flight.simplified_trajectory()
+                    if checkpoint is not None:
+                        since = checkpoint.exported_until(flight_id)
+                        if since is not None:
+                            trajectory = trajectory[trajectory["timestamp_dt"] > pd.to_datetime(since, unit="s")]
+                        pending[flight_id] = (fingerprint, trajectory_end(trajectory, since))
+                    summary = flight.get_flight_summary()
+                except Exception as e:
+                    producer_failed += 1
+                    if len(results["errors"]) < 10:
+                        results["errors"].append(f"{flight_id or 'flight'}: {type(e).__name__}: {e}")
+                    continue
+                results["points"] += summary["total_points"]
+                results["points_exported"] += len(trajectory)
+                self.timeseries.put(summary["flight_id"], trajectory)
+                self.metadata.put(summary["flight_id"], summary)
+                produced += 1
+        finally:
+            results["producer_s"] = time.perf_counter() - start
+            self.timeseries.close()
+            self.metadata.close()
+
+        # Trajectory points still in the writer's batches are part of the export
+        if writer:
+            writer.flush()
+            for key in ("points_written", "points_failed"):
+                results[f"influx_{key}"] = writer.stats[key] - influx_before.get(key, 0)
+        results["elapsed_s"] = time.perf_counter() - start
+
+        exported = self.timeseries.done & self.metadata.done
+        if writer:
+            exported -= writer.pop_failed_keys()
+        results["exported"] = len(exported)
+        results["failed"] = produced - len(exported) + producer_failed
+        results["metadata_exported"] = self.metadata.stats()["units"]
+        if checkpoint is not None:
+            for flight_id in exported:
+                checkpoint.record(flight_id, *pending[flight_id])
+        results["flights_per_s"] = produced / results["elapsed_s"] if results["elapsed_s"] > 0 else None
+        results["sinks"] = {"timeseries": self.timeseries.stats(), "metadata": self.metadata.stats()}
+        if writer:
+            timeseries = results["sinks"]["timeseries"]
+            timeseries["failed_points"] = results["influx_points_failed"]
+            for kind, latencies in writer.pop_latencies().items():
+                for p in LATENCY_PERCENTILES:
+                    timeseries[f"{kind}_latency_p{p}_ms"] = (
+                        float(np.percentile(latencies * 1000, p)) if len(latencies) else None
+                    )
+        return results
@@ -0,0 +1,309 @@
+# %%
+# Vectorized flight segmentation
+# Flights are computed once for the whole message table as an integer
+# `flight_id` column over a table sorted by aircraft and time, so that every
+# flight is a contiguous slice given by two offsets.
+
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from adsb_decoding import epoch_seconds, last_valid_index
+
+# Gap (seconds) between two messages of an aircraft that starts a new flight
+DEFAULT_GAP_THRESHOLD = 20000
+
+
+def _next_valid_index(valid: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """Index of the first `valid` row at or after each row within its group, -1 if none"""
+    n = len(valid)
+    idx = last_valid_index(valid[::-1], group[::-1])[::-1]
+    return np.where(idx >= 0, n - 1 - idx, -1)
+
+
+def segment_flights(
+    data: pd.DataFrame, gap_threshold: float = DEFAULT_GAP_THRESHOLD
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Split messages into flights in one pass
+
+    Messages are sorted by icao24 and timestamp; a flight starts at each new
+    aircraft, after a gap longer than `gap_threshold` seconds, or when the
+    callsign changes. Rows without callsign take the previous callsign of
+    their flight (or the next one before the first identification message).
+
+    Returns the sorted table with an integer `flight_id` column and the
+    array of flight offsets: flight i is rows offsets[i]:offsets[i + 1].
+    """
+    data = data[data["icao24"].notna()]
+    n = len(data)
+    if n == 0:
+        empty = data.assign(flight_id=np.zeros(0, dtype=np.int64))
+        return empty.reset_index(drop=True), np.zeros(1, dtype=np.int64)
+
+    aircraft = pd.factorize(data["icao24"].to_numpy())[0]
+    ts = epoch_seconds(data["timestamp"])
+    order = np.lexsort((ts, aircraft))
+    flights = data.iloc[order].reset_index(drop=True)
+    aircraft, ts = aircraft[order], ts[order]
+
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = (aircraft[1:] != aircraft[:-1]) | (np.diff(ts) > gap_threshold)
+
+    if "callsign" in flights.columns:
+        segment = np.cumsum(starts)
+        known = flights["callsign"].notna().to_numpy()
+        source = last_valid_index(known, segment)
+        source = np.where(source >= 0, source, _next_valid_index(known, segment))
+
+        codes = pd.factorize(flights["callsign"].to_numpy())[0]
+        filled = np.where(source >= 0, codes[np.maximum(source, 0)], -1)
+        starts[1:] |= (filled[1:] != filled[:-1]) & (filled[1:] >= 0) & (filled[:-1] >= 0)
+
+        callsign = flights["callsign"].take(np.maximum(source, 0)).reset_index(drop=True)
+        flights["callsign"] = callsign.where(source >= 0)
+
+    flights["flight_id"] = np.cumsum(starts) - 1
+    offsets = np.append(np.flatnonzero(starts), n).astype(np.int64)
+    return flights, offsets
+
+
+def _ids_by_key(keys: np.ndarray) -> Dict[str, np.ndarray]:
+    """Map each non-null key to the array of positions where it occurs"""
+    known = pd.notna(keys)
+    ids = np.flatnonzero(known)
+    groups = pd.Series(ids).groupby(keys[known]).indices
+    return {key: ids[positions] for key, positions in groups.items()}
+
+
+class _IntervalTree:
+    """Static centered interval tree answering stabbing queries
+
+    Each node keeps the intervals containing its center (the median of the
+    endpoints below it), sorted by start and by end; intervals entirely before
+    or after the center go to the left or right child. Small nodes are leaves
+    scanned directly.
+    """
+
+    LEAF_SIZE = 16
+
+    def __init__(self, start: np.ndarray, end: np.ndarray):
+        """`start` and `end` are int64 arrays (e.g. nanoseconds), one per interval"""
+        self.start = start
+        self.end = end
+        # One entry per node: (center, ids by start, sorted starts, ids by end, sorted ends, left, right);
+        # leaves have a None center and their ids, starts and ends unsorted
+        self.nodes = []
+        self._root = self._build(np.arange(len(start), dtype=np.int64)) if len(start) else -1
+
+    def _build(self, ids: np.ndarray) -> int:
+        start, end = self.start[ids], self.end[ids]
+        position = len(self.nodes)
+        if len(ids) <= self.LEAF_SIZE:
+            self.nodes.append((None, ids, start, None, end, -1, -1))
+            return position
+        center = int(np.median(np.concatenate([start, end])))
+        here = (start <= center) & (end >= center)
+        by_start = np.argsort(start[here], kind="stable")
+        by_end = np.argsort(end[here], kind="stable")
+        self.nodes.append(None)
+        left = self._build(ids[end < center]) if (end < center).any() else -1
+        right = self._build(ids[start > center]) if (start > center).any() else -1
+        self.nodes[position] = (
+            center,
+            ids[here][by_start], start[here][by_start],
+            ids[here][by_end], end[here][by_end],
+            left, right,
+        )
+        return position
+
+    def stabbing(self, point) -> np.ndarray:
+        """Ids of the intervals with start < `point` < end"""
+        found = []
+        node = self._root
+        while node >= 0:
+            center, by_start, starts, by_end, ends, left, right = self.nodes[node]
+            if center is None:
+                found.append(by_start[(starts < point) & (ends > point)])
+                break
+            if point < center:
+                # every interval here ends at or after the center
+                found.append(by_start[:np.searchsorted(starts, point, side="left")])
+                node = left
+            elif point > center:
+                # every interval here starts at or before the center
+                found.append(by_end[np.searchsorted(ends, point, side="right"):])
+                node = right
+            else:
+                found.append(by_start[(starts < point) & (self.end[by_start] > point)])
+                break
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+
+class FlightIndex:
+    """Lookup of flight ids by icao24, callsign and time window
+
+    Built once from a segmented table: hash maps from icao24 and callsign to
+    flight ids, flight start times sorted by start and an interval tree of
+    the flight spans. A time window query takes the flights starting inside
+    the window by binary search and those still in progress at its start
+    from the tree, in O(log n + k) for k matching flights.
+    """
+
+    def __init__(self, flights: pd.DataFrame, offsets: np.ndarray):
+        first, last = offsets[:-1], offsets[1:] - 1
+        self.by_icao24 = _ids_by_key(flights["icao24"].to_numpy()[first])
+        self.by_callsign = (
+            _ids_by_key(flights["callsign"].to_numpy()[first])
+            if "callsign" in flights.columns
+            else {}
+        )
+
+        ts = flights["timestamp"].to_numpy("datetime64[ns]")
+        self.start = ts[first]
+        self.end = ts[last]
+        self._by_start = np.argsort(self.start, kind="stable")
+        self._sorted_start = self.start[self._by_start]
+        self._spans = _IntervalTree(self.start.view(np.int64), self.end.view(np.int64))
+
+    def __len__(self):
+        return len(self.start)
+
+    def lookup(self, key: str) -> np.ndarray:
+        """Flight ids whose icao24 or callsign equals `key`"""
+        matches = [
+            self.by_icao24.get(key, np.zeros(0, dtype=np.int64)),
+            self.by_callsign.get(key, np.zeros(0, dtype=np.int64)),
+        ]
+        return np.unique(np.concatenate(matches)).astype(np.int64)
+
+    def between(self, start, stop) -> np.ndarray:
+        """Flight ids whose time span overlaps the open interval (`start`, `stop`)"""
+        start = np.datetime64(pd.Timestamp(start), "ns")
+        stop = np.datetime64(pd.Timestamp(stop), "ns")
+        lo = np.searchsorted(self._sorted_start, start, side="left")
+        hi = np.searchsorted(self._sorted_start, stop, side="left")
+        starting = self._by_start[lo:hi]
+        starting = starting[self.end[starting] > start]
+        in_progress = self._spans.stabbing(start.astype(np.int64))
+        return np.sort(np.concatenate([starting, in_progress])).astype(np.int64)
+
+
+def summarize_aircraft(flights: pd.DataFrame) -> pd.DataFrame:
+    """Per-aircraft statistics of a table sorted by icao24, in one pass
+
+    `flights` is the sorted table returned by `segment_flights`. Each row of
+    the summary gives the aircraft's slice (`first_row`:`stop_row`), its
+    altitude and vertical rate extremes and the number of points with a
+    complete position (latitude, longitude and altitude).
+    """
+    n = len(flights)
+    aircraft = pd.factorize(flights["icao24"].to_numpy())[0]
+    starts = np.flatnonzero(np.r_[True, aircraft[1:] != aircraft[:-1]]) if n else np.zeros(0, dtype=np.int64)
+    stops = np.append(starts[1:], n).astype(np.int64)
+
+    def extremes(column):
+        if column not in flights.columns or n == 0:
+            return np.full(len(starts), np.nan), np.full(len(starts), np.nan)
+        values = pd.to_numeric(flights[column], errors="coerce").to_numpy(np.float64)
+        with np.errstate(invalid="ignore"):
+            return np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts)
+
+    valid = np.ones(n, dtype=bool)
+    for column in ("latitude", "longitude", "altitude"):
+        valid &= flights[column].notna().to_numpy() if column in flights.columns else False
+
+    alt_min, alt_max = extremes("altitude")
+    vr_min, vr_max = extremes("vertical_rate")
+    return pd.DataFrame({
+        "icao24": flights["icao24"].to_numpy()[starts],
+        "first_row": starts,
+        "stop_row": stops,
+        "n_messages": stops - starts,
+        "altitude_min": alt_min,
+        "altitude_max": alt_max,
+        "vertical_rate_min": vr_min,
+        "vertical_rate_max": vr_max,
+        "valid_points": np.add.reduceat(valid.astype(np.int64), starts) if n else np.zeros(0, dtype=np.int64),
+    })
+
+
+def classify_aircraft(
+    summary: pd.DataFrame,
+    ground_altitude_threshold: float = 100,
+    descent_rate_threshold: float = -1500,
+    climb_rate_threshold: float = 3000,
+) -> pd.DataFrame:
+    """Add `is_landing`/`is_takeoff` flags to an aircraft summary
+
+    Same criteria as `FlightGrafana.is_landing`/`is_takeoff`: minimum altitude
+    close to the ground and a strong descent (resp. climb) rate. Only the
+    summary is read, so new thresholds do not re-scan the messages.
+    """
+    near_ground = summary["altitude_min"].to_numpy() <= ground_altitude_threshold
+    result = summary.copy()
+    result["is_landing"] = near_ground & (summary["vertical_rate_min"].to_numpy() <= descent_rate_threshold)
+    result["is_takeoff"] = near_ground & (summary["vertical_rate_max"].to_numpy() >= climb_rate_threshold)
+    return result
+
+
+class ColumnStore:
+    """Shared columnar storage of a segmented message table
+
+    Flight views keep a reference to the store and two offsets; columns
+    are converted once to NumPy arrays (categoricals keep their codes) and
+    handed out as slices, which are views for numeric and datetime columns.
+    Columns added later to `frame` (e.g. x_lambert/y_lambert) are picked
+    up on first access. After modifying existing values of `frame`, call
+    `invalidate()`: it drops the converted arrays and bumps `version`, which
+    flight views compare against to refresh their cached metrics.
+    """
+
+    __slots__ = ("frame", "version", "_arrays")
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        self.version = 0
+        self._arrays = {}
+
+    def __repr__(self):
+        return f"ColumnStore with {len(self)} rows, {len(self._arrays)}/{len(self.frame.columns)} columns loaded"
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.frame.columns
+
+    def invalidate(self):
+        """Forget converted columns and mark derived values as stale"""
+        self._arrays = {}
+        self.version += 1
+
+    def array(self, name: str):
+        """Whole column as a NumPy array, or a pandas Categorical for categories"""
+        values = self._arrays.get(name)
+        if values is None:
+            column = self.frame[name]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                values = column.array
+            elif pd.api.types.is_datetime64_any_dtype(column):
+                values = column.to_numpy("datetime64[ns]")
+            else:
+                values = column.to_numpy()
+            self._arrays[name] = values
+        return values
+
+    def column(self, name: str, start: int, stop: int) -> np.ndarray:
+        """Rows start:stop of one column (a view unless the column is categorical)"""
+        values = self.array(name)
+        if isinstance(values, pd.Categorical):
+            codes = values.codes[start:stop]
+            categories = values.categories.to_numpy(dtype=object)
+            return np.where(codes >= 0, categories[np.maximum(codes, 0)], None)
+        return values[start:stop]
+
+    def frame_slice(self, start: int, stop: int, columns=None) -> pd.DataFrame:
+        """Rows start:stop as a DataFrame, optionally restricted to some columns"""
+        frame = self.frame if columns is None else self.frame[list(columns)]
+        return frame.iloc[start:stop]
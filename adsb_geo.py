@@ -0,0 +1,298 @@
+# %%
+# Batched projection of trajectories to Lambert-93
+# All points of all selected flights are projected with one transformer call
+# and turned into point and line geometries with shapely's vectorized
+# constructors, instead of one GeoDataFrame per flight.
+
+import threading
+from typing import Iterable, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+
+from adsb_decoding import epoch_seconds
+from adsb_trajectory import compression_ratio, simplify_mask
+
+WGS84 = "EPSG:4326"
+LAMBERT93 = "EPSG:2154"
+
+# Paris region kept on the maps (Lambert-93 metres)
+PARIS_CENTER = (650000, 6860000)
+PARIS_MAX_DISTANCE = 100000
+
+# Margin (degrees) added to the WGS84 bounding box of a region
+PREFILTER_MARGIN = 0.01
+
+TRAJECTORY_COLUMNS = ["latitude", "longitude", "altitude", "timestamp", "vertical_rate"]
+
+FEET_TO_METRES = 0.3048
+
+
+# {(source, target): Transformer} of the current thread, freed with the thread
+_transformers = threading.local()
+
+
+def get_transformer(source: str = WGS84, target: str = LAMBERT93) -> pyproj.Transformer:
+    """Return the shared (lon, lat) -> (x, y) transformer for a CRS pair
+
+    Transformers are built once per CRS pair and per thread, since a pyproj
+    Transformer must not be used by several threads at the same time.
+    """
+    cache = getattr(_transformers, "cache", None)
+    if cache is None:
+        cache = _transformers.cache = {}
+    transformer = cache.get((source, target))
+    if transformer is None:
+        transformer = cache[(source, target)] = pyproj.Transformer.from_crs(source, target, always_xy=True)
+    return transformer
+
+
+class Region:
+    """Region of interest of the maps, a box or polygon in Lambert-93
+
+    The geometry may be given in WGS84 or Lambert-93 (`crs`). Its WGS84
+    bounding box is computed once so that messages far away can be dropped
+    from their latitude/longitude, before any projection; `contains_xy`
+    then gives the exact test on projected coordinates.
+    """
+
+    def __init__(self, geometry, crs: str = LAMBERT93):
+        if crs != LAMBERT93:
+            # Densify first so that edges stay close to the original lines once projected
+            transformer = get_transformer(crs, LAMBERT93)
+            geometry = shapely.transform(
+                shapely.segmentize(geometry, PREFILTER_MARGIN),
+                lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])),
+            )
+        self.geometry = geometry
+        self.is_box = geometry.equals(shapely.box(*geometry.bounds))
+        shapely.prepare(self.geometry)
+
+        lon_min, lat_min, lon_max, lat_max = get_transformer(LAMBERT93, WGS84).transform_bounds(
+            *geometry.bounds, densify_pts=21
+        )
+        self.wgs84_bounds = (
+            lon_min - PREFILTER_MARGIN,
+            lat_min - PREFILTER_MARGIN,
+            lon_max + PREFILTER_MARGIN,
+            lat_max + PREFILTER_MARGIN,
+        )
+
+    def __repr__(self):
+        kind = "box" if self.is_box else "polygon"
+        return f"Region {kind} {tuple(round(v) for v in self.geometry.bounds)} (EPSG:2154)"
+
+    @classmethod
+    def box(cls, xmin: float, ymin: float, xmax: float, ymax: float, crs: str = LAMBERT93) -> "Region":
+        """Rectangle given by its bounds in `crs` (lon/lat order for WGS84)"""
+        return cls(shapely.box(xmin, ymin, xmax, ymax), crs)
+
+    @classmethod
+    def around(cls, center: Tuple[float, float], distance: float) -> "Region":
+        """Square of half-side `distance` metres around a Lambert-93 point"""
+        x, y = center
+        return cls.box(x - distance, y - distance, x + distance, y + distance)
+
+    def prefilter(self, latitude, longitude) -> np.ndarray:
+        """Cheap mask of positions inside the WGS84 bounding box of the region"""
+        lat = np.asarray(latitude, dtype=np.float64)
+        lon = np.asarray(longitude, dtype=np.float64)
+        lon_min, lat_min, lon_max, lat_max = self.wgs84_bounds
+        return (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+
+    def contains_xy(self, x, y) -> np.ndarray:
+        """Exact mask of Lambert-93 coordinates inside the region"""
+        if self.is_box:
+            xmin, ymin, xmax, ymax = self.geometry.bounds
+            return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return shapely.contains_xy(self.geometry, x, y)
+
+
+PARIS_REGION = Region.around(PARIS_CENTER, PARIS_MAX_DISTANCE)
+
+
+def as_region(region, crs: str = LAMBERT93) -> Optional[Region]:
+    """Accept a Region, a shapely geometry in `crs`, or None (no filtering)"""
+    if region is None or isinstance(region, Region):
+        return region
+    return Region(region, crs)
+
+
+def add_lambert_columns(
+    data: pd.DataFrame,
+    transformer: Optional[pyproj.Transformer] = None,
+    region: Optional[Region] = None,
+) -> pd.DataFrame:
+    """Add `x_lambert`/`y_lambert` columns in place, projecting only rows with a position
+
+    Rows without latitude or longitude, or outside the bounding box of
+    `region`, get NaN. Does nothing when the columns already exist, so the
+    projection is done once per table.
+    """
+    if {"x_lambert", "y_lambert"}.issubset(data.columns):
+        return data
+    transformer = transformer or get_transformer()
+
+    x = np.full(len(data), np.nan)
+    y = np.full(len(data), np.nan)
+    lat = data["latitude"].to_numpy(np.float64)
+    lon = data["longitude"].to_numpy(np.float64)
+    located = ~(np.isnan(lat) | np.isnan(lon))
+    if region is not None:
+        located &= region.prefilter(lat, lon)
+    if located.any():
+        x[located], y[located] = transformer.transform(lon[located], lat[located])
+    data["x_lambert"] = x
+    data["y_lambert"] = y
+    return data
+
+
+def _simplify(data: pd.DataFrame, x, y, group, tolerance: float, max_gap: Optional[float]) -> np.ndarray:
+    """Douglas-Peucker mask on Lambert-93 x/y and altitude (metres) of time-sorted rows"""
+    coords = [x, y]
+    if "altitude" in data.columns:
+        altitude = pd.to_numeric(data["altitude"], errors="coerce").to_numpy(np.float64)
+        coords.append(np.nan_to_num(altitude) * FEET_TO_METRES)
+    return simplify_mask(
+        np.column_stack(coords), group, tolerance, epoch_seconds(data["timestamp"]), max_gap
+    )
+
+
+def simplify_trajectory(
+    trajectory: pd.DataFrame,
+    tolerance: float,
+    max_gap: Optional[float] = None,
+    group: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Rows of a time-sorted trajectory kept by Douglas-Peucker simplification
+
+    Positions are compared in Lambert-93 metres (reusing `x_lambert`/
+    `y_lambert` when present) together with the altitude.
+    """
+    if len(trajectory) < 3:
+        return trajectory
+    if {"x_lambert", "y_lambert"}.issubset(trajectory.columns):
+        x = trajectory["x_lambert"].to_numpy(np.float64)
+        y = trajectory["y_lambert"].to_numpy(np.float64)
+    else:
+        x, y = get_transformer().transform(
+            trajectory["longitude"].to_numpy(np.float64), trajectory["latitude"].to_numpy(np.float64)
+        )
+    return trajectory[_simplify(trajectory, x, y, group, tolerance, max_gap)]
+
+
+def trajectories_to_geodataframes(
+    data: pd.DataFrame,
+    group: np.ndarray,
+    transformer: Optional[pyproj.Transformer] = None,
+    key_columns: Iterable[str] = ("icao24", "callsign"),
+    region: Optional[Region] = PARIS_REGION,
+    tolerance: Optional[float] = None,
+    max_gap: Optional[float] = None,
+) -> Tuple[Optional[gpd.GeoDataFrame], Optional[gpd.GeoDataFrame]]:
+    """Project the trajectories of many flights at once
+
+    `group` gives the flight number of each row of `data`. Rows without
+    latitude, longitude or altitude are dropped, as are rows outside the
+    WGS84 bounding box of `region`; the others are projected to Lambert-93
+    in a single call and kept if they fall in `region` (the Paris region
+    by default, None keeps everything). Returns (points, lines): one point per row with `x_lambert`,
+    `y_lambert` and the flight number in `group`, and one linestring per
+    flight with at least two points, or None when nothing is left.
+
+    Existing `x_lambert`/`y_lambert` columns (see `add_lambert_columns`)
+    are reused instead of projecting again. With a `tolerance` (metres),
+    trajectories are simplified before building the geometries (see
+    `simplify_mask`) and the compression ratio is stored in
+    `points.attrs["compression_ratio"]`.
+    """
+    projected = {"x_lambert", "y_lambert"}.issubset(data.columns)
+    transformer = transformer or get_transformer()
+
+    group = np.asarray(group)
+    key_columns = [col for col in key_columns if col in data.columns]
+    columns = [col for col in TRAJECTORY_COLUMNS if col in data.columns]
+    if "groundspeed" in data.columns:
+        columns.append("groundspeed")
+    if projected:
+        columns += ["x_lambert", "y_lambert"]
+
+    valid = data[["latitude", "longitude", "altitude"]].notna().all(axis=1).to_numpy(copy=True)
+    if region is not None:
+        valid &= region.prefilter(data["latitude"], data["longitude"])
+    points = data.loc[valid, list(dict.fromkeys(key_columns + columns))].reset_index(drop=True)
+    points["group"] = group[valid]
+    if len(points) == 0:
+        return None, None
+
+    if pd.api.types.is_datetime64_any_dtype(points["timestamp"]):
+        points["timestamp_dt"] = points["timestamp"]
+    else:
+        points["timestamp_dt"] = pd.to_datetime(points["timestamp"], unit="s")
+    points = points.sort_values(["group", "timestamp_dt"], kind="stable").reset_index(drop=True)
+
+    lat = points["latitude"].to_numpy(np.float64)
+    lon = points["longitude"].to_numpy(np.float64)
+    if projected:
+        # Rows left out of the cached projection (other region) are projected now
+        x = points["x_lambert"].to_numpy(np.float64, copy=True)
+        y = points["y_lambert"].to_numpy(np.float64, copy=True)
+        missing = np.isnan(x)
+        if missing.any():
+            x[missing], y[missing] = transformer.transform(lon[missing], lat[missing])
+    else:
+        x, y = transformer.transform(lon, lat)
+    in_region = np.ones(len(points), dtype=bool) if region is None else region.contains_xy(x, y)
+    if not in_region.any():
+        return None, None
+
+    points = points[in_region].reset_index(drop=True)
+    x, y = x[in_region], y[in_region]
+    n_points = len(points)
+    if tolerance is not None:
+        kept = _simplify(points, x, y, points["group"].to_numpy(), tolerance, max_gap)
+        points = points[kept].reset_index(drop=True)
+        x, y = x[kept], y[kept]
+    points["x_lambert"] = x
+    points["y_lambert"] = y
+    points_gdf = gpd.GeoDataFrame(points, geometry=shapely.points(x, y), crs=LAMBERT93)
+    points_gdf.attrs["compression_ratio"] = compression_ratio(n_points, len(points))
+
+    # One linestring per flight with at least two points, built from the
+    # coordinates and the flight boundaries of the sorted table
+    flight_codes = pd.factorize(points["group"].to_numpy())[0]
+    starts = np.flatnonzero(np.r_[True, flight_codes[1:] != flight_codes[:-1]])
+    counts = np.diff(np.append(starts, len(points)))
+    keep = np.repeat(counts > 1, counts)
+    if not keep.any():
+        return points_gdf, None
+
+    lines = shapely.linestrings(
+        np.column_stack([x[keep], y[keep]]), indices=pd.factorize(flight_codes[keep])[0]
+    )
+    first = starts[counts > 1]
+    lines_df = points.loc[first, key_columns + ["group"]].reset_index(drop=True)
+    lines_df["n_points"] = counts[counts > 1]
+    lines_gdf = gpd.GeoDataFrame(lines_df, geometry=lines, crs=LAMBERT93)
+    return points_gdf, lines_gdf
+
+
+def flights_to_geodataframes(
+    flights: Iterable,
+    transformer: Optional[pyproj.Transformer] = None,
+    region: Optional[Region] = PARIS_REGION,
+    tolerance: Optional[float] = None,
+    max_gap: Optional[float] = None,
+) -> Tuple[Optional[gpd.GeoDataFrame], Optional[gpd.GeoDataFrame]]:
+    """Project a list of flight objects (anything with a `data` table) at once"""
+    tables = [flight.data for flight in flights]
+    if not tables:
+        return None, None
+    group = np.repeat(np.arange(len(tables)), [len(table) for table in tables])
+    return trajectories_to_geodataframes(
+        pd.concat(tables, ignore_index=True), group, transformer,
+        region=region, tolerance=tolerance, max_gap=max_gap,
+    )
@@ -0,0 +1,436 @@
+# %%
+# Batched InfluxDB line-protocol writer
+# Line protocol is built from whole column arrays (one NumPy string operation
+# per column instead of one Point object per row) and sent by a background
+# thread in batches bounded by size and age, over one persistent HTTP
+# connection to the InfluxDB v2 write endpoint, with retries and a bounded
+# queue that blocks producers when the database falls behind.
+
+import gzip
+import http.client
+import queue
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+
+# Points per request and longest time (s) a point waits in the buffer
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Chunks waiting for the sender thread before `write` blocks
+DEFAULT_MAX_PENDING = 64
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_INTERVAL = 0.5
+MAX_RETRY_DELAY = 30.0
+
+# Timestamp units of the write API, in nanoseconds
+PRECISIONS = {"s": 10**9, "ms": 10**6, "us": 10**3, "ns": 1}
+
+# Trajectory columns written as fields, with their InfluxDB field name
+TRAJECTORY_FIELDS = {
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "altitude": "altitude",
+    "vertical_rate": "vertical_rate",
+    "ground_speed": "ground_speed",
+    "groundspeed": "ground_speed",
+}
+
+
+def _escape(text: str, special: str) -> str:
+    text = text.replace("\\", "\\\\")
+    for char in special:
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+def _escape_key(text) -> str:
+    """Escape a measurement, tag key, tag value or field key"""
+    return _escape(str(text), ", =")
+
+
+def _tag_strings(key: str, values, n: int) -> np.ndarray:
+    """',key=value' for every row ('' where the value is missing or empty)"""
+    prefix = "," + _escape_key(key) + "="
+    if np.ndim(values) == 0:
+        missing = values is None or values == "" or (isinstance(values, float) and np.isnan(values))
+        return np.full(n, "" if missing else prefix + _escape_key(values), dtype=object)
+
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    escaped = np.array(
+        [prefix + _escape_key(value) if value != "" else "" for value in uniques] + [""], dtype=object
+    )
+    return escaped[codes]
+
+
+def _field_strings(key: str, values) -> np.ndarray:
+    """'key=value' for every row ('' where the value is missing or not finite)"""
+    values = np.asarray(values)
+    if values.dtype.kind != "f":
+        values = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(np.float64)
+    # NumPy prints the shortest repr of each float ('1459.0', '48.72')
+    text = np.char.add(_escape_key(key) + "=", values.astype(str))
+    return np.where(np.isfinite(values), text, "")
+
+
+def _timestamps(times, precision: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Integer timestamps in `precision` from datetimes or epoch seconds, and the known mask"""
+    times = times.to_numpy() if isinstance(times, pd.Series) else np.asarray(times)
+    if times.dtype == object:
+        times = pd.to_datetime(pd.Series(times), utc=True).dt.tz_localize(None).to_numpy()
+    if np.issubdtype(times.dtype, np.datetime64):
+        known = ~np.isnat(times)
+        nanoseconds = times.astype("datetime64[ns]").astype(np.int64)
+        return np.where(known, nanoseconds // PRECISIONS[precision], 0), known
+    seconds = times.astype(np.float64)
+    known = ~np.isnan(seconds)
+    stamps = np.round(np.where(known, seconds, 0.0) * (10**9 / PRECISIONS[precision]))
+    return stamps.astype(np.int64), known
+
+
+def line_protocol(
+    measurement: str,
+    fields: Mapping[str, Sequence],
+    times,
+    tags: Optional[Mapping[str, object]] = None,
+    precision: str = "ms",
+) -> List[str]:
+    """Line-protocol records of one point per row, built column by column
+
+    `fields` maps field names to numeric arrays, `tags` maps tag names to
+    arrays or to a scalar shared by all rows, `times` holds datetimes or
+    epoch seconds. NaN fields and empty tags are left out, and rows without
+    any field or timestamp are skipped.
+    """
+    n = len(times)
+    if n == 0:
+        return []
+
+    field_text = [_field_strings(key, values) for key, values in fields.items()]
+    present = np.zeros(n, dtype=bool)
+    joined = np.full(n, "", dtype=object)
+    for text in field_text:
+        has_value = text != ""
+        separator = np.where(present & has_value, ",", "")
+        joined = joined + separator + text.astype(object)
+        present |= has_value
+
+    head = np.full(n, _escape(measurement, ", "), dtype=object)
+    for key, values in (tags or {}).items():
+        head = head + _tag_strings(key, values, n)
+
+    stamps, known = _timestamps(times, precision)
+    valid = present & known
+    lines = head + " " + joined + " " + stamps.astype(str).astype(object)
+    return lines[valid].tolist()
+
+
+def trajectory_lines(
+    trajectory: pd.DataFrame,
+    tags: Optional[Mapping[str, object]] = None,
+    measurement: str = "trajectory",
+    precision: str = "ms",
+) -> List[str]:
+    """Line protocol of trajectory points (`get_trajectory` columns)
+
+    Constant tags such as flight_id are given in `tags`; icao24 and callsign
+    columns of the trajectory are written as tags when not given.
+    """
+    tags = dict(tags or {})
+    for key in ("icao24", "callsign"):
+        if key not in tags and key in trajectory.columns:
+            tags[key] = trajectory[key].to_numpy()
+    fields = {}
+    for column, name in TRAJECTORY_FIELDS.items():
+        if column in trajectory.columns and name not in fields:
+            fields[name] = trajectory[column].to_numpy()
+    return line_protocol(measurement, fields, trajectory["timestamp"], tags, precision)
+
+
+class InfluxWriteError(Exception):
+    """A batch was rejected by InfluxDB or could not be sent"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class InfluxLineWriter:
+    """Asynchronous, batched writer to the InfluxDB v2 `/api/v2/write` endpoint
+
+    `write(lines)` queues line-protocol records and returns at once; it
+    blocks only when `max_pending` chunks are already waiting (backpressure).
+    A background thread sends batches of at most `batch_size` lines, and
+    sends a partial batch once its oldest line is `flush_interval` seconds
+    old. Failed requests (connection errors, 429 and 5xx) are retried with
+    exponential backoff, honouring Retry-After; other errors drop the batch.
+    Counters are in `stats`. Lines written with a `key` (such as a flight
+    id) are tracked: keys with at least one line in a dropped batch are
+    returned by `pop_failed_keys()`. `pop_latencies()` gives the duration of
+    each successful request (retries included) and the delivery latency of
+    each `write` call, from queueing to the acknowledgment of its last line.
+    Use `flush()` to wait for every queued line and `close()` (or a `with`
+    block) to stop the thread.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        org: str,
+        bucket: str,
+        precision: str = "ms",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_interval: float = DEFAULT_RETRY_INTERVAL,
+        compress: bool = False,
+        timeout: float = 10.0,
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {list(PRECISIONS)}, not {precision!r}")
+        parts = urlsplit(url)
+        self.url = url
+        self.precision = precision
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.compress = compress
+        self.timeout = timeout
+        self._scheme = parts.scheme or "http"
+        self._netloc = parts.netloc
+        self._path = parts.path.rstrip("/") + "/api/v2/write?" + urlencode(
+            {"org": org, "bucket": bucket, "precision": precision}
+        )
+        self._headers = {
+            "Authorization": f"Token {token}",
+            "Content-Type": "text/plain; charset=utf-8",
+            "Accept": "application/json",
+        }
+        if compress:
+            self._headers["Content-Encoding"] = "gzip"
+
+        self.stats = {
+            "points_queued": 0,
+            "points_written": 0,
+            "points_failed": 0,
+            "batches": 0,
+            "retries": 0,
+            "bytes": 0,
+            "last_error": None,
+        }
+        self._connection = None
+        self._failed_keys = set()
+        self._latencies = {"send": [], "delivery": []}
+        self._keys_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        # The sender thread starts with the first write
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._start_lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"InfluxLineWriter {self.url} ({self.stats['points_written']} points written, "
+            f"{self.stats['points_failed']} failed, {self._queue.qsize()} chunks pending)"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def write(self, lines: Sequence[str], timeout: Optional[float] = None, key=None):
+        """Queue line-protocol records, blocking while the queue is full"""
+        if self._closed:
+            raise RuntimeError("InfluxLineWriter is closed")
+        if len(lines) == 0:
+            return
+        if not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread.ident is None:
+                    self._thread.start()
+        self._queue.put((list(lines), key, time.perf_counter()), timeout=timeout)
+        self.stats["points_queued"] += len(lines)
+
+    def write_trajectory(self, trajectory: pd.DataFrame, tags: Optional[Mapping[str, object]] = None,
+                         measurement: str = "trajectory", key=None) -> int:
+        """Queue the points of a trajectory DataFrame; returns the number of points"""
+        lines = trajectory_lines(trajectory, tags, measurement, self.precision)
+        self.write(lines, key=key)
+        return len(lines)
+
+    def pop_failed_keys(self) -> set:
+        """Keys of the lines dropped since the last call (call after `flush`)"""
+        with self._keys_lock:
+            failed, self._failed_keys = self._failed_keys, set()
+        return failed
+
+    def pop_latencies(self) -> Dict[str, np.ndarray]:
+        """Send and delivery latencies (s) since the last call (call after `flush`)"""
+        with self._keys_lock:
+            latencies, self._latencies = self._latencies, {"send": [], "delivery": []}
+        return {kind: np.array(values) for kind, values in latencies.items()}
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything queued so far; False if `timeout` expired first"""
+        if self._closed or self._thread.ident is None:
+            return not self._thread.is_alive()
+        self._queue.put(self._FLUSH, timeout=timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        """Flush, then stop the sender thread and close the connection"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.ident is None:
+            return
+        self._queue.put(self._STOP, timeout=timeout)
+        self._thread.join(timeout)
+
+    def _run(self):
+        buffer: List[str] = []
+        # [key, line count, queued time] runs covering `buffer` in order
+        runs: Deque[list] = deque()
+        oldest = None
+        while True:
+            wait = None if oldest is None else max(oldest + self.flush_interval - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                self._send_buffer(buffer, runs, force=True)
+                oldest = None
+                continue
+
+            try:
+                if item is self._FLUSH or item is self._STOP:
+                    self._send_buffer(buffer, runs, force=True)
+                    oldest = None
+                    if item is self._STOP:
+                        self._disconnect()
+                        return
+                else:
+                    if oldest is None:
+                        oldest = time.monotonic()
+                    lines, key, queued = item
+                    buffer.extend(lines)
+                    runs.append([key, len(lines), queued])
+                    self._send_buffer(buffer, runs, force=False)
+                    if not buffer:
+                        oldest = None
+            finally:
+                self._queue.task_done()
+
+    def _send_buffer(self, buffer: List[str], runs: Deque[list], force: bool):
+        """Send full batches from the front of `buffer` (and the rest if `force`)"""
+        while len(buffer) >= self.batch_size or (force and buffer):
+            batch = buffer[: self.batch_size]
+            del buffer[: self.batch_size]
+            # Keys of the batch's lines, taken from the front runs, and the
+            # queueing times of the runs whose last line is in the batch
+            keys = set()
+            completed = []
+            remaining = len(batch)
+            while remaining:
+                run = runs[0]
+                taken = min(run[1], remaining)
+                keys.add(run[0])
+                run[1] -= taken
+                remaining -= taken
+                if run[1] == 0:
+                    completed.append(run[2])
+                    runs.popleft()
+            if self._send(batch):
+                now = time.perf_counter()
+                with self._keys_lock:
+                    self._latencies["delivery"].extend(now - queued for queued in completed)
+            else:
+                keys.discard(None)
+                with self._keys_lock:
+                    self._failed_keys.update(keys)
+
+    def _send(self, batch: List[str]) -> bool:
+        payload = "\n".join(batch).encode("utf-8")
+        if self.compress:
+            payload = gzip.compress(payload, compresslevel=1)
+
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._post(payload)
+            except InfluxWriteError as e:
+                self.stats["last_error"] = str(e)
+                if not e.retryable or attempt == self.max_retries:
+                    break
+                self.stats["retries"] += 1
+                delay = min(self.retry_interval * 2**attempt, MAX_RETRY_DELAY)
+                time.sleep(e.retry_after if e.retry_after is not None else delay)
+            else:
+                self.stats["points_written"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["bytes"] += len(payload)
+                with self._keys_lock:
+                    self._latencies["send"].append(time.perf_counter() - start)
+                return True
+        self.stats["points_failed"] += len(batch)
+        return False
+
+    def _post(self, payload: bytes):
+        """One request on the persistent connection; raises InfluxWriteError on failure"""
+        try:
+            if self._connection is None:
+                connection_class = (
+                    http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+                )
+                self._connection = connection_class(self._netloc, timeout=self.timeout)
+            self._connection.request("POST", self._path, body=payload, headers=self._headers)
+            response = self._connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self._disconnect()
+            raise InfluxWriteError(f"connection error: {e}") from e
+
+        if response.status >= 300:
+            if response.getheader("Connection", "").lower() == "close":
+                self._disconnect()
+            retry_after = response.getheader("Retry-After")
+            raise InfluxWriteError(
+                f"HTTP {response.status}: {body[:200].decode('utf-8', 'replace')}",
+                status=response.status,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+
+    def _disconnect(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def writer_from_config(config: Dict, **options) -> InfluxLineWriter:
+    """InfluxLineWriter for the `influxdb` section of GRAFANA_CONFIG"""
+    return InfluxLineWriter(
+        url=config["url"], token=config["token"], org=config["org"], bucket=config["bucket"], **options
+    )
@@ -0,0 +1,424 @@
+# %%
+# Streaming ingest of ADS-B JSONL.gz captures
+# Reads the receiver dumps in fixed-size batches with typed columns instead of
+# building one huge list of dicts before the first DataFrame exists.
+
+import glob
+import gzip
+import json
+import os
+import threading
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import accumulate
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# Number of messages decoded before a typed batch is emitted
+DEFAULT_BATCH_SIZE = 50_000
+
+# Size of the decompressed blocks handed to the JSON decoder
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Typed schema of the message table. Timestamps are stored as datetime64[ns],
+# i.e. int64 epoch nanoseconds, so `.view("int64")` is free.
+ADSB_DTYPES = {
+    "timestamp": "datetime64[ns]",
+    "icao24": "category",
+    "callsign": "category",
+    "df": "category",
+    "tc": "float32",
+    "capability": "category",
+    "altitude": "float32",
+    "source": "category",
+    "vertical_rate": "float32",
+    "vrate_src": "category",
+    "groundspeed": "float32",
+    "track": "float32",
+    "geo_minus_baro": "float32",
+    "selected_altitude": "float32",
+    "latitude": "float64",
+    "longitude": "float64",
+    "lat_cpr": "float64",
+    "lon_cpr": "float64",
+    "parity": "category",
+    "squawk": "category",
+}
+
+# Raw fields that are large and rarely needed once messages are decoded
+RAW_COLUMNS = ("frame", "metadata")
+
+
+def _available_json_backends() -> Dict[str, Callable]:
+    """Return the installed JSON `loads` functions, fastest first"""
+    backends = {}
+    try:
+        import orjson
+        backends["orjson"] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import simdjson
+        backends["simdjson"] = simdjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        backends["ujson"] = ujson.loads
+    except ImportError:
+        pass
+    backends["json"] = json.loads
+    return backends
+
+
+JSON_BACKENDS = _available_json_backends()
+
+# Backends that parse a block faster as one JSON array than line by line
+# (see benchmark_json_decoders.py): stdlib json saves its per-call overhead,
+# while orjson gains nothing on real captures once the lines are joined
+JOINED_BACKENDS = ("json",)
+
+
+class JsonDecoder:
+    """Decode blocks of JSON lines with one backend and count malformed lines
+
+    With `joined` (by default for the backends of JOINED_BACKENDS), a block
+    is parsed as one JSON array instead of one call per line.
+    """
+
+    def __init__(self, backend: str = None, joined: bool = None):
+        if backend is None:
+            backend = next(iter(JSON_BACKENDS))
+        if backend not in JSON_BACKENDS:
+            raise ValueError(
+                f"JSON backend '{backend}' not available. Installed: {list(JSON_BACKENDS)}"
+            )
+        self.backend = backend
+        self.loads = JSON_BACKENDS[backend]
+        self.joined = backend in JOINED_BACKENDS if joined is None else joined
+        self.decoded = 0
+        self.malformed = 0
+
+    def __repr__(self):
+        return (
+            f"JsonDecoder({self.backend}) with {self.decoded} decoded "
+            f"and {self.malformed} malformed lines"
+        )
+
+    def _decode_each(self, lines: List[bytes]) -> List:
+        records = []
+        for line in lines:
+            try:
+                records.append(self.loads(line))
+            except ValueError:
+                self.malformed += 1
+        return records
+
+    def _decode_lines(self, lines: List[bytes]) -> List:
+        """Parse lines as one JSON array, resuming after each malformed line
+
+        The error position of a failed parse gives the malformed line: the
+        lines before it are parsed as one array, it and the malformed lines
+        right after it are decoded alone, and parsing resumes at the next
+        valid line. When the position is unknown or wrong, or once the failed
+        parses have cost more than one pass over the block, the rest is
+        decoded line by line.
+        """
+        ends = list(accumulate(len(line) + 1 for line in lines))
+        budget = ends[-1]
+        records = []
+        start = 0
+        while start < len(lines):
+            try:
+                return records + self.loads(b"[" + b",".join(lines[start:]) + b"]")
+            except ValueError as error:
+                # Invalid UTF-8 is reported with a byte offset instead of a JSON position
+                pos = error.start if isinstance(error, UnicodeDecodeError) else getattr(error, "pos", None)
+            base = ends[start - 1] if start else 0
+            budget -= pos or 0
+            if pos is None or budget < 0:
+                return records + self._decode_each(lines[start:])
+
+            bad = min(max(bisect_right(ends, base + pos - 1), start), len(lines) - 1)
+            malformed = self.malformed
+            try:
+                records += self.loads(b"[" + b",".join(lines[start:bad]) + b"]")
+                records += self._decode_each(lines[bad:bad + 1])
+            except ValueError:
+                records += self._decode_each(lines[start:bad + 1])
+            start = bad + 1
+            if self.malformed == malformed:
+                # The error position did not point at a malformed line
+                return records + self._decode_each(lines[start:])
+
+            # Skip a run of malformed lines without joining the rest each time
+            while start < len(lines):
+                start += 1
+                try:
+                    records.append(self.loads(lines[start - 1]))
+                    break
+                except ValueError:
+                    self.malformed += 1
+        return records
+
+    def decode_block(self, lines: List[bytes]) -> List[Dict]:
+        """Decode a block of non-empty lines in as few backend calls as possible
+
+        The block is parsed as one JSON array (see `_decode_lines`) or line by
+        line, depending on `joined`; malformed lines are skipped and counted.
+        """
+        if not lines:
+            return []
+        records = self._decode_lines(lines) if self.joined else self._decode_each(lines)
+
+        if not all(isinstance(record, dict) for record in records):
+            valid = [record for record in records if isinstance(record, dict)]
+            self.malformed += len(records) - len(valid)
+            records = valid
+
+        self.decoded += len(records)
+        return records
+
+
+def iter_raw_blocks(fileobj, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield decompressed blocks of about `block_size` bytes cut on line boundaries
+
+    Block boundaries only depend on the file content and `block_size`, so the
+    same file is always chunked the same way.
+    """
+    remainder = b""
+    while True:
+        block = fileobj.read(block_size)
+        if not block:
+            break
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        remainder = block[cut:]
+        if cut:
+            yield block[:cut]
+    if remainder:
+        yield remainder
+
+
+def split_lines(block: bytes) -> List[bytes]:
+    """Return the non-empty lines of a raw block"""
+    return [line for line in block.split(b"\n") if line.strip()]
+
+
+def iter_line_blocks(fileobj, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[List[bytes]]:
+    """Yield lists of non-empty lines read from a binary file in large blocks"""
+    for block in iter_raw_blocks(fileobj, block_size):
+        yield split_lines(block)
+
+
+def _select_columns(columns: Optional[Sequence[str]], include_raw: bool) -> List[str]:
+    """Return the ordered list of columns kept in each batch"""
+    selected = list(columns) if columns is not None else list(ADSB_DTYPES)
+    if include_raw:
+        selected += [col for col in RAW_COLUMNS if col not in selected]
+    return selected
+
+
+def _to_typed_frame(records: List[Dict], columns: List[str]) -> pd.DataFrame:
+    """Build one typed DataFrame from a batch of decoded messages"""
+    df = pd.DataFrame.from_records(records, columns=columns)
+
+    for col in columns:
+        dtype = ADSB_DTYPES.get(col)
+        if dtype is None:
+            continue
+        if col == "timestamp":
+            df[col] = pd.to_datetime(
+                pd.to_numeric(df[col], errors="coerce"), unit="s"
+            ).astype("datetime64[ns]")
+        elif dtype == "category":
+            df[col] = df[col].astype("category")
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+
+    return df
+
+
+def _union_categorical(parts: List[pd.Series]) -> pd.Categorical:
+    """Concatenate categorical columns whose categories differ between batches"""
+    categories = pd.Index(
+        sorted(set().union(*(set(part.cat.categories) for part in parts))),
+        dtype=object,
+    )
+    codes = [
+        part.cat.set_categories(categories).cat.codes.to_numpy() for part in parts
+    ]
+    return pd.Categorical.from_codes(np.concatenate(codes), categories)
+
+
+def concat_batches(batches: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate typed batches, keeping categorical columns categorical"""
+    batches = [batch for batch in batches if len(batch) > 0]
+    if not batches:
+        return _to_typed_frame([], _select_columns(None, False))
+    if len(batches) == 1:
+        return batches[0].reset_index(drop=True)
+
+    data = {}
+    for col in batches[0].columns:
+        parts = [batch[col] for batch in batches]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            data[col] = _union_categorical(parts)
+        else:
+            data[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data)
+
+
+def iter_jsonl_gz_batches(
+    filename: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    columns: Optional[Sequence[str]] = None,
+    include_raw: bool = False,
+    decoder: JsonDecoder = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """Yield typed DataFrames of at most `batch_size` messages from a JSONL.gz file
+
+    Only the columns of ADSB_DTYPES are kept by default; `frame` and
+    `metadata` are added when `include_raw` is True. Malformed lines are
+    counted on `decoder` rather than silently dropped.
+    """
+    selected = _select_columns(columns, include_raw)
+    decoder = decoder or JsonDecoder()
+    malformed_before = decoder.malformed
+    records = []
+
+    with gzip.open(filename, "rb") as f:
+        for lines in iter_line_blocks(f, block_size):
+            records.extend(decoder.decode_block(lines))
+
+            while len(records) >= batch_size:
+                yield _to_typed_frame(records[:batch_size], selected)
+                records = records[batch_size:]
+
+    if records:
+        yield _to_typed_frame(records, selected)
+
+    malformed = decoder.malformed - malformed_before
+    if malformed:
+        print(f"{filename}: skipped {malformed} malformed lines")
+
+
+def cache_variant(columns: List[str]) -> str:
+    """Return the cache variant of a column selection (part of the cache key)"""
+    return "typed-v1:" + ",".join(columns)
+
+
+def read_jsonl_gz_typed(
+    filename: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    columns: Optional[Sequence[str]] = None,
+    include_raw: bool = False,
+    decoder: JsonDecoder = None,
+    cache=None,
+) -> pd.DataFrame:
+    """Read a whole JSONL.gz file batch by batch into a single typed DataFrame
+
+    When a `MessageCache` is given, the typed table is read from (and
+    written to) the cache instead of re-parsing an unchanged file.
+    """
+    def load():
+        return concat_batches(
+            iter_jsonl_gz_batches(filename, batch_size, columns, include_raw, decoder)
+        )
+
+    if cache is None:
+        return load()
+    return cache.load(filename, load, cache_variant(_select_columns(columns, include_raw)))
+
+
+def _decode_raw_block(block: bytes, columns: List[str], backend: str):
+    """Process pool task: decode one raw block into a typed DataFrame"""
+    decoder = JsonDecoder(backend)
+    records = decoder.decode_block(split_lines(block))
+    return _to_typed_frame(records, columns), decoder.malformed
+
+
+def receiver_name(filename: str) -> str:
+    """Return the receiver name of a capture file (adsb25/orly.jsonl.gz -> orly)"""
+    name = os.path.basename(filename)
+    for suffix in (".gz", ".jsonl", ".json"):
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+    return name
+
+
+def read_jsonl_gz_many(
+    files: Union[str, Sequence[str]],
+    workers: int = None,
+    columns: Optional[Sequence[str]] = None,
+    include_raw: bool = False,
+    backend: str = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    cache=None,
+) -> pd.DataFrame:
+    """Read several receiver files in parallel into one time-ordered DataFrame
+
+    `files` is a glob pattern or a list of paths. One reader thread per file
+    decompresses it into raw blocks (zlib releases the GIL) and the blocks
+    are decoded in a pool of `workers` processes. Results are reassembled in
+    (file, block) order and stably sorted by timestamp, so the output does
+    not depend on scheduling. A `receiver` column records the source file.
+    Files found in `cache` (a `MessageCache`) are not parsed again.
+    """
+    paths = sorted(glob.glob(files)) if isinstance(files, str) else list(files)
+    if not paths:
+        raise FileNotFoundError(f"No ADS-B file matches {files}")
+
+    selected = _select_columns(columns, include_raw)
+    variant = cache_variant(selected)
+    backend = backend or JsonDecoder().backend
+    workers = workers or os.cpu_count() or 1
+
+    frames = {}
+    if cache is not None:
+        for path in paths:
+            cached = cache.get(path, variant)
+            if cached is not None:
+                frames[path] = cached
+    to_parse = [path for path in paths if path not in frames]
+
+    if to_parse:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Bound the number of raw blocks held in memory at once
+            pending = threading.BoundedSemaphore(2 * workers)
+
+            def submit_blocks(path):
+                futures = []
+                with gzip.open(path, "rb") as f:
+                    for block in iter_raw_blocks(f, block_size):
+                        pending.acquire()
+                        future = pool.submit(_decode_raw_block, block, selected, backend)
+                        future.add_done_callback(lambda _: pending.release())
+                        futures.append(future)
+                return futures
+
+            with ThreadPoolExecutor(max_workers=len(to_parse)) as readers:
+                futures_per_file = list(readers.map(submit_blocks, to_parse))
+
+            for path, futures in zip(to_parse, futures_per_file):
+                results = [future.result() for future in futures]
+                malformed = sum(bad_lines for _, bad_lines in results)
+                if malformed:
+                    print(f"{path}: skipped {malformed} malformed lines")
+                frames[path] = concat_batches(batch for batch, _ in results)
+                if cache is not None:
+                    cache.put(path, frames[path], variant)
+
+    batches = []
+    for path in paths:
+        batch = frames[path].copy()
+        batch["receiver"] = receiver_name(path)
+        batches.append(batch)
+
+    df = concat_batches(batches)
+    if "receiver" in df.columns:
+        df["receiver"] = df["receiver"].astype("category")
+    return df.sort_values("timestamp", kind="mergesort", ignore_index=True)
@@ -0,0 +1,259 @@
+# %%
+# Bulk flight metadata loading
+# Flight summaries are gathered in one columnar buffer and written in a single
+# statement batch: PostgreSQL receives them through COPY into a temporary
+# staging table merged with ON CONFLICT (flight_id) DO UPDATE, so reruns
+# update rows instead of failing on the primary key. A SQLite file with the
+# same table and upsert semantics is used when PostgreSQL is not reachable.
+
+import io
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+import pandas as pd
+
+try:
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+    POSTGRESQL_AVAILABLE = True
+except ImportError:
+    POSTGRESQL_AVAILABLE = False
+    print("PostgreSQL client not available. Install with: pip install psycopg2-binary")
+
+METADATA_TABLE = "flight_metadata"
+
+# Columns of the metadata table (keys of FlightGrafana.get_flight_summary)
+# with their PostgreSQL type; created_at is filled by the database
+METADATA_COLUMNS = {
+    "flight_id": "VARCHAR(100) PRIMARY KEY",
+    "icao24": "VARCHAR(10)",
+    "callsign": "VARCHAR(20)",
+    "start_time": "TIMESTAMP",
+    "end_time": "TIMESTAMP",
+    "duration_minutes": "FLOAT",
+    "total_points": "INTEGER",
+    "altitude_min": "FLOAT",
+    "altitude_max": "FLOAT",
+    "vertical_rate_min": "FLOAT",
+    "vertical_rate_max": "FLOAT",
+    "is_landing": "BOOLEAN",
+    "is_takeoff": "BOOLEAN",
+    "start_lat": "FLOAT",
+    "start_lon": "FLOAT",
+    "end_lat": "FLOAT",
+    "end_lon": "FLOAT",
+}
+
+# pandas dtype of each column in the buffer
+_COLUMN_DTYPES = {
+    "TIMESTAMP": "datetime64[ns]",
+    "FLOAT": "float64",
+    "INTEGER": "Int64",
+    "BOOLEAN": "boolean",
+}
+
+# SQLite affinity of the PostgreSQL types
+_SQLITE_TYPES = {"VARCHAR": "TEXT", "TIMESTAMP": "TEXT", "FLOAT": "REAL", "INTEGER": "INTEGER", "BOOLEAN": "INTEGER"}
+
+DEFAULT_SQLITE_PATH = "adsb_metadata.sqlite"
+DEFAULT_POOL_SIZE = 4
+
+
+def metadata_schema(dialect: str = "postgresql", table: str = METADATA_TABLE) -> str:
+    """CREATE TABLE/INDEX statements of the metadata table for 'postgresql' or 'sqlite'"""
+    columns = []
+    for name, sql_type in METADATA_COLUMNS.items():
+        if dialect == "sqlite":
+            base, _, rest = sql_type.partition(" ")
+            sql_type = " ".join(filter(None, [_SQLITE_TYPES[base.split("(")[0]], rest]))
+        columns.append(f"{name} {sql_type}")
+    columns.append("created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(columns) + "\n);\n"
+        f"CREATE INDEX IF NOT EXISTS idx_flight_start_time ON {table}(start_time);\n"
+        f"CREATE INDEX IF NOT EXISTS idx_flight_icao24 ON {table}(icao24);\n"
+        f"CREATE INDEX IF NOT EXISTS idx_flight_callsign ON {table}(callsign);\n"
+    )
+
+
+def _upsert_clause(columns: List[str]) -> str:
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in columns if name != "flight_id")
+    return f"ON CONFLICT (flight_id) DO UPDATE SET {updates}"
+
+
+class MetadataBuffer:
+    """Columnar buffer of flight summaries (one list per metadata column)"""
+
+    def __init__(self, summaries: Iterable[Dict] = ()):
+        self.columns = {name: [] for name in METADATA_COLUMNS}
+        for summary in summaries:
+            self.add(summary)
+
+    def __len__(self):
+        return len(self.columns["flight_id"])
+
+    def __repr__(self):
+        return f"MetadataBuffer with {len(self)} flight summaries"
+
+    def add(self, summary: Dict):
+        """Append one summary; missing keys are NULL, extra keys are ignored"""
+        for name, values in self.columns.items():
+            values.append(summary.get(name))
+
+    def extend(self, summaries: Iterable[Dict]):
+        for summary in summaries:
+            self.add(summary)
+
+    def clear(self):
+        for values in self.columns.values():
+            values.clear()
+
+    def to_frame(self) -> pd.DataFrame:
+        """Typed DataFrame with one row per flight_id (the last summary wins)"""
+        frame = pd.DataFrame(self.columns)
+        for name, sql_type in METADATA_COLUMNS.items():
+            dtype = _COLUMN_DTYPES.get(sql_type.split(" ")[0])
+            if dtype == "datetime64[ns]":
+                frame[name] = pd.to_datetime(frame[name])
+            elif dtype is not None:
+                frame[name] = pd.to_numeric(frame[name], errors="coerce").astype(dtype)
+        return frame.drop_duplicates("flight_id", keep="last").reset_index(drop=True)
+
+
+class PostgresMetadataSink:
+    """Upserts metadata in bulk over a pool of PostgreSQL connections
+
+    Each `write` takes a pooled connection, COPYs the buffer as CSV into a
+    temporary staging table and merges it into the metadata table with one
+    INSERT ... SELECT ... ON CONFLICT (flight_id) DO UPDATE, in a single
+    transaction.
+    """
+
+    dialect = "postgresql"
+
+    def __init__(self, config: Dict, pool_size: int = DEFAULT_POOL_SIZE, table: str = METADATA_TABLE):
+        self.table = table
+        self.pool = ThreadedConnectionPool(
+            1, pool_size,
+            host=config["host"], port=config["port"], dbname=config["database"],
+            user=config["user"], password=config["password"],
+        )
+        self._schema_ready = False
+
+    def __repr__(self):
+        return f"PostgresMetadataSink into {self.table}"
+
+    @contextmanager
+    def connection(self):
+        """A pooled connection, committed on success and rolled back on error"""
+        conn = self.pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(metadata_schema("postgresql", self.table))
+        self._schema_ready = True
+
+    def write(self, buffer: MetadataBuffer) -> int:
+        """COPY + upsert the buffer; returns the number of flights written"""
+        frame = buffer.to_frame()
+        if len(frame) == 0:
+            return 0
+        self.ensure_schema()
+
+        csv = io.StringIO()
+        frame.to_csv(csv, header=False, index=False, date_format="%Y-%m-%d %H:%M:%S.%f")
+        csv.seek(0)
+        columns = list(frame.columns)
+        column_list = ", ".join(columns)
+        staging = f"{self.table}_staging"
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE {staging} (LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", csv)
+            cursor.execute(
+                f"INSERT INTO {self.table} ({column_list}) SELECT {column_list} FROM {staging} "
+                + _upsert_clause(columns)
+            )
+        return len(frame)
+
+    def close(self):
+        self.pool.closeall()
+
+
+class SQLiteMetadataSink:
+    """Same table and upsert semantics in a local SQLite file (fallback and tests)"""
+
+    dialect = "sqlite"
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, table: str = METADATA_TABLE):
+        self.path = path
+        self.table = table
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SQLiteMetadataSink into {self.path}:{self.table}"
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the file and create the table on first use (call with the lock held)"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            with conn:
+                conn.executescript(metadata_schema("sqlite", self.table))
+            self._conn = conn
+        return self._conn
+
+    def ensure_schema(self):
+        with self._lock:
+            self._connection()
+
+    def write(self, buffer: MetadataBuffer) -> int:
+        """Upsert the buffer in one transaction; returns the number of flights written"""
+        frame = buffer.to_frame()
+        if len(frame) == 0:
+            return 0
+
+        for name in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[name]):
+                frame[name] = frame[name].dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+        rows = frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+        columns = list(frame.columns)
+        statement = (
+            f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            + _upsert_clause(columns)
+        )
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(statement, rows)
+        return len(frame)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def metadata_sink_from_config(config: Dict, sqlite_path: str = DEFAULT_SQLITE_PATH,
+                              pool_size: int = DEFAULT_POOL_SIZE):
+    """PostgreSQL sink for the `postgresql` section of GRAFANA_CONFIG, or SQLite if unavailable"""
+    if POSTGRESQL_AVAILABLE:
+        try:
+            return PostgresMetadataSink(config, pool_size)
+        except psycopg2.Error as e:
+            print(f"PostgreSQL unreachable ({e}), writing metadata to {sqlite_path}")
+    return SQLiteMetadataSink(sqlite_path)
@@ -0,0 +1,324 @@
+# %%
+# Event-time replay of recorded flights
+# The valid positions of every flight are merged once into a single
+# time-ordered columnar stream (one stable argsort of the concatenated
+# per-flight arrays). An asyncio scheduler then releases, on each wall-clock
+# tick, the points whose event time falls in the next `tick * speed` seconds:
+# simultaneous aircraft are replayed together, and thousands of them cost one
+# array slice per tick instead of one timer per aircraft or per point.
+
+import asyncio
+import inspect
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from adsb_influx import TRAJECTORY_FIELDS, line_protocol
+from adsb_metadata import MetadataBuffer
+
+REPLAY_FIELDS = ("latitude", "longitude", "altitude", "vertical_rate", "ground_speed")
+DEFAULT_SPEED = 1.0
+DEFAULT_TICK = 1.0
+# Sink calls that may run concurrently before the scheduler waits for one
+DEFAULT_MAX_IN_FLIGHT = 4
+
+LATENESS_PERCENTILES = (50, 99)
+
+
+def _store_array(store, name: str) -> np.ndarray:
+    """Whole column of a ColumnStore as float64 (NaN when missing), or datetime64[ns] for timestamps"""
+    if name not in store:
+        return np.full(len(store), np.nan)
+    values = store.array(name)
+    if name == "timestamp":
+        if not np.issubdtype(values.dtype, np.datetime64):
+            values = pd.to_datetime(values, unit="s").to_numpy()
+        return values.astype("datetime64[ns]")
+    return pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(np.float64)
+
+
+def _instant(value) -> Optional[np.datetime64]:
+    """A timestamp given as epoch seconds, a string or a datetime, as datetime64[ns]"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return np.datetime64(int(round(value * 1e9)), "ns")
+    return np.datetime64(pd.Timestamp(value).value, "ns")
+
+
+class ReplayStream:
+    """Points of many flights merged in event-time order, stored as flat arrays
+
+    Point i happened at `times[i]` (datetime64[ns], non-decreasing) and
+    belongs to flight `flight[i]`, a row of `flights` (flight_id, icao24,
+    callsign, end). `columns` holds the point fields; `sources` keeps the
+    flight objects the stream was built from, in the same order as `flights`.
+    """
+
+    def __init__(self, times: np.ndarray, flight: np.ndarray, columns: Dict[str, np.ndarray],
+                 flights: pd.DataFrame, sources: List = None):
+        self.times = times
+        self.flight = flight
+        self.columns = columns
+        self.flights = flights
+        self.sources = sources or []
+        # Flights ordered by the time of their last point, to find those ending in a window
+        ends = flights["end"].to_numpy("datetime64[ns]")
+        self.end_order = np.argsort(ends, kind="stable")
+        self.sorted_ends = ends[self.end_order]
+
+    def __repr__(self):
+        span = (self.end - self.start) / 3600 if len(self) else 0
+        return f"ReplayStream with {len(self.flights)} flights, {len(self)} points over {span:.1f} h"
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def start(self) -> Optional[float]:
+        """Epoch seconds of the first point"""
+        return self.times[0].astype(np.int64) / 1e9 if len(self) else None
+
+    @property
+    def end(self) -> Optional[float]:
+        """Epoch seconds of the last point"""
+        return self.times[-1].astype(np.int64) / 1e9 if len(self) else None
+
+    @classmethod
+    def from_flights(cls, flights: Iterable, fields=REPLAY_FIELDS) -> "ReplayStream":
+        """Merge the positions (latitude, longitude and altitude known) of FlightGrafana views"""
+        times, owners, keys, sources = [], [], [], []
+        values = {name: [] for name in fields}
+        # Columns are converted once per store; each flight then takes a slice
+        converted = {}
+        for flight in flights:
+            if id(flight.store) not in converted:
+                converted[id(flight.store)] = {
+                    name: _store_array(flight.store, name)
+                    for name in {"timestamp", "latitude", "longitude", "altitude", *fields}
+                }
+            arrays = {
+                name: column[flight.start:flight.stop] for name, column in converted[id(flight.store)].items()
+            }
+            valid = ~(np.isnan(arrays["latitude"]) | np.isnan(arrays["longitude"]) | np.isnan(arrays["altitude"]))
+            if not valid.any():
+                continue
+            flight_times = arrays["timestamp"][valid]
+            metrics = flight.metrics()
+            times.append(flight_times)
+            owners.append(np.full(len(flight_times), len(keys), dtype=np.int32))
+            for name in fields:
+                values[name].append(arrays[name][valid])
+            keys.append((metrics["flight_id"], metrics["icao24"], metrics["callsign"], flight_times.max()))
+            sources.append(flight)
+
+        if not times:
+            empty = pd.DataFrame(columns=["flight_id", "icao24", "callsign", "end"])
+            return cls(np.zeros(0, dtype="datetime64[ns]"), np.zeros(0, dtype=np.int32),
+                       {name: np.zeros(0) for name in fields}, empty)
+
+        times = np.concatenate(times)
+        order = np.argsort(times, kind="stable")
+        return cls(
+            times[order],
+            np.concatenate(owners)[order],
+            {name: np.concatenate(arrays)[order] for name, arrays in values.items()},
+            pd.DataFrame(keys, columns=["flight_id", "icao24", "callsign", "end"]),
+            sources,
+        )
+
+
+class ReplayBatch:
+    """Points released by one tick (stream rows start:stop) and the flights that ended with them"""
+
+    __slots__ = ("stream", "start", "stop", "window_start", "window_end", "ended")
+
+    def __init__(self, stream: ReplayStream, start: int, stop: int,
+                 window_start: np.datetime64, window_end: np.datetime64, ended: np.ndarray):
+        self.stream = stream
+        self.start = start
+        self.stop = stop
+        self.window_start = window_start
+        self.window_end = window_end
+        self.ended = ended
+
+    def __repr__(self):
+        return (
+            f"ReplayBatch of {len(self)} points, {len(self.ended)} flights ended, "
+            f"{pd.Timestamp(self.window_start)} to {pd.Timestamp(self.window_end)}"
+        )
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.stream.times[self.start:self.stop]
+
+    def column(self, name: str) -> np.ndarray:
+        return self.stream.columns[name][self.start:self.stop]
+
+    def keys(self, name: str) -> np.ndarray:
+        """A `flights` column (flight_id, icao24, callsign) for each point"""
+        return self.stream.flights[name].to_numpy()[self.stream.flight[self.start:self.stop]]
+
+    def lines(self, measurement: str = "trajectory", precision: str = "ms") -> List[str]:
+        """Line protocol of the points, tagged with flight_id, icao24 and callsign"""
+        fields = {}
+        for column, name in TRAJECTORY_FIELDS.items():
+            if column in self.stream.columns and name not in fields:
+                fields[name] = self.column(column)
+        tags = {name: self.keys(name) for name in ("flight_id", "icao24", "callsign")}
+        return line_protocol(measurement, fields, self.times, tags, precision)
+
+
+class ReplayEngine:
+    """Replays a ReplayStream against the wall clock with asyncio
+
+    Tick k is due `k * tick` wall-clock seconds after the start and covers
+    the next `tick * speed` seconds of event time: its points and the flights
+    whose last point it contains are handed to `sink(batch)` (a function or
+    a coroutine function); ticks without either are not delivered. Deadlines
+    are absolute, so timing does not drift, and up to `max_in_flight` sink
+    calls run concurrently so a slow write does not hold the clock. When the
+    sinks fall behind the scheduler waits, and the lateness of each tick is
+    reported by `run`.
+    """
+
+    def __init__(self, stream: ReplayStream, sink: Callable[[ReplayBatch], Optional[Awaitable]],
+                 speed: float = DEFAULT_SPEED, tick: float = DEFAULT_TICK, start=None, end=None,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        if speed <= 0 or tick <= 0:
+            raise ValueError("speed and tick must be positive")
+        self.stream = stream
+        self.sink = sink
+        self.speed = speed
+        self.tick = tick
+        self.start = _instant(start)
+        self.end = _instant(end)
+        self.max_in_flight = max_in_flight
+        self._stopped = False
+
+    def __repr__(self):
+        return f"ReplayEngine x{self.speed:g} every {self.tick:g}s over {self.stream}"
+
+    def stop(self):
+        """End the replay after the current tick"""
+        self._stopped = True
+
+    async def _deliver(self, batch: ReplayBatch, slots: asyncio.Semaphore, stats: Dict):
+        try:
+            result = self.sink(batch)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            stats["failed_batches"] += 1
+            if len(stats["errors"]) < 10:
+                stats["errors"].append(f"{type(e).__name__}: {e}")
+        finally:
+            slots.release()
+
+    async def run(self, duration: float = None) -> Dict:
+        """Replay until the end of the stream (or for `duration` wall-clock seconds)
+
+        Returns the number of ticks, batches, points and ended flights, the
+        replayed event span, and the tick lateness (s) behind the schedule.
+        """
+        stream = self.stream
+        stats = {
+            "ticks": 0, "batches": 0, "points": 0, "flights_ended": 0,
+            "failed_batches": 0, "errors": [], "event_span_s": 0.0,
+        }
+        lateness = []
+        if len(stream) == 0:
+            return stats
+
+        loop = asyncio.get_running_loop()
+        # Event time is handled in integer nanoseconds so window edges match the points exactly
+        event_start = stream.times[0] if self.start is None else self.start
+        event_end = stream.times[-1] if self.end is None else self.end
+        step = np.timedelta64(int(round(self.tick * self.speed * 1e9)), "ns")
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        position = int(np.searchsorted(stream.times, event_start, "left"))
+        ended = int(np.searchsorted(stream.sorted_ends, event_start, "left"))
+        horizon = event_start
+        self._stopped = False
+
+        wall_start = loop.time()
+        k = 0
+        while not self._stopped:
+            k += 1
+            deadline = wall_start + k * self.tick
+            if duration is not None and deadline - wall_start > duration:
+                break
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lateness.append(max(loop.time() - deadline, 0.0))
+
+            window_end = min(event_start + k * step, event_end)
+            stop = int(np.searchsorted(stream.times, window_end, "right"))
+            ended_stop = int(np.searchsorted(stream.sorted_ends, window_end, "right"))
+            batch = ReplayBatch(stream, position, stop, horizon, window_end,
+                                stream.end_order[ended:ended_stop])
+            stats["ticks"] += 1
+            if len(batch) or len(batch.ended):
+                # Waits here only when max_in_flight deliveries are still running
+                await slots.acquire()
+                task = asyncio.create_task(self._deliver(batch, slots, stats))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                stats["batches"] += 1
+                stats["points"] += len(batch)
+                stats["flights_ended"] += len(batch.ended)
+            position, ended, horizon = stop, ended_stop, window_end
+            if window_end >= event_end:
+                break
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = loop.time() - wall_start
+        lateness = np.array(lateness)
+        stats["event_span_s"] = float((horizon - event_start) / np.timedelta64(1, "s"))
+        stats["elapsed_s"] = elapsed
+        stats["effective_speed"] = stats["event_span_s"] / elapsed if elapsed > 0 else None
+        stats["points_per_s"] = stats["points"] / elapsed if elapsed > 0 else None
+        for p in LATENESS_PERCENTILES:
+            stats[f"lateness_p{p}_s"] = float(np.percentile(lateness, p)) if len(lateness) else None
+        stats["lateness_max_s"] = float(lateness.max()) if len(lateness) else None
+        return stats
+
+
+class GrafanaReplaySink:
+    """Replay sink writing to the databases of a GrafanaExporter
+
+    Points go to the exporter's InfluxLineWriter as they are released; the
+    summary of each flight is upserted once its last point was replayed.
+    Both calls run in worker threads so the event loop keeps its timing.
+    """
+
+    def __init__(self, exporter, measurement: str = "trajectory"):
+        self.exporter = exporter
+        self.measurement = measurement
+
+    def __repr__(self):
+        return f"GrafanaReplaySink to {self.exporter}"
+
+    def _write_points(self, batch: ReplayBatch):
+        writer = self.exporter.influx_writer
+        if writer is not None:
+            writer.write(batch.lines(self.measurement, writer.precision))
+
+    def _write_summaries(self, batch: ReplayBatch):
+        sink = self.exporter.metadata_sink
+        if sink is not None:
+            sources = batch.stream.sources
+            sink.write(MetadataBuffer(sources[i].get_flight_summary() for i in batch.ended))
+
+    async def __call__(self, batch: ReplayBatch):
+        if len(batch):
+            await asyncio.to_thread(self._write_points, batch)
+        if len(batch.ended) and batch.stream.sources:
+            await asyncio.to_thread(self._write_summaries, batch)
@@ -0,0 +1,179 @@
+# %%
+# Per-aircraft state vectors
+# Each Mode S message carries only some fields (position, altitude, velocity
+# or identification); the assembler merges them into one dense state vector
+# per aircraft and time step, forgetting values older than a staleness limit.
+
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from adsb_decoding import epoch_seconds, last_valid_index
+
+# Fields carried forward from message to message
+STATE_FIELDS = (
+    "callsign",
+    "latitude",
+    "longitude",
+    "altitude",
+    "vertical_rate",
+    "groundspeed",
+    "track",
+    "squawk",
+)
+
+# Default time step (seconds) and staleness limit (seconds)
+DEFAULT_STEP = 1.0
+DEFAULT_STALENESS = 30.0
+
+
+def staleness_limit(staleness: Union[float, Dict[str, float]], field: str) -> float:
+    """Staleness limit of one field, given a single limit or a per-field dict"""
+    if isinstance(staleness, dict):
+        return staleness.get(field, DEFAULT_STALENESS)
+    return staleness
+
+
+def assemble_state_vectors(
+    data: pd.DataFrame,
+    step: Optional[float] = DEFAULT_STEP,
+    staleness: Union[float, Dict[str, float]] = DEFAULT_STALENESS,
+    fields: Sequence[str] = STATE_FIELDS,
+) -> pd.DataFrame:
+    """Return one dense state vector per aircraft and time step
+
+    Every field holds its last value received at most `staleness` seconds
+    before the last message of the step, NaN otherwise; `staleness` may be
+    a dict of per-field limits. With `step=None` one state vector is
+    returned per message.
+    """
+    fields = [field for field in fields if field in data.columns]
+    if len(data) == 0:
+        return pd.DataFrame(columns=["icao24", "timestamp", *fields])
+
+    group = pd.factorize(data["icao24"].to_numpy())[0]
+    ts = epoch_seconds(data["timestamp"])
+    order = np.lexsort((ts, group))
+    group, ts = group[order], ts[order]
+    sorted_data = data.iloc[order]
+
+    if step is None:
+        keep = np.ones(len(order), dtype=bool)
+        step_start = ts
+    else:
+        bucket = np.floor(ts / step)
+        keep = np.ones(len(order), dtype=bool)
+        keep[:-1] = (group[1:] != group[:-1]) | (bucket[1:] != bucket[:-1])
+        step_start = bucket * step
+    keep &= group >= 0
+
+    states = {
+        "icao24": sorted_data["icao24"].to_numpy()[keep],
+        "timestamp": pd.to_datetime(step_start[keep], unit="s"),
+    }
+    for field in fields:
+        column = sorted_data[field]
+        last = last_valid_index(column.notna().to_numpy(), group)[keep]
+        age = ts[keep] - ts[np.maximum(last, 0)]
+        fresh = (last >= 0) & (age <= staleness_limit(staleness, field))
+        values = column.take(np.maximum(last, 0)).reset_index(drop=True)
+        states[field] = values.where(fresh)
+
+    result = pd.DataFrame(states)
+    if isinstance(data["icao24"].dtype, pd.CategoricalDtype):
+        result["icao24"] = result["icao24"].astype("category")
+    return result
+
+
+class StateVectorAssembler:
+    """Streaming version of `assemble_state_vectors`, fed message by message
+
+    `update` returns the completed state vector of the previous time step
+    of an aircraft when one of its messages opens a new step, and `flush`
+    the steps already over at `now` (or every open step with `now=None`).
+    A step is emitted once, unless messages for it arrive after it was
+    flushed, so for time-ordered messages the updates followed by a final
+    `flush()` emit the same rows as batch mode.
+    """
+
+    def __init__(
+        self,
+        step: float = DEFAULT_STEP,
+        staleness: Union[float, Dict[str, float]] = DEFAULT_STALENESS,
+        fields: Sequence[str] = STATE_FIELDS,
+    ):
+        self.step = step
+        self.staleness = staleness
+        self.fields = list(fields)
+        self._aircraft: Dict[str, Dict] = {}
+
+    def __len__(self):
+        return len(self._aircraft)
+
+    @staticmethod
+    def _epoch(timestamp) -> float:
+        if isinstance(timestamp, (pd.Timestamp, np.datetime64)):
+            return pd.Timestamp(timestamp).value / 1e9
+        return float(timestamp)
+
+    def _snapshot(self, icao24: str, aircraft: Dict, now: float) -> Dict:
+        state = {
+            "icao24": icao24,
+            "timestamp": pd.Timestamp(aircraft["bucket"] * self.step, unit="s"),
+        }
+        for field in self.fields:
+            value, seen = aircraft["values"].get(field, (None, None))
+            fresh = seen is not None and now - seen <= staleness_limit(self.staleness, field)
+            state[field] = value if fresh else np.nan
+        return state
+
+    def update(self, message: Dict) -> Optional[Dict]:
+        """Add one message; return the state vector of a completed step, if any"""
+        icao24 = message.get("icao24")
+        if icao24 is None:
+            return None
+
+        now = self._epoch(message["timestamp"])
+        bucket = np.floor(now / self.step)
+        aircraft = self._aircraft.setdefault(
+            icao24, {"values": {}, "bucket": bucket, "last_seen": now, "pending": False}
+        )
+
+        completed = None
+        if bucket != aircraft["bucket"]:
+            if aircraft["pending"]:
+                completed = self._snapshot(icao24, aircraft, aircraft["last_seen"])
+            aircraft["bucket"] = bucket
+
+        for field in self.fields:
+            value = message.get(field)
+            if value is not None and value == value:
+                aircraft["values"][field] = (value, now)
+        aircraft["last_seen"] = now
+        aircraft["pending"] = True
+        return completed
+
+    def state(self, icao24: str, now=None) -> Optional[Dict]:
+        """Current state vector of one aircraft, with staleness applied at `now`"""
+        aircraft = self._aircraft.get(icao24)
+        if aircraft is None:
+            return None
+        now = aircraft["last_seen"] if now is None else self._epoch(now)
+        return self._snapshot(icao24, aircraft, now)
+
+    def flush(self, now=None) -> List[Dict]:
+        """Emit the steps over at `now` (all open steps if None) and forget aircraft silent for too long"""
+        now = None if now is None else self._epoch(now)
+        current = None if now is None else np.floor(now / self.step)
+        states = []
+        for icao24, aircraft in list(self._aircraft.items()):
+            if aircraft["pending"] and (current is None or aircraft["bucket"] < current):
+                states.append(self._snapshot(icao24, aircraft, aircraft["last_seen"]))
+                aircraft["pending"] = False
+            silent = None if now is None else now - aircraft["last_seen"]
+            if silent is not None and not aircraft["pending"] and all(
+                silent > staleness_limit(self.staleness, field) for field in self.fields
+            ):
+                del self._aircraft[icao24]
+        return states
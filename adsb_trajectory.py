@@ -0,0 +1,243 @@
+# %%
+# Trajectory simplification and resampling
+# Douglas-Peucker run on all flights at once: every iteration handles all the
+# open segments of all flights with NumPy, instead of recursing per flight.
+# Resampling interpolates every flight onto a regular time grid in one pass
+# over the sorted message array.
+
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from adsb_decoding import epoch_seconds
+
+# Default tolerance (metres) and maximum time between kept points (seconds)
+DEFAULT_TOLERANCE = 25.0
+DEFAULT_MAX_GAP = 60.0
+
+# Fields interpolated by the resampler, default grid step and longest gap
+# (seconds) between two messages that is still interpolated
+RESAMPLE_FIELDS = ("latitude", "longitude", "altitude", "vertical_rate")
+DEFAULT_RESAMPLE_STEP = 5.0
+DEFAULT_RESAMPLE_GAP = 30.0
+
+
+def _point_segment_distance(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distance of each point to the segment [a, b] of the same row"""
+    ab = b - a
+    ap = points - a
+    length2 = np.einsum("ij,ij->i", ab, ab)
+    t = np.einsum("ij,ij->i", ap, ab) / np.where(length2 > 0, length2, 1)
+    t = np.clip(np.where(length2 > 0, t, 0), 0, 1)
+    return np.linalg.norm(ap - t[:, None] * ab, axis=1)
+
+
+def simplify_mask(
+    coords: np.ndarray,
+    group: Optional[np.ndarray] = None,
+    tolerance: float = DEFAULT_TOLERANCE,
+    times: Optional[np.ndarray] = None,
+    max_gap: Optional[float] = None,
+) -> np.ndarray:
+    """Boolean mask of the points kept by Douglas-Peucker simplification
+
+    `coords` is an (n, d) array of metric coordinates (x, y and optionally
+    altitude), sorted by `group` (one flight per value) and time. The first
+    and last point of every flight are kept, as is every point farther than
+    `tolerance` from the simplified line. With `times` and `max_gap`, kept
+    points are never more than `max_gap` seconds apart unless the original
+    trajectory already had such a gap.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.ndim == 1:
+        coords = coords[:, None]
+    n = len(coords)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    group = np.zeros(n, dtype=np.int64) if group is None else np.asarray(group)
+    time_aware = times is not None and max_gap is not None
+    if time_aware:
+        times = np.asarray(times, dtype=np.float64)
+
+    new_flight = np.r_[True, group[1:] != group[:-1]]
+    keep |= new_flight
+    keep[np.r_[np.flatnonzero(new_flight)[1:] - 1, n - 1]] = True
+    if time_aware:
+        gap = np.diff(times) > max_gap
+        keep[:-1] |= gap
+        keep[1:] |= gap
+
+    kept = np.flatnonzero(keep)
+    start, end = kept[:-1], kept[1:]
+    open_segments = (end - start > 1) & (group[start] == group[end])
+    start, end = start[open_segments], end[open_segments]
+
+    while len(start):
+        # Interior points of every open segment, laid out segment after segment
+        lengths = end - start - 1
+        offsets = np.cumsum(lengths) - lengths
+        segment = np.repeat(np.arange(len(start)), lengths)
+        idx = np.arange(lengths.sum()) - offsets[segment] + start[segment] + 1
+
+        dist = _point_segment_distance(coords[idx], coords[start[segment]], coords[end[segment]])
+        worst = np.maximum.reduceat(dist, offsets)
+        farthest = np.minimum.reduceat(np.where(dist == worst[segment], idx, n), offsets)
+
+        split = worst > tolerance
+        split_at = farthest
+        if time_aware:
+            too_long = ~split & (times[end] - times[start] > max_gap)
+            split_at = np.where(too_long, (start + end) // 2, farthest)
+            split |= too_long
+
+        split_at = split_at[split]
+        keep[split_at] = True
+        start = np.r_[start[split], split_at]
+        end = np.r_[split_at, end[split]]
+        longer = end - start > 1
+        start, end = start[longer], end[longer]
+
+    return keep
+
+
+def compression_ratio(n_before: int, n_after: int) -> float:
+    """Number of original points per kept point"""
+    return n_before / n_after if n_after else float("nan")
+
+
+class ResampledTrajectories:
+    """Flights on a regular time grid, stored as flat arrays plus offsets
+
+    Flight i covers grid rows offsets[i]:offsets[i + 1] of `times` (epoch
+    seconds) and of each float32 array in `columns`; `flights` holds one
+    row of keys (icao24, callsign) per flight. NaN marks grid points inside
+    gaps longer than the resampler's `max_gap`.
+    """
+
+    def __init__(
+        self,
+        times: np.ndarray,
+        offsets: np.ndarray,
+        columns: Dict[str, np.ndarray],
+        flights: pd.DataFrame,
+        step: float,
+    ):
+        self.times = times
+        self.offsets = offsets
+        self.columns = columns
+        self.flights = flights
+        self.step = step
+
+    def __repr__(self):
+        return (
+            f"ResampledTrajectories with {len(self)} flights, {len(self.times)} points "
+            f"every {self.step}s ({self.nbytes / 1e6:.1f} MB)"
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return self.times.nbytes + sum(values.nbytes for values in self.columns.values())
+
+    def flight(self, i: int) -> Dict[str, np.ndarray]:
+        """Array views of one flight (no copy)"""
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        arrays = {"time": self.times[start:stop]}
+        arrays.update({name: values[start:stop] for name, values in self.columns.items()})
+        return arrays
+
+    def to_frame(self) -> pd.DataFrame:
+        """All flights as one DataFrame with a `flight` column"""
+        frame = pd.DataFrame({
+            "flight": np.repeat(np.arange(len(self)), np.diff(self.offsets)),
+            "timestamp": pd.to_datetime(self.times, unit="s"),
+            **self.columns,
+        })
+        for key in self.flights.columns:
+            frame[key] = self.flights[key].to_numpy()[frame["flight"].to_numpy()]
+        return frame
+
+
+def resample_trajectories(
+    data: pd.DataFrame,
+    offsets: np.ndarray,
+    step: float = DEFAULT_RESAMPLE_STEP,
+    max_gap: float = DEFAULT_RESAMPLE_GAP,
+    fields: Sequence[str] = RESAMPLE_FIELDS,
+    key_columns: Sequence[str] = ("icao24", "callsign"),
+) -> ResampledTrajectories:
+    """Linearly interpolate every flight onto a grid of `step` seconds
+
+    `data` is sorted by flight and time, flight i being rows
+    offsets[i]:offsets[i + 1] (as returned by `segment_flights`). Each
+    field is interpolated between its own surrounding valid values
+    (latitude and longitude together), only when they are at most
+    `max_gap` seconds apart. Grid points are multiples of `step` within
+    each flight's time span.
+    """
+    fields = [field for field in fields if field in data.columns]
+    n_flights = len(offsets) - 1
+    ts = epoch_seconds(data["timestamp"])
+    origin = ts.min() if len(ts) else 0.0
+    ts = ts - origin
+
+    # Grid of every flight, laid out flight after flight
+    first, last = offsets[:-1], offsets[1:] - 1
+    grid_start = np.ceil((ts[first] + origin) / step) if n_flights else np.zeros(0)
+    grid_stop = np.floor((ts[last] + origin) / step) if n_flights else np.zeros(0)
+    counts = np.maximum(grid_stop - grid_start + 1, 0).astype(np.int64)
+    grid_offsets = np.append(0, np.cumsum(counts)).astype(np.int64)
+    grid_flight = np.repeat(np.arange(n_flights), counts)
+    grid_index = np.arange(grid_offsets[-1]) - grid_offsets[grid_flight]
+    times = (grid_start[grid_flight] + grid_index) * step
+    grid_ts = times - origin
+
+    # Sort keys combining flight number and time, so one searchsorted
+    # finds the surrounding samples of every grid point of every flight
+    span = (ts.max() if len(ts) else 0.0) + 2 * step + 1
+    row_flight = np.repeat(np.arange(n_flights), np.diff(offsets))
+    grid_key = grid_flight * span + grid_ts
+
+    columns = {}
+    groups = [("latitude", "longitude")] if {"latitude", "longitude"}.issubset(fields) else []
+    groups += [(field,) for field in fields if field not in ("latitude", "longitude")]
+    for group in groups:
+        values = [pd.to_numeric(data[field], errors="coerce").to_numpy(np.float64) for field in group]
+        valid = np.flatnonzero(np.logical_and.reduce([~np.isnan(v) for v in values]))
+        if len(valid) == 0:
+            for field in group:
+                columns[field] = np.full(len(times), np.nan, dtype=np.float32)
+            continue
+        key = row_flight[valid] * span + ts[valid]
+
+        right = np.searchsorted(key, grid_key, side="left")
+        left = right - 1
+        right_ok = right < len(valid)
+        right = np.minimum(right, len(valid) - 1)
+        left_ok = left >= 0
+        left = np.maximum(left, 0)
+        same = (
+            left_ok & right_ok
+            & (row_flight[valid[left]] == grid_flight)
+            & (row_flight[valid[right]] == grid_flight)
+        )
+        t_left, t_right = ts[valid[left]], ts[valid[right]]
+        exact = right_ok & (row_flight[valid[right]] == grid_flight) & (t_right == grid_ts)
+        usable = (same & (t_right - t_left <= max_gap)) | exact
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(t_right > t_left, (grid_ts - t_left) / (t_right - t_left), 1.0)
+
+        for field, v in zip(group, values):
+            interpolated = v[valid[left]] + weight * (v[valid[right]] - v[valid[left]])
+            interpolated = np.where(exact, v[valid[right]], interpolated)
+            columns[field] = np.where(usable, interpolated, np.nan).astype(np.float32)
+
+    flights = pd.DataFrame({
+        key: data[key].to_numpy()[first] for key in key_columns if key in data.columns
+    })
+    ordered = {field: columns[field] for field in fields}
+    return ResampledTrajectories(times, grid_offsets, ordered, flights, step)
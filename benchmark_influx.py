@@ -0,0 +1,193 @@
+"""Benchmark de l'écriture InfluxDB contre un serveur HTTP local qui enregistre les requêtes
+
+Compare l'ancienne écriture (une ligne construite par iterrows, une requête
+synchrone par vol) à InfluxLineWriter (line protocol par colonnes, lots en
+arrière-plan), puis vérifie pour chaque méthode que le serveur a reçu
+exactement les points envoyés, en autant de requêtes que de lots comptés,
+y compris quand il rejette une partie des requêtes (503 puis reprise).
+Toute différence lève AssertionError.
+
+    python benchmark_influx.py [fichier.jsonl.gz] [taux d'échec]
+"""
+import http.client
+import math
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from adsb_influx import DEFAULT_BATCH_SIZE, InfluxLineWriter, trajectory_lines
+from ILEMS2025_ECE_6ILM4_TA_Bleicher_Cusseau_GRAFANA import FlightCollectionGrafana
+
+
+class RecordingInflux(ThreadingHTTPServer):
+    """Faux /api/v2/write : garde les lignes reçues, rejette une requête sur `1 / failure_rate` avec 503"""
+
+    daemon_threads = True
+
+    def __init__(self, failure_rate=0.0, latency=0.0):
+        super().__init__(("127.0.0.1", 0), RecordingHandler)
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.lines = []
+        self.requests = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.lines, self.requests, self.rejected = [], 0, 0
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            fail = server.failure_rate and server.requests % round(1 / server.failure_rate) == 0
+            if fail:
+                server.rejected += 1
+            else:
+                server.lines.extend(body.decode("utf-8").split("\n"))
+        if fail:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+        else:
+            self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def per_row_lines(flight_id, trajectory):
+    """Lignes de l'ancienne méthode, construites une par une avec iterrows"""
+    lines = []
+    for _, row in trajectory.iterrows():
+        lines.append(
+            f"trajectory,flight_id={flight_id},icao24={row.get('icao24', '')},"
+            f"callsign={row.get('callsign', '')} latitude={float(row['latitude'])},"
+            f"longitude={float(row['longitude'])},altitude={float(row.get('altitude', 0))},"
+            f"vertical_rate={float(row.get('vertical_rate', 0))} "
+            f"{int(row['timestamp'].value // 10**6)}"
+        )
+    return lines
+
+
+def write_per_row(server, trajectories):
+    """Ancienne méthode : une ligne par iterrows, une requête synchrone par vol"""
+    for flight_id, trajectory in trajectories:
+        lines = per_row_lines(flight_id, trajectory)
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        connection.request("POST", "/api/v2/write?precision=ms", body="\n".join(lines).encode("utf-8"))
+        connection.getresponse().read()
+        connection.close()
+
+
+def write_batched(server, trajectories, **options):
+    """InfluxLineWriter : lignes construites par colonnes, envoi par lots en arrière-plan"""
+    with InfluxLineWriter(server.url, "token", "org", "adsb-trajectories", **options) as writer:
+        for flight_id, trajectory in trajectories:
+            writer.write_trajectory(trajectory, {"flight_id": flight_id})
+        writer.flush()
+    return writer.stats
+
+
+def write_all_at_once(server, combined, **options):
+    """InfluxLineWriter sur toutes les trajectoires concaténées (flight_id en colonne)"""
+    with InfluxLineWriter(server.url, "token", "org", "adsb-trajectories", **options) as writer:
+        writer.write_trajectory(combined, {"flight_id": combined["flight_id"].to_numpy()})
+        writer.flush()
+    return writer.stats
+
+
+def check_received(server, expected, stats=None, batch_size=None, requests=None):
+    """Lève AssertionError si les lignes, les lots ou les reprises ne sont pas ceux attendus"""
+    received = sorted(server.lines)
+    if received != sorted(expected):
+        raise AssertionError(f"{len(received)} lignes reçues, {len(expected)} attendues")
+    accepted = server.requests - server.rejected
+    if requests is not None and accepted != requests:
+        raise AssertionError(f"{accepted} requêtes acceptées, {requests} attendues")
+    if stats is None:
+        return
+    if stats["points_written"] != len(expected) or stats["points_failed"]:
+        raise AssertionError(
+            f"{stats['points_written']} points écrits et {stats['points_failed']} perdus, "
+            f"{len(expected)} attendus sans perte"
+        )
+    if stats["batches"] != accepted or stats["batches"] < math.ceil(len(expected) / batch_size):
+        raise AssertionError(
+            f"{stats['batches']} lots comptés pour {accepted} requêtes acceptées "
+            f"(au moins {math.ceil(len(expected) / batch_size)} attendus)"
+        )
+    if stats["retries"] != server.rejected:
+        raise AssertionError(f"{stats['retries']} reprises pour {server.rejected} requêtes rejetées")
+
+
+def main(filename="adsb25/montsouris.jsonl.gz", failure_rate=0.2, repeat=20):
+    collection = FlightCollectionGrafana.read_jsonl_gz(filename)
+    flights = [flight for flight in collection.filter_by_icao24_only() if flight.has_valid_trajectory()]
+    trajectories = [(flight.flight_id, flight.get_trajectory()) for flight in flights] * repeat
+    expected = [
+        line for flight_id, trajectory in trajectories
+        for line in trajectory_lines(trajectory, {"flight_id": flight_id})
+    ]
+    combined = pd.concat(
+        [trajectory.assign(flight_id=flight_id) for flight_id, trajectory in trajectories], ignore_index=True
+    )
+    n_points = len(combined)
+    per_row = [
+        line for flight_id, trajectory in trajectories for line in per_row_lines(flight_id, trajectory)
+    ]
+    print(f"{filename}: {len(flights)} vols x {repeat} = {n_points} points")
+
+    server = RecordingInflux()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        print(f"{'méthode':<30} {'temps (s)':>10} {'points/s':>12} {'requêtes':>9}")
+        for name, write in (
+            ("par ligne, requête par vol", lambda: write_per_row(server, trajectories)),
+            ("InfluxLineWriter, par vol", lambda: write_batched(server, trajectories)),
+            ("InfluxLineWriter, un appel", lambda: write_all_at_once(server, combined)),
+        ):
+            server.reset()
+            start = time.perf_counter()
+            stats = write()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<30} {elapsed:>10.3f} {n_points / elapsed:>12,.0f} {server.requests:>9}")
+            if stats is None:
+                check_received(server, per_row, requests=len(trajectories))
+            else:
+                check_received(server, expected, stats, DEFAULT_BATCH_SIZE)
+
+        # Reprise sur erreur : une requête sur 1 / failure_rate reçoit 503
+        server.reset()
+        server.failure_rate = float(failure_rate)
+        stats = write_batched(server, trajectories, batch_size=500, retry_interval=0.01)
+        print(
+            f"Avec {server.rejected} requêtes rejetées (503): {stats['retries']} reprises, "
+            f"{stats['points_written']} points écrits, {stats['points_failed']} perdus"
+        )
+        if not server.rejected:
+            raise AssertionError(f"Aucune requête rejetée avec un taux d'échec de {failure_rate}")
+        check_received(server, expected, stats, 500)
+        print("Toutes les lignes attendues ont été reçues une seule fois, lots et reprises cohérents")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,61 @@
+"""Benchmark des décodeurs JSON sur adsb25/montsouris.jsonl.gz"""
+import gzip
+import sys
+import time
+
+from adsb_ingest import DEFAULT_BLOCK_SIZE, JOINED_BACKENDS, JSON_BACKENDS, JsonDecoder, iter_line_blocks
+
+
+def time_per_line(raw_lines, backend, repeat):
+    """Décodage ligne par ligne (ancienne boucle de read_jsonl_gz)"""
+    loads = JSON_BACKENDS[backend]
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = []
+        malformed = 0
+        for line in raw_lines:
+            try:
+                records.append(loads(line))
+            except ValueError:
+                malformed += 1
+        best = min(best, time.perf_counter() - start)
+    return best, malformed
+
+
+def time_blocks(blocks, backend, repeat, joined):
+    """Décodage par blocs décompressés entiers, ligne par ligne ou en un seul tableau JSON"""
+    best = float("inf")
+    for _ in range(repeat):
+        decoder = JsonDecoder(backend, joined=joined)
+        start = time.perf_counter()
+        for lines in blocks:
+            decoder.decode_block(lines)
+        best = min(best, time.perf_counter() - start)
+    return best, decoder.malformed
+
+
+def main(filename="adsb25/montsouris.jsonl.gz", repeat=5, block_size=DEFAULT_BLOCK_SIZE):
+    with gzip.open(filename, "rb") as f:
+        blocks = list(iter_line_blocks(f, block_size))
+    raw_lines = [line for lines in blocks for line in lines]
+    print(f"{filename}: {len(raw_lines)} lignes, {len(blocks)} blocs de {block_size} octets")
+    print(f"{'backend':<10} {'mode':<12} {'temps (s)':>10} {'lignes/s':>12} {'invalides':>10}")
+
+    for backend in JSON_BACKENDS:
+        default = "bloc joint" if backend in JOINED_BACKENDS else "bloc ligne"
+        for mode, bench, data in (
+            ("ligne", time_per_line, raw_lines),
+            ("bloc ligne", lambda data, backend, repeat: time_blocks(data, backend, repeat, False), blocks),
+            ("bloc joint", lambda data, backend, repeat: time_blocks(data, backend, repeat, True), blocks),
+        ):
+            elapsed, malformed = bench(data, backend, repeat)
+            print(
+                f"{backend:<10} {mode:<12} {elapsed:>10.4f} "
+                f"{len(raw_lines) / elapsed:>12,.0f} {malformed:>10}"
+                f"{'  (défaut)' if mode == default else ''}"
+            )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
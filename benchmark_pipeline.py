@@ -0,0 +1,261 @@
+"""Benchmark du pipeline lecture → segmentation → classification → projection → export
+
+Génère des captures ADS-B synthétiques de taille choisie à partir des messages
+de adsb25/montsouris.jsonl.gz, mesure chaque étape (temps, messages/s, pic
+mémoire) et ajoute les résultats à un fichier JSONL pour comparer les runs.
+
+    python benchmark_pipeline.py --messages 14288 100000 500000
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from adsb_cache import DEFAULT_CACHE_DIR
+from adsb_ingest import JsonDecoder, iter_line_blocks
+from ILEMS2025_ECE_6ILM4_TA_Bleicher_Cusseau_GRAFANA import FlightCollectionGrafana, trajectories_to_csv
+
+SOURCE = "adsb25/montsouris.jsonl.gz"
+SYNTHETIC_DIR = os.path.join(DEFAULT_CACHE_DIR, "benchmark")
+RESULTS_FILE = "benchmark_pipeline_results.jsonl"
+
+
+def load_templates(source=SOURCE):
+    """Messages décodés de la capture réelle, triés par temps"""
+    decoder = JsonDecoder()
+    with gzip.open(source, "rb") as f:
+        records = [record for lines in iter_line_blocks(f) for record in decoder.decode_block(lines)]
+    return sorted(records, key=lambda record: record["timestamp"])
+
+
+def generate_capture(n_messages, source=SOURCE, directory=SYNTHETIC_DIR, seed=0):
+    """Écrit (une seule fois) une capture synthétique de `n_messages` messages
+
+    La capture réelle est recopiée autant de fois que nécessaire. Chaque copie
+    reçoit de nouvelles adresses icao24 (et indicatifs), un décalage temporel
+    aléatoire de moins d'une heure et un léger décalage des positions : le
+    fichier garde le schéma et la répartition des types de messages de la
+    source, avec plus d'avions simultanés.
+    """
+    path = os.path.join(directory, f"synthetic_{n_messages}_{seed}.jsonl.gz")
+    if os.path.exists(path):
+        return path
+
+    templates = load_templates(source)
+    rng = np.random.default_rng(seed)
+    n_copies = -(-n_messages // len(templates))
+    copies = []
+    for copy in range(n_copies):
+        shift = 0.0 if copy == 0 else float(rng.uniform(0, 3600))
+        dlat, dlon = (0.0, 0.0) if copy == 0 else rng.normal(0, 0.05, 2)
+        prefix = f"{copy:02x}"[-2:]
+        for record in templates[: n_messages - copy * len(templates)]:
+            record = dict(record)
+            record["timestamp"] = record["timestamp"] + shift
+            if copy:
+                if "icao24" in record:
+                    record["icao24"] = prefix + record["icao24"][2:]
+                if record.get("callsign"):
+                    record["callsign"] = record["callsign"][:-2] + prefix.upper()
+                if "latitude" in record:
+                    record["latitude"] += dlat
+                    record["longitude"] += dlon
+                record["metadata"] = [
+                    dict(meta, system_timestamp=meta["system_timestamp"] + shift)
+                    for meta in record.get("metadata", [])
+                ]
+            copies.append(record)
+    copies.sort(key=lambda record: record["timestamp"])
+
+    os.makedirs(directory, exist_ok=True)
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        for record in copies:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def pipeline_stages(path, output_dir):
+    """Étapes mesurées, dans l'ordre; chacune lit et complète le contexte `ctx`"""
+
+    def read(ctx):
+        ctx["collection"] = FlightCollectionGrafana.read_jsonl_gz(path)
+
+    def iterate(ctx):
+        ctx["flights"] = sorted(ctx["collection"])
+
+    def statistics(ctx):
+        ctx["statistics"] = ctx["collection"].get_statistics()
+
+    def landings(ctx):
+        ctx["landings"] = ctx["collection"].filter_landings()
+
+    def takeoffs(ctx):
+        ctx["takeoffs"] = ctx["collection"].filter_takeoffs()
+
+    def geopandas(ctx):
+        ctx["geometries"] = ctx["collection"].to_geopandas("all")
+
+    def csv_export(ctx):
+        for name in ("landings", "takeoffs"):
+            if ctx[name]:
+                trajectories_to_csv(ctx[name], os.path.join(output_dir, f"{name}.csv"))
+
+    def csv_export_all(ctx):
+        # Toutes les trajectoires valides : la capture de Montsouris ne contient
+        # aucun atterrissage ni décollage avec au moins deux positions
+        flights = [flight for flight in ctx["flights"] if flight.has_valid_trajectory()]
+        if flights:
+            trajectories_to_csv(flights, os.path.join(output_dir, "all.csv"))
+
+    return [
+        ("read_jsonl_gz", read),
+        ("iteration", iterate),
+        ("get_statistics", statistics),
+        ("filter_landings", landings),
+        ("filter_takeoffs", takeoffs),
+        ("to_geopandas", geopandas),
+        ("export_csv", csv_export),
+        ("export_csv_all", csv_export_all),
+    ]
+
+
+def run_pipeline(stages, traced=False):
+    """Exécute toutes les étapes sur une collection neuve; temps ou pic mémoire (octets) par étape"""
+    ctx = {}
+    measures = {}
+    for name, stage in stages:
+        if traced:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            stage(ctx)
+            measures[name] = tracemalloc.get_traced_memory()[1] - baseline
+        else:
+            start = time.perf_counter()
+            stage(ctx)
+            measures[name] = time.perf_counter() - start
+    return measures, ctx
+
+
+def benchmark(path, repeat=3):
+    """Meilleur temps sur `repeat` exécutions complètes du pipeline, puis une exécution tracée pour la mémoire
+
+    Chaque exécution repart d'une collection neuve : les caches internes
+    (segmentation, résumé par avion, colonnes projetées) sont donc recalculés
+    dans l'étape qui en a besoin la première, comme lors d'un vrai run.
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        stages = pipeline_stages(path, output_dir)
+        best = {}
+        for _ in range(repeat):
+            elapsed, ctx = run_pipeline(stages)
+            for name, seconds in elapsed.items():
+                best[name] = min(best.get(name, float("inf")), seconds)
+        n_messages = len(ctx["collection"].data)
+        n_flights = len(ctx["flights"])
+
+        tracemalloc.start()
+        try:
+            peaks, _ = run_pipeline(stages, traced=True)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "file": path,
+        "file_bytes": os.path.getsize(path),
+        "messages": n_messages,
+        "flights": n_flights,
+        "repeat": repeat,
+        "stages": [
+            {
+                "stage": name,
+                "seconds": best[name],
+                "messages_per_s": n_messages / best[name] if best[name] > 0 else None,
+                "peak_mb": peaks[name] / 1e6,
+            }
+            for name, _ in stages
+        ],
+    }
+
+
+def run_metadata():
+    """Version du code et de l'environnement, pour comparer les runs entre eux"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def previous_result(results_file, messages):
+    """Dernier résultat enregistré pour la même taille de capture"""
+    if not os.path.exists(results_file):
+        return None
+    previous = None
+    with open(results_file, encoding="utf-8") as f:
+        for line in f:
+            result = json.loads(line)
+            if result.get("messages") == messages:
+                previous = result
+    return previous
+
+
+def print_result(result, previous=None):
+    reference = {stage["stage"]: stage["seconds"] for stage in previous["stages"]} if previous else {}
+    print(f"{result['file']}: {result['messages']} messages, {result['flights']} vols")
+    print(f"{'étape':<18} {'temps (s)':>10} {'messages/s':>13} {'pic (Mo)':>10} {'vs précédent':>13}")
+    for stage in result["stages"]:
+        before = reference.get(stage["stage"])
+        ratio = f"{before / stage['seconds']:.2f}x" if before and stage["seconds"] > 0 else "-"
+        # Étape sans travail (aucun vol sélectionné) : débit non significatif
+        rate = f"{stage['messages_per_s']:,.0f}" if stage["seconds"] > 1e-4 else "-"
+        print(
+            f"{stage['stage']:<18} {stage['seconds']:>10.4f} {rate:>13} "
+            f"{stage['peak_mb']:>10.1f} {ratio:>13}"
+        )
+    total = sum(stage["seconds"] for stage in result["stages"])
+    print(f"{'total':<18} {total:>10.4f} {result['messages'] / total:>13,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, nargs="+", default=[14288, 100_000],
+                        help="tailles des captures synthétiques (nombre de messages)")
+    parser.add_argument("--source", default=SOURCE, help="capture réelle servant de modèle")
+    parser.add_argument("--repeat", type=int, default=3, help="exécutions par taille (meilleur temps)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=RESULTS_FILE, help="fichier JSONL des résultats")
+    args = parser.parse_args()
+
+    metadata = run_metadata()
+    for n_messages in args.messages:
+        path = generate_capture(n_messages, args.source, seed=args.seed)
+        result = dict(metadata, **benchmark(path, args.repeat))
+        print_result(result, previous_result(args.output, result["messages"]))
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        print()
+    print(f"Résultats ajoutés à {args.output}")
+
+
+if __name__ == "__main__":
+    main()
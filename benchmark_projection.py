@@ -0,0 +1,67 @@
+"""Benchmark de la projection Lambert-93 lors de la construction répétée des cartes"""
+import sys
+import time
+
+import pandas as pd
+import pyproj
+from shapely.geometry import LineString, Point
+
+from adsb_geo import LAMBERT93, WGS84, get_transformer, trajectories_to_geodataframes
+from ILEMS2025_ECE_6ILM4_TA_Bleicher_Cusseau_GRAFANA import FlightCollectionGrafana
+
+
+def map_per_flight(flights, shared):
+    """Ancienne méthode: un Transformer (neuf ou partagé) et des Point par vol"""
+    n_points = 0
+    for flight in flights:
+        trajectory = flight.get_trajectory()
+        if len(trajectory) == 0:
+            continue
+        transformer = get_transformer() if shared else pyproj.Transformer.from_crs(
+            WGS84, LAMBERT93, always_xy=True
+        )
+        x, y = transformer.transform(trajectory["longitude"].values, trajectory["latitude"].values)
+        points = [Point(xi, yi) for xi, yi in zip(x, y)]
+        if len(points) > 1:
+            LineString(points)
+        n_points += len(points)
+    return n_points
+
+
+def map_batched(flights_table, group, cached):
+    """Projection par lot, en réutilisant ou non les colonnes x_lambert/y_lambert"""
+    data = flights_table if cached else flights_table.drop(columns=["x_lambert", "y_lambert"])
+    points, lines = trajectories_to_geodataframes(data, group)
+    return 0 if points is None else len(points)
+
+
+def main(filename="adsb25/montsouris.jsonl.gz", n_maps=10):
+    collection = FlightCollectionGrafana.read_jsonl_gz(filename)
+    flights = list(collection.filter_by_icao24_only())
+    flights_table = collection._segment()[0]
+    group = pd.factorize(flights_table["icao24"].to_numpy())[0]
+    print(f"{filename}: {len(flights)} avions, {n_maps} cartes construites par méthode")
+
+    start = time.perf_counter()
+    collection.project()
+    print(f"Projection initiale des colonnes x/y: {time.perf_counter() - start:.4f} s")
+
+    methods = [
+        ("par vol, Transformer neuf", lambda: map_per_flight(flights, shared=False)),
+        ("par vol, Transformer partagé", lambda: map_per_flight(flights, shared=True)),
+        ("lot, reprojection", lambda: map_batched(flights_table, group, cached=False)),
+        ("lot, colonnes en cache", lambda: map_batched(flights_table, group, cached=True)),
+    ]
+    print(f"{'méthode':<32} {'total (s)':>10} {'par carte (s)':>14} {'accélération':>13}")
+    reference = None
+    for name, build in methods:
+        start = time.perf_counter()
+        for _ in range(n_maps):
+            build()
+        elapsed = time.perf_counter() - start
+        reference = reference or elapsed
+        print(f"{name:<32} {elapsed:>10.4f} {elapsed / n_maps:>14.4f} {reference / elapsed:>12.1f}x")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
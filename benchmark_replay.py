@@ -0,0 +1,75 @@
+"""Benchmark du rejeu temps réel (adsb_replay) sur des captures synthétiques
+
+Construit le flux fusionné de tous les vols d'une capture synthétique, puis le
+rejoue à plusieurs facteurs d'accélération vers le faux serveur InfluxDB de
+benchmark_influx.py. Mesure le temps de construction du flux, le débit de
+points et le retard des ticks sur l'horloge murale (p50, p99, max).
+
+    python benchmark_replay.py --messages 500000 --speeds 10 100 1000 --duration 10
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from adsb_influx import InfluxLineWriter
+from adsb_replay import ReplayBatch, ReplayEngine
+from benchmark_influx import RecordingInflux
+from benchmark_pipeline import SOURCE, generate_capture
+from ILEMS2025_ECE_6ILM4_TA_Bleicher_Cusseau_GRAFANA import FlightCollectionGrafana
+
+
+class InfluxSink:
+    """Écrit les points de chaque tick avec un InfluxLineWriter, dans un thread"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    async def __call__(self, batch: ReplayBatch):
+        await asyncio.to_thread(lambda: self.writer.write(batch.lines()))
+
+
+def replay(stream, server, speed, tick, duration):
+    with InfluxLineWriter(server.url, "token", "org", "adsb-trajectories") as writer:
+        engine = ReplayEngine(stream, InfluxSink(writer), speed=speed, tick=tick)
+        stats = asyncio.run(engine.run(duration))
+        writer.flush()
+        stats["points_written"] = writer.stats["points_written"]
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500_000, help="taille de la capture synthétique")
+    parser.add_argument("--source", default=SOURCE, help="capture réelle servant de modèle")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--tick", type=float, default=1.0, help="période des ticks (s)")
+    parser.add_argument("--duration", type=float, default=10.0, help="durée maximale de chaque rejeu (s)")
+    args = parser.parse_args()
+
+    path = generate_capture(args.messages, args.source)
+    collection = FlightCollectionGrafana.read_jsonl_gz(path)
+    start = time.perf_counter()
+    stream = collection.replay_engine().stream
+    print(f"{path}: {stream} construit en {time.perf_counter() - start:.2f}s")
+
+    server = RecordingInflux()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        print(f"{'vitesse':>8} {'ticks':>6} {'points':>8} {'écrits':>8} {'points/s':>10} "
+              f"{'vitesse réelle':>15} {'retard p50 (ms)':>16} {'p99 (ms)':>9} {'max (ms)':>9}")
+        for speed in args.speeds:
+            server.reset()
+            stats = replay(stream, server, speed, args.tick, args.duration)
+            print(
+                f"{speed:>8g} {stats['ticks']:>6} {stats['points']:>8} {stats['points_written']:>8} "
+                f"{stats['points_per_s']:>10,.0f} {stats['effective_speed']:>15.1f} "
+                f"{stats['lateness_p50_s'] * 1000:>16.2f} {stats['lateness_p99_s'] * 1000:>9.2f} "
+                f"{stats['lateness_max_s'] * 1000:>9.2f}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
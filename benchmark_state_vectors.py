@@ -0,0 +1,68 @@
+"""Benchmark et vérification des vecteurs d'état en flux (StateVectorAssembler) contre le mode batch
+
+Rejoue les messages d'une capture dans l'ordre chronologique avec des
+flush() périodiques, puis vérifie que les vecteurs émis (suivis du flush()
+final) sont exactement ceux de assemble_state_vectors sur les mêmes messages.
+
+    python benchmark_state_vectors.py [fichier.jsonl.gz] [période des flush (s)]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from adsb_decoding import decode_cpr_positions
+from adsb_ingest import read_jsonl_gz_typed
+from adsb_state import STATE_FIELDS, StateVectorAssembler, assemble_state_vectors
+
+
+def stream_state_vectors(data, flush_every=10.0, **options):
+    """Vecteurs d'état émis par StateVectorAssembler, avec un flush toutes les `flush_every` secondes"""
+    assembler = StateVectorAssembler(**options)
+    records = data.sort_values("timestamp", kind="stable").to_dict("records")
+    states = []
+    next_flush = None
+    for record in records:
+        now = pd.Timestamp(record["timestamp"])
+        if next_flush is None:
+            next_flush = now + pd.Timedelta(seconds=flush_every)
+        elif now >= next_flush:
+            states.extend(assembler.flush(now))
+            next_flush = now + pd.Timedelta(seconds=flush_every)
+        state = assembler.update(record)
+        if state is not None:
+            states.append(state)
+    states.extend(assembler.flush())
+    return pd.DataFrame(states)
+
+
+def main(filename="adsb25/montsouris.jsonl.gz", flush_every=10.0):
+    data = decode_cpr_positions(read_jsonl_gz_typed(filename))
+    fields = [field for field in STATE_FIELDS if field in data.columns]
+    data = data[data["icao24"].notna()]
+    data = data.assign(icao24=data["icao24"].astype(str))
+
+    start = time.perf_counter()
+    batch = assemble_state_vectors(data, fields=fields)
+    batch_s = time.perf_counter() - start
+    start = time.perf_counter()
+    streamed = stream_state_vectors(data, float(flush_every), fields=fields)
+    stream_s = time.perf_counter() - start
+    print(f"{filename}: {len(data)} messages, {len(batch)} vecteurs d'état")
+    print(f"batch {batch_s:.3f}s, flux {stream_s:.3f}s ({len(data) / stream_s:,.0f} messages/s)")
+
+    keys = ["icao24", "timestamp"]
+    batch = batch.sort_values(keys).reset_index(drop=True)
+    streamed = streamed.sort_values(keys).reset_index(drop=True)[batch.columns]
+    if streamed.duplicated(keys).any():
+        raise AssertionError(f"{int(streamed.duplicated(keys).sum())} pas émis plusieurs fois")
+    for column in fields:
+        batch[column] = batch[column].astype(object).where(batch[column].notna(), np.nan)
+        streamed[column] = streamed[column].astype(object).where(streamed[column].notna(), np.nan)
+    pd.testing.assert_frame_equal(streamed, batch, check_dtype=False)
+    print(f"Flux avec flush toutes les {flush_every}s identique au mode batch")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
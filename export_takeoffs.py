@@ -2,7 +2,13 @@
 import sys
 sys.path.insert(0, r'c:\Users\ncuss\Documents\GitHub\pyclass\TP_FINAL')
 
+from adsb_checkpoint import ExportCheckpoint, csv_sink
 from ILEMS2025_ECE_6ILM4_TA_Bleicher_Cusseau_GRAFANA import export_takeoffs_csv
 
 if __name__ == "__main__":
-    export_takeoffs_csv()
+    # Export incrémental : le CSV n'est réécrit que si des vols ont changé
+    # depuis le dernier lancement (--full pour tout réexporter)
+    checkpoint = ExportCheckpoint()
+    if "--full" in sys.argv[1:]:
+        checkpoint.reset(csv_sink('takeoffs_trajectory_for_grafana.csv'))
+    export_takeoffs_csv(checkpoint)